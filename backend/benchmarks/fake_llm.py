@@ -0,0 +1,89 @@
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+import logging
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+def create_fake_openrouter(latency: float, jitter: float, tokens: int, token_rate: float, seed: int) -> FastAPI:
+    """
+    OpenRouter-compatible /chat/completions stand-in. Waits `latency` (+/- jitter)
+    seconds before the first token, then emits `tokens` tokens at `token_rate`
+    tokens per second, either as SSE chunks or as one JSON body.
+    """
+    app = FastAPI()
+    rng = random.Random(seed)
+
+    def first_token_delay() -> float:
+        return max(0.0, latency + rng.uniform(-jitter, jitter))
+
+    def usage(body: dict) -> dict:
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        delay = first_token_delay()
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay + tokens / token_rate)
+            return JSONResponse({
+                "id": "bench",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(["tok"] * tokens)}}],
+                "usage": usage(body)
+            })
+
+        async def stream():
+            await asyncio.sleep(delay)
+            for _ in range(tokens):
+                chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": "tok "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1 / token_rate)
+            yield f"data: {json.dumps({'model': model, 'choices': [], 'usage': usage(body)})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+class FakeOpenRouterServer:
+    """Runs the fake provider with uvicorn on a background thread and an ephemeral port"""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: Optional[int] = None):
+        self.host = host
+        self.port = port or _free_port(host)
+        self._server = uvicorn.Server(uvicorn.Config(app, host=host, port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 10.0):
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake OpenRouter server did not start")
+            time.sleep(0.01)
+        logger.info(f"Fake OpenRouter listening on {self.base_url}")
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+def _free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,247 @@
+"""
+Load and latency benchmark for the API.
+
+Runs the app in-process against a local mongod (--mongo-url) or an in-memory
+Mongo stand-in (requires mongomock-motor), with a local fake OpenRouter server
+in place of the real provider. Alternatively --target benchmarks an already
+running deployment. Run from the backend directory:
+
+    python -m benchmarks.run --concurrency 1,8,32 --duration 20 --mix chat=5,crud=3,workflow=2
+    python -m benchmarks.run --save-baseline          # record benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --max-regression 0.15
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_llm import create_fake_openrouter, FakeOpenRouterServer
+from benchmarks.scenarios import SCENARIOS, Recorder, BenchState, seed
+
+logger = logging.getLogger("benchmarks")
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="Benchmark a running server at this base URL instead of in-process")
+    parser.add_argument("--mongo-url", help="Local mongod for the in-process app; in-memory stand-in if omitted")
+    parser.add_argument("--db-name", default="benchmark", help="Use a scratch database; fixtures are left behind")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=5,crud=3,workflow=2"))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before each level")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--agents", type=int, default=10)
+    parser.add_argument("--workflows", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake provider seconds to first token")
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--llm-tokens", type=int, default=64, help="Completion tokens per fake response")
+    parser.add_argument("--llm-token-rate", type=float, default=200, help="Fake provider tokens per second")
+    parser.add_argument("--output", type=Path, help="Write the full JSON report here")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="Allowed fractional p95/throughput regression before exiting non-zero")
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    return args
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    operations = {}
+    total = 0
+    for op in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = sorted(recorder.latencies.get(op, []))
+        total += len(values)
+        operations[op] = {
+            "count": len(values),
+            "errors": dict(recorder.errors.get(op, {})),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": (values[-1] if values else 0.0) * 1000,
+            "throughput": len(values) / elapsed if elapsed else 0.0
+        }
+    return {"duration": elapsed, "throughput": total / elapsed if elapsed else 0.0, "operations": operations}
+
+async def run_level(
+    client: httpx.AsyncClient,
+    state: BenchState,
+    args: argparse.Namespace,
+    concurrency: int
+) -> Dict[str, Any]:
+    recorder = Recorder()
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    stop_at = time.monotonic() + args.warmup + args.duration
+    measure_from = time.monotonic() + args.warmup
+
+    async def worker(index: int):
+        # Per-worker generators keep the operation sequence reproducible for a given seed
+        rng = random.Random(args.seed * 1000 + concurrency * 100 + index)
+        worker_state: Dict[str, Any] = {}
+        while time.monotonic() < stop_at:
+            recorder.enabled = time.monotonic() >= measure_from
+            scenario = SCENARIOS[rng.choices(names, weights)[0]]
+            try:
+                await scenario(client, state, recorder, rng, worker_state)
+            except httpx.HTTPError:
+                # Already counted by the recorder; keep the load steady
+                await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    return summarize(recorder, args.duration)
+
+def print_report(results: Dict[str, Any]):
+    for level, summary in results["levels"].items():
+        print(f"\nconcurrency={level}  throughput={summary['throughput']:.1f} ops/s")
+        print(f"  {'operation':<26}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>9}")
+        for op, stats in summary["operations"].items():
+            errors = sum(stats["errors"].values())
+            print(f"  {op:<26}{stats['count']:>8}{errors:>8}{stats['p50_ms']:>10.1f}"
+                  f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['throughput']:>9.1f}")
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions in p95 latency or throughput beyond the tolerance, per level and operation"""
+    regressions = []
+    for level, summary in results["levels"].items():
+        base_level = baseline.get("levels", {}).get(level)
+        if not base_level:
+            continue
+        for op, stats in summary["operations"].items():
+            base = base_level["operations"].get(op)
+            if not base or not base["count"] or not stats["count"]:
+                continue
+            if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"c={level} {op}: p95 {stats['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms"
+                )
+            if stats["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(
+                    f"c={level} {op}: {stats['throughput']:.1f} ops/s vs baseline {base['throughput']:.1f} ops/s"
+                )
+    return regressions
+
+async def start_in_process(args: argparse.Namespace, llm_base_url: str) -> Tuple[httpx.AsyncClient, Any]:
+    # Settings are read at import time, so they must be in place before the app is imported
+    os.environ["OPENROUTER_BASE_URL"] = llm_base_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://in-memory"
+    # The benchmark user is on the enterprise plan; lift its limits so the
+    # harness measures the service rather than admission control
+    os.environ.setdefault("LLM_PLAN_LIMITS", json.dumps({
+        "enterprise": {"rate": 1e6, "burst": 1e6, "concurrency": 1e6, "plan_rate": 1e6, "plan_burst": 1e6}
+    }))
+    os.environ.setdefault("LLM_MAX_QUEUE", "100000")
+
+    import server
+    from services.database import db_manager
+
+    if not args.mongo_url:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("Install mongomock-motor for the in-memory stand-in, or pass --mongo-url to a local mongod")
+        # connect() keeps an existing client, so the startup hook uses this one
+        db_manager.client = AsyncMongoMockClient()
+        db_manager.db = db_manager.client[args.db_name]
+
+    await server.app.router.startup()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://benchmark", timeout=None)
+    return client, server.app
+
+async def main(args: argparse.Namespace) -> int:
+    fake_server = None
+    app = None
+    if args.target:
+        client = httpx.AsyncClient(base_url=args.target, timeout=None)
+    else:
+        fake_server = FakeOpenRouterServer(create_fake_openrouter(
+            args.llm_latency, args.llm_jitter, args.llm_tokens, args.llm_token_rate, args.seed
+        ))
+        fake_server.start()
+        client, app = await start_in_process(args, fake_server.base_url)
+    # The app configures INFO logging on import; per-request lines would swamp the report
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        state = await seed(client, args.agents, args.workflows)
+        results = {
+            "created_at": datetime.utcnow().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "target": args.target or ("mongod" if args.mongo_url else "in-memory"),
+                "mix": args.mix,
+                "duration": args.duration,
+                "seed": args.seed,
+                "llm": {
+                    "latency": args.llm_latency,
+                    "tokens": args.llm_tokens,
+                    "token_rate": args.llm_token_rate
+                }
+            },
+            "levels": {}
+        }
+        for concurrency in args.concurrency:
+            logger.warning(f"Running concurrency={concurrency} for {args.warmup + args.duration:.0f}s")
+            results["levels"][str(concurrency)] = await run_level(client, state, args, concurrency)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+        if fake_server is not None:
+            fake_server.stop()
+
+    print_report(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.max_regression)
+    if regressions:
+        print(f"\nRegressions beyond {args.max_regression:.0%} of baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nWithin {args.max_regression:.0%} of baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,171 @@
+import asyncio
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Any, List, Callable, Awaitable
+
+import httpx
+
+TERMINAL_RUN_STATES = {"succeeded", "failed"}
+RUN_TIMEOUT_SECONDS = 60
+
+class Recorder:
+    """Collects per-operation latencies and failures for one concurrency level"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.enabled = True
+
+    async def timed(self, op: str, request: Awaitable[httpx.Response], expected=(200, 201, 202)) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            if self.enabled:
+                self.errors[op][type(e).__name__] += 1
+            raise
+        elapsed = time.perf_counter() - started
+        if self.enabled:
+            if response.status_code in expected:
+                self.latencies[op].append(elapsed)
+            else:
+                self.errors[op][str(response.status_code)] += 1
+        return response
+
+    def record(self, op: str, elapsed: float):
+        if self.enabled:
+            self.latencies[op].append(elapsed)
+
+class BenchState:
+    """Fixtures created once per benchmark run and shared by every worker"""
+
+    def __init__(self, user_id: str, agent_ids: List[str], workflow_ids: List[str]):
+        self.user_id = user_id
+        self.agent_ids = agent_ids
+        self.workflow_ids = workflow_ids
+
+async def seed(client: httpx.AsyncClient, agents: int, workflows: int) -> BenchState:
+    suffix = uuid.uuid4().hex[:8]
+    user = (await client.post("/api/users/", json={
+        "email": f"bench-{suffix}@example.com",
+        "username": f"bench-{suffix}",
+        "full_name": "Benchmark User",
+        "subscription_plan": "enterprise"
+    })).json()
+
+    agent_ids = []
+    for index in range(agents):
+        agent = (await client.post("/api/agents/", json={
+            "name": f"bench-agent-{index}",
+            "description": "Benchmark agent",
+            "system_prompt": "You are a concise assistant.",
+            "user_id": user["id"]
+        })).json()
+        agent_ids.append(agent["id"])
+
+    workflow_ids = []
+    for index in range(workflows):
+        workflow = (await client.post("/api/workflows/", json={
+            "name": f"bench-workflow-{index}",
+            "description": "Trigger, two parallel actions and a join",
+            "nodes": [
+                {"id": "trigger", "type": "trigger"},
+                {"id": "left", "type": "action", "config": {}},
+                {"id": "right", "type": "action", "config": {}},
+                {"id": "join", "type": "action", "config": {}}
+            ],
+            "connections": [
+                {"source": "trigger", "target": "left"},
+                {"source": "trigger", "target": "right"},
+                {"source": "left", "target": "join"},
+                {"source": "right", "target": "join"}
+            ],
+            "user_id": user["id"]
+        })).json()
+        workflow_ids.append(workflow["id"])
+
+    return BenchState(user["id"], agent_ids, workflow_ids)
+
+async def chat(client: httpx.AsyncClient, state: BenchState, recorder: Recorder, rng: random.Random, worker: Dict[str, Any]):
+    agent_id = rng.choice(state.agent_ids)
+    # Each worker keeps one session per agent so history building is exercised
+    session_id = worker.setdefault("sessions", {}).get(agent_id)
+    params = {"message": f"question {rng.randint(0, 10**6)}"}
+    if session_id:
+        params["session_id"] = session_id
+    response = await recorder.timed("chat", client.post(f"/api/agents/{agent_id}/chat", params=params))
+    if response.status_code == 200:
+        worker["sessions"][agent_id] = response.json()["session_id"]
+
+async def chat_stream(client: httpx.AsyncClient, state: BenchState, recorder: Recorder, rng: random.Random, worker: Dict[str, Any]):
+    agent_id = rng.choice(state.agent_ids)
+    params = {"message": f"question {rng.randint(0, 10**6)}", "stream": "true"}
+    started = time.perf_counter()
+    first_byte = None
+    try:
+        async with client.stream("POST", f"/api/agents/{agent_id}/chat", params=params) as response:
+            if response.status_code != 200:
+                await response.aread()
+                if recorder.enabled:
+                    recorder.errors["chat_stream"][str(response.status_code)] += 1
+                return
+            async for chunk in response.aiter_bytes():
+                if first_byte is None and b'"token"' in chunk:
+                    first_byte = time.perf_counter() - started
+    except httpx.HTTPError as e:
+        if recorder.enabled:
+            recorder.errors["chat_stream"][type(e).__name__] += 1
+        return
+    recorder.record("chat_stream", time.perf_counter() - started)
+    if first_byte is not None:
+        recorder.record("chat_stream_first_token", first_byte)
+
+async def crud(client: httpx.AsyncClient, state: BenchState, recorder: Recorder, rng: random.Random, worker: Dict[str, Any]):
+    created = await recorder.timed("agent_create", client.post("/api/agents/", json={
+        "name": f"crud-{rng.randint(0, 10**6)}",
+        "description": "Created by the CRUD scenario",
+        "system_prompt": "You are a test agent.",
+        "user_id": state.user_id
+    }))
+    if created.status_code != 200:
+        return
+    agent_id = created.json()["id"]
+    await recorder.timed("agent_get", client.get(f"/api/agents/{agent_id}"))
+    await recorder.timed("agent_list", client.get("/api/agents/", params={"user_id": state.user_id, "limit": 50}))
+    await recorder.timed("agent_update", client.put(f"/api/agents/{agent_id}", json={"description": "updated"}))
+    await recorder.timed("agent_delete", client.delete(f"/api/agents/{agent_id}"))
+
+async def workflow(client: httpx.AsyncClient, state: BenchState, recorder: Recorder, rng: random.Random, worker: Dict[str, Any]):
+    workflow_id = rng.choice(state.workflow_ids)
+    started = time.perf_counter()
+    response = await recorder.timed(
+        "workflow_enqueue",
+        client.post(f"/api/workflows/{workflow_id}/execute", json={"n": rng.randint(0, 100)})
+    )
+    if response.status_code != 202:
+        return
+    run_id = response.json()["run_id"]
+
+    # End-to-end latency includes time spent queued behind other runs
+    status = "timeout"
+    while time.perf_counter() - started < RUN_TIMEOUT_SECONDS:
+        run = await client.get(f"/api/workflows/{workflow_id}/runs/{run_id}")
+        if run.status_code == 200 and run.json()["status"] in TERMINAL_RUN_STATES:
+            status = run.json()["status"]
+            break
+        await asyncio.sleep(0.02)
+    if status == "succeeded":
+        recorder.record("workflow_run", time.perf_counter() - started)
+    elif recorder.enabled:
+        recorder.errors["workflow_run"][status] += 1
+
+Scenario = Callable[[httpx.AsyncClient, BenchState, Recorder, random.Random, Dict[str, Any]], Awaitable[None]]
+
+SCENARIOS: Dict[str, Scenario] = {
+    "chat": chat,
+    "chat_stream": chat_stream,
+    "crud": crud,
+    "workflow": workflow,
+}
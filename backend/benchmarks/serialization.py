@@ -0,0 +1,86 @@
+"""
+Per-row CPU cost of list responses: the legacy path (build models in the
+handler, then FastAPI re-validates and jsonable_encodes them through
+response_model) against services.serialization.page_response. Run from the
+backend directory:
+
+    python -m benchmarks.serialization --rows 1000 --repeat 50
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+import httpx
+from fastapi import FastAPI
+
+from models.schemas import Agent, Page
+from services.serialization import page_response
+
+def make_documents(count: int) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    return [{
+        "id": str(uuid.uuid4()),
+        "name": f"agent-{index}",
+        "description": "Benchmark agent with a realistic amount of descriptive text " * 2,
+        "model": "deepseek/deepseek-r1-0528-qwen3-8b:free",
+        "system_prompt": "You are a helpful assistant. " * 10,
+        "tools": ["search", "calculator", "http"],
+        "memory_enabled": True,
+        "status": "active",
+        "created_at": now - timedelta(seconds=index),
+        "updated_at": now,
+        "user_id": "benchmark-user",
+        "performance_metrics": {"message_count": index, "avg_response_time": 1.25, "error_rate": 0.01},
+        "cache_enabled": False
+    } for index in range(count)]
+
+def build_app(documents: Dict[int, List[Dict[str, Any]]]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy", response_model=Page[Agent])
+    async def legacy(rows: int):
+        return {"items": [Agent(**doc) for doc in documents[rows]], "limit": rows, "next_cursor": None}
+
+    @app.get("/fast", response_model=Page[Agent])
+    async def fast(rows: int):
+        return page_response(Agent, {"items": documents[rows], "limit": rows, "next_cursor": None})
+
+    return app
+
+async def measure(client: httpx.AsyncClient, path: str, rows: int, repeat: int) -> float:
+    """CPU seconds per request"""
+    await client.get(path, params={"rows": rows})  # warm caches and adapters
+    started = time.process_time()
+    for _ in range(repeat):
+        response = await client.get(path, params={"rows": rows})
+        response.raise_for_status()
+    return (time.process_time() - started) / repeat
+
+async def main(args: argparse.Namespace):
+    small = 10
+    documents = {small: make_documents(small), args.rows: make_documents(args.rows)}
+    app = build_app(documents)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        legacy_body = (await client.get("/legacy", params={"rows": small})).json()
+        fast_body = (await client.get("/fast", params={"rows": small})).json()
+        assert legacy_body == fast_body, "fast path must produce the same payload"
+
+        print(f"{'path':<8}{'ms/request':>12}{'us/row':>10}")
+        results = {}
+        for path in ("legacy", "fast"):
+            large = await measure(client, f"/{path}", args.rows, args.repeat)
+            base = await measure(client, f"/{path}", small, args.repeat)
+            # Subtract the fixed per-request cost measured at a small page size
+            per_row = (large - base) / (args.rows - small)
+            results[path] = per_row
+            print(f"{path:<8}{large * 1000:>12.2f}{per_row * 1e6:>10.2f}")
+        print(f"\nper-row CPU reduced {results['legacy'] / results['fast']:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=30)
+    asyncio.run(main(parser.parse_args()))
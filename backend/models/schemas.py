@@ -1,8 +1,11 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Generic, TypeVar
 from datetime import datetime
 import uuid
 
+T = TypeVar("T")
+U = TypeVar("U")
+
 class Agent(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -16,21 +19,26 @@ class Agent(BaseModel):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     user_id: str
     performance_metrics: Dict[str, Any] = Field(default_factory=dict)
+    cache_enabled: bool = False
     
 class AgentCreate(BaseModel):
     name: str
     description: str
+    model: str = "deepseek/deepseek-r1-0528-qwen3-8b:free"
     system_prompt: str
     tools: List[str] = Field(default_factory=list)
     memory_enabled: bool = True
+    cache_enabled: bool = False
     user_id: str
 
 class AgentUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
+    model: Optional[str] = None
     system_prompt: Optional[str] = None
     tools: Optional[List[str]] = None
     memory_enabled: Optional[bool] = None
+    cache_enabled: Optional[bool] = None
     status: Optional[str] = None
 
 class Workflow(BaseModel):
@@ -46,6 +54,7 @@ class Workflow(BaseModel):
     user_id: str
     execution_count: int = 0
     last_execution: Optional[datetime] = None
+    plan: Optional[Dict[str, Any]] = None  # compiled on save by services.workflow_compiler
 
 class WorkflowCreate(BaseModel):
     name: str
@@ -76,7 +85,23 @@ class Template(BaseModel):
     created_by: str
     usage_count: int = 0
     rating: float = 0.0
+    # Usage/rating rank maintained server-side; orders query-less search
+    popularity: float = 0.0
     
+class TemplateSearchHit(Template):
+    score: float = 0.0
+
+class FacetCount(BaseModel):
+    value: Any
+    count: int
+
+class TemplateSearchPage(BaseModel):
+    items: List[TemplateSearchHit]
+    limit: int
+    next_cursor: Optional[str] = None
+    total: int
+    facets: Dict[str, List[FacetCount]]
+
 class TemplateCreate(BaseModel):
     name: str
     description: str
@@ -123,6 +148,7 @@ class ChatMessage(BaseModel):
     agent_response: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     response_time: float = 0.0
+    time_to_first_token: Optional[float] = None
     tokens_used: int = 0
 
 class ChatSession(BaseModel):
@@ -132,4 +158,54 @@ class ChatSession(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
-    message_count: int = 0
\ No newline at end of file
+    message_count: int = 0
+    summary: str = ""
+    summarized_count: int = 0
+    summarized_until: Optional[datetime] = None
+
+class WorkflowRun(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    workflow_id: str
+    status: str = "queued"  # queued, running, succeeded, failed
+    priority: int = 0
+    inputs: Dict[str, Any] = Field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    attempts: int = 0
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    limit: int
+    next_cursor: Optional[str] = None
+
+MAX_BULK_ITEMS = 1000
+
+class BulkCreateRequest(BaseModel, Generic[T]):
+    items: List[T] = Field(max_length=MAX_BULK_ITEMS)
+    ordered: bool = True
+
+class BulkUpdateItem(BaseModel, Generic[U]):
+    id: str
+    update: U
+
+class BulkUpdateRequest(BaseModel, Generic[U]):
+    items: List[BulkUpdateItem[U]] = Field(max_length=MAX_BULK_ITEMS)
+    ordered: bool = True
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[str] = Field(max_length=MAX_BULK_ITEMS)
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str  # created, updated, deleted, not_found, error, skipped
+    error: Optional[str] = None
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
@@ -1,37 +1,73 @@
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Optional
+from typing import Optional
 from datetime import datetime
-from models.schemas import Agent, AgentCreate, AgentUpdate, ChatMessage, ChatSession
+from models.schemas import Agent, AgentCreate, AgentUpdate, ChatMessage, ChatSession, Page, BulkCreateRequest, BulkUpdateRequest, BulkDeleteRequest, BulkResult
 from services.llm_service import llm_service
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from services.history import history_builder
+from services.chat_writer import chat_write_buffer, agent_metrics_update
+from services.session_archive import read_session_messages
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from services.database import get_database
+from services import cache
+from services import user_stats
+from services.repository import agents_repository, summarize_bulk
+from services.pagination import paginate, page_limit, encode_cursor, decode_cursor
+from services.serialization import page_response, model_projection
+from services.streaming import format_sse, SSEResponse
+from services.rate_limiter import admission_controller, resolve_plan, retry_after_header, RateLimitExceeded
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/agents", tags=["agents"])
 
-# Database dependency
-def get_database():
-    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
-    return client[os.environ['DB_NAME']]
-
-@router.get("/", response_model=List[Agent])
-async def get_agents(user_id: Optional[str] = None):
-    """Get all agents, optionally filtered by user_id"""
-    db = get_database()
+@router.get("/", response_model=Page[Agent])
+async def get_agents(
+    user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get a page of agents, newest first, optionally filtered by user_id"""
     query = {}
     if user_id:
         query["user_id"] = user_id
     
-    agents = await db.agents.find(query).to_list(1000)
-    return [Agent(**agent) for agent in agents]
+    page = await paginate(db.agents, query, limit, cursor, projection=model_projection(Agent))
+    return page_response(Agent, page)
+
+@router.post("/bulk", response_model=BulkResult)
+async def bulk_create_agents(request: BulkCreateRequest[AgentCreate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Create many agents with one insert_many"""
+    agents = [Agent(**agent.dict()).dict() for agent in request.items]
+    results = await agents_repository.bulk_insert(db, agents, ordered=request.ordered)
+    created = [doc for doc, result in zip(agents, results) if result["status"] == "created"]
+    await user_stats.increment_many(db, "agents", created)
+    return summarize_bulk(results)
+
+@router.patch("/bulk", response_model=BulkResult)
+async def bulk_update_agents(request: BulkUpdateRequest[AgentUpdate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Update many agents with one bulk_write"""
+    updates = [(item.id, item.update.dict(exclude_unset=True)) for item in request.items]
+    results = await agents_repository.bulk_update(db, updates, ordered=request.ordered)
+    for agent_id, _ in updates:
+        cache.invalidate_agent(agent_id)
+    return summarize_bulk(results)
+
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete_agents(request: BulkDeleteRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Delete many agents by id"""
+    results, deleted = await agents_repository.bulk_delete(db, request.ids, projection={"_id": 0, "id": 1, "user_id": 1})
+    for agent in deleted:
+        cache.invalidate_agent(agent["id"])
+    await user_stats.increment_many(db, "agents", deleted, sign=-1)
+    return summarize_bulk(results)
 
 @router.get("/{agent_id}", response_model=Agent)
-async def get_agent(agent_id: str):
+async def get_agent(agent_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Get a specific agent by ID"""
-    db = get_database()
-    agent = await db.agents.find_one({"id": agent_id})
+    agent = await cache.agent_cache.get_or_load(agent_id, lambda: agents_repository.get(db, agent_id))
     
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
@@ -39,117 +75,113 @@ async def get_agent(agent_id: str):
     return Agent(**agent)
 
 @router.post("/", response_model=Agent)
-async def create_agent(agent: AgentCreate):
+async def create_agent(agent: AgentCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Create a new agent"""
-    db = get_database()
-    
     # Create agent object
     agent_obj = Agent(**agent.dict())
     
     # Insert into database
-    await db.agents.insert_one(agent_obj.dict())
+    await agents_repository.insert(db, agent_obj.dict())
+    await user_stats.increment(db, "agents", agent_obj.user_id)
     
     return agent_obj
 
 @router.put("/{agent_id}", response_model=Agent)
-async def update_agent(agent_id: str, agent_update: AgentUpdate):
+async def update_agent(agent_id: str, agent_update: AgentUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Update an existing agent"""
-    db = get_database()
-    
-    # Check if agent exists
-    existing_agent = await db.agents.find_one({"id": agent_id})
-    if not existing_agent:
-        raise HTTPException(status_code=404, detail="Agent not found")
-    
-    # Update fields
+    # Update fields and read back the result in one round trip
     update_data = agent_update.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.agents.update_one(
-        {"id": agent_id},
-        {"$set": update_data}
-    )
+    updated_agent = await agents_repository.update_fields(db, agent_id, update_data)
+    cache.invalidate_agent(agent_id)
+    if not updated_agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
     
-    # Return updated agent
-    updated_agent = await db.agents.find_one({"id": agent_id})
     return Agent(**updated_agent)
 
 @router.delete("/{agent_id}")
-async def delete_agent(agent_id: str):
+async def delete_agent(agent_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Delete an agent"""
-    db = get_database()
-    
-    # Check if agent exists
-    existing_agent = await db.agents.find_one({"id": agent_id})
-    if not existing_agent:
+    deleted_agent = await agents_repository.delete(db, agent_id)
+    cache.invalidate_agent(agent_id)
+    if not deleted_agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    # Delete from database
-    await db.agents.delete_one({"id": agent_id})
+    await user_stats.increment(db, "agents", deleted_agent.get("user_id"), -1)
     
     return {"message": "Agent deleted successfully"}
 
 @router.post("/{agent_id}/chat")
-async def chat_with_agent(agent_id: str, message: str, session_id: Optional[str] = None):
-    """Chat with a specific agent"""
-    db = get_database()
-    
-    # Get agent
-    agent = await db.agents.find_one({"id": agent_id})
+async def chat_with_agent(agent_id: str, message: str, session_id: Optional[str] = None, stream: bool = False, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Chat with a specific agent; with stream=true tokens are sent as server-sent events"""
+    # Get agent (read-through cache; configs change rarely)
+    agent = await cache.agent_cache.get_or_load(agent_id, lambda: agents_repository.get(db, agent_id))
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    # Get or create session
-    if session_id:
-        session = await db.chat_sessions.find_one({"id": session_id})
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-    else:
-        # Create new session
-        session = ChatSession(
-            agent_id=agent_id,
-            user_id=agent.get("user_id", "default")
-        )
-        await db.chat_sessions.insert_one(session.dict())
-        session_id = session.id
+    # Admission control runs before any writes so rejected requests stay cheap
+    owner_id = agent.get("user_id", "default")
+    plan = await resolve_plan(db, owner_id)
+    try:
+        ticket = await admission_controller.acquire(owner_id, plan)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=retry_after_header(e))
     
-    # Get conversation history
-    messages = await db.chat_messages.find({"session_id": session_id}).sort("timestamp", 1).to_list(50)
-    conversation_history = []
+    try:
+        # Get or create session; the session document carries its recent turns
+        if session_id:
+            session = await db.chat_sessions.find_one({"id": session_id})
+            if not session:
+                raise HTTPException(status_code=404, detail="Session not found")
+        else:
+            # Create new session
+            session = ChatSession(
+                agent_id=agent_id,
+                user_id=owner_id
+            ).dict()
+            # Embedded bucket of the newest turns, so later history builds need no chat_messages query
+            if chat_write_buffer.embedded_turns > 0:
+                session["recent_messages"] = []
+            await db.chat_sessions.insert_one(session)
+            await user_stats.increment(db, "chat_sessions", session["user_id"])
+            session_id = session["id"]
+        
+        # Get conversation history: rolling summary plus recent turns within the token budget
+        conversation_history = await history_builder.build(db, session)
+    except BaseException:
+        admission_controller.release(ticket)
+        raise
     
-    for msg in messages:
-        conversation_history.append({"role": "user", "content": msg["user_message"]})
-        conversation_history.append({"role": "assistant", "content": msg["agent_response"]})
+    if stream:
+        # The response releases the admission ticket when it ends, even if the stream never starts
+        return SSEResponse(
+            _stream_chat_response(db, agent, session_id, message, conversation_history),
+            on_close=lambda: admission_controller.release(ticket)
+        )
     
     # Generate response using LLM
-    response = await llm_service.generate_agent_response(
-        agent_config=agent,
-        user_message=message,
-        session_context={"history": conversation_history}
-    )
+    started = time.monotonic()
+    try:
+        response = await llm_service.generate_agent_response(
+            agent_config=agent,
+            user_message=message,
+            session_context={"history": conversation_history}
+        )
+    finally:
+        admission_controller.release(ticket)
     
     if not response.get("success"):
-        raise HTTPException(status_code=500, detail=f"LLM error: {response.get('error')}")
+        await _record_agent_error(db, agent_id, time.monotonic() - started)
+        raise HTTPException(status_code=response.get("status_code", 500), detail=f"LLM error: {response.get('error')}")
     
-    # Save chat message
-    chat_message = ChatMessage(
-        agent_id=agent_id,
-        session_id=session_id,
-        user_message=message,
-        agent_response=response["response"],
-        tokens_used=response.get("usage", {}).get("total_tokens", 0)
-    )
-    
-    await db.chat_messages.insert_one(chat_message.dict())
-    
-    # Update session
-    await db.chat_sessions.update_one(
-        {"id": session_id},
-        {
-            "$set": {"updated_at": datetime.utcnow()},
-            "$inc": {"message_count": 1}
-        }
+    await _save_chat_message(
+        db,
+        agent_id,
+        session_id,
+        message,
+        response["response"],
+        response_time=time.monotonic() - started,
+        # A cache hit spent no tokens; its usage describes the original call
+        tokens_used=0 if response.get("cached") else response.get("usage", {}).get("total_tokens", 0)
     )
     
     return {
@@ -160,21 +192,102 @@ async def chat_with_agent(agent_id: str, message: str, session_id: Optional[str]
         "usage": response.get("usage", {})
     }
 
-@router.get("/{agent_id}/sessions")
-async def get_agent_sessions(agent_id: str):
-    """Get all chat sessions for an agent"""
-    db = get_database()
+async def _save_chat_message(
+    db: AsyncIOMotorDatabase,
+    agent_id: str,
+    session_id: str,
+    message: str,
+    agent_response: str,
+    response_time: float,
+    tokens_used: int,
+    time_to_first_token: Optional[float] = None
+):
+    """Queue a completed chat turn for persistence; the flush also folds it into the agent's metrics"""
+    chat_message = ChatMessage(
+        agent_id=agent_id,
+        session_id=session_id,
+        user_message=message,
+        agent_response=agent_response,
+        response_time=response_time,
+        time_to_first_token=time_to_first_token,
+        tokens_used=tokens_used
+    )
+    
+    # Write-behind: the insert and session counters are batched with other turns;
+    # older turns are folded into the session summary once this one is persisted
+    await chat_write_buffer.submit(
+        db,
+        chat_message.dict(),
+        on_persisted=lambda: history_builder.schedule_fold(db, session_id)
+    )
+
+async def _record_agent_error(db: AsyncIOMotorDatabase, agent_id: str, response_time: float):
+    """Count a failed chat turn in Agent.performance_metrics; completed turns are counted by the write buffer"""
+    # Cached agent configs may show metrics up to CACHE_TTL_SECONDS old; the chat
+    # path deliberately does not invalidate on every turn
+    try:
+        await db.agents.update_one({"id": agent_id}, agent_metrics_update(errors=1, last_response_time=response_time))
+    except Exception as e:
+        logger.error(f"Failed to update performance metrics for agent {agent_id}: {str(e)}")
+
+async def _stream_chat_response(
+    db: AsyncIOMotorDatabase,
+    agent: dict,
+    session_id: str,
+    message: str,
+    conversation_history: list
+):
+    """Forward LLM tokens as SSE frames, then save the completed turn"""
+    yield format_sse({"type": "session", "agent_id": agent["id"], "session_id": session_id})
     
-    sessions = await db.chat_sessions.find({"agent_id": agent_id}).to_list(100)
-    return [ChatSession(**session) for session in sessions]
+    async for event in llm_service.stream_agent_response(
+        agent_config=agent,
+        user_message=message,
+        session_context={"history": conversation_history}
+    ):
+        if event["type"] == "done":
+            await _save_chat_message(
+                db,
+                agent["id"],
+                session_id,
+                message,
+                event["response"],
+                response_time=event["response_time"],
+                tokens_used=event["usage"].get("total_tokens", 0),
+                time_to_first_token=event["time_to_first_token"]
+            )
+            logger.info(f"Streamed chat for agent {agent['id']}: ttft={event['time_to_first_token']}s total={event['response_time']:.3f}s")
+        elif event["type"] == "error":
+            await _record_agent_error(db, agent["id"], 0.0)
+        yield format_sse(event)
+
+@router.get("/{agent_id}/sessions", response_model=Page[ChatSession])
+async def get_agent_sessions(
+    agent_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get a page of chat sessions for an agent, newest first"""
+    page = await paginate(db.chat_sessions, {"agent_id": agent_id}, limit, cursor, projection=model_projection(ChatSession))
+    return page_response(ChatSession, page)
 
-@router.get("/{agent_id}/sessions/{session_id}/messages")
-async def get_session_messages(agent_id: str, session_id: str):
-    """Get all messages for a specific session"""
-    db = get_database()
+@router.get("/{agent_id}/sessions/{session_id}/messages", response_model=Page[ChatMessage])
+async def get_session_messages(
+    agent_id: str,
+    session_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get a page of messages for a specific session in chronological order"""
+    # Reads archived segments of compacted sessions transparently
+    after, after_id = decode_cursor(cursor) if cursor else (None, None)
+    messages = await read_session_messages(db, session_id, limit + 1, after, after_id, agent_id=agent_id)
     
-    messages = await db.chat_messages.find(
-        {"agent_id": agent_id, "session_id": session_id}
-    ).sort("timestamp", 1).to_list(1000)
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1]["timestamp"], messages[-1]["id"])
     
-    return [ChatMessage(**message) for message in messages]
\ No newline at end of file
+    return page_response(ChatMessage, {"items": messages, "limit": limit, "next_cursor": next_cursor})
\ No newline at end of file
@@ -1,43 +1,111 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from services.database import get_database
 from services.llm_service import llm_service
+from services.streaming import format_sse, SSEResponse
+from services.llm_cache import llm_cache
+from services import cache
+from services.repository import agents_repository
+from services.rate_limiter import admission_controller, resolve_plan, retry_after_header, RateLimitExceeded, ANONYMOUS_PLAN
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
+def _client_key(request: Request) -> str:
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
 @router.get("/test")
-async def test_llm_connection():
+async def test_llm_connection(request: Request):
     """Test the LLM connection"""
+    try:
+        ticket = await admission_controller.acquire(_client_key(request), ANONYMOUS_PLAN)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=retry_after_header(e))
     try:
         result = await llm_service.test_connection()
         return result
     except Exception as e:
         logger.error(f"LLM test failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"LLM test failed: {str(e)}")
+    finally:
+        admission_controller.release(ticket)
 
 @router.post("/chat")
-async def chat(message: str, system_prompt: str = "You are a helpful assistant."):
-    """Direct chat with the LLM"""
+async def chat(
+    request: Request,
+    message: str,
+    system_prompt: str = "You are a helpful assistant.",
+    stream: bool = False,
+    model: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Direct chat with the LLM; with stream=true tokens are sent as server-sent events"""
+    # Calls made for an agent are limited on its owner's plan, as on the agent chat
+    # endpoint; everything else shares the strict per-address anonymous plan
+    if agent_id:
+        agent = await cache.agent_cache.get_or_load(agent_id, lambda: agents_repository.get(db, agent_id))
+        if not agent:
+            raise HTTPException(status_code=404, detail="Agent not found")
+        caller = agent.get("user_id", "default")
+        plan = await resolve_plan(db, caller)
+    else:
+        caller = _client_key(request)
+        plan = ANONYMOUS_PLAN
+    try:
+        ticket = await admission_controller.acquire(caller, plan)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=retry_after_header(e))
+    
+    if stream:
+        async def event_stream():
+            async for event in llm_service.stream_chat(system_prompt=system_prompt, user_message=message, model=model):
+                yield format_sse(event)
+        
+        # The response releases the admission ticket when it ends, even if the stream never starts
+        return SSEResponse(event_stream(), on_close=lambda: admission_controller.release(ticket))
+    
     try:
         result = await llm_service.chat_with_agent(
             system_prompt=system_prompt,
-            user_message=message
+            user_message=message,
+            model=model
         )
         
         if not result.get("success"):
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
+            raise HTTPException(status_code=result.get("status_code", 500), detail=result.get("error", "Unknown error"))
         
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Chat failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+    finally:
+        admission_controller.release(ticket)
 
 @router.get("/models")
 async def get_available_models():
-    """Get information about available models"""
+    """Get the model catalog, routing policy and observed latencies"""
+    return {
+        "current_model": llm_service.model,
+        "provider": llm_service.router.model_info(llm_service.model)["provider"],
+        "routing": llm_service.router.describe()
+    }
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Get LLM response cache hit/miss counters"""
+    return llm_cache.stats()
+
+@router.get("/stats")
+async def get_llm_stats():
+    """Get LLM cache, request coalescing and admission control counters"""
     return {
-        "current_model": "deepseek/deepseek-r1-0528-qwen3-8b:free",
-        "provider": "openrouter",
-        "description": "DeepSeek R1 model via OpenRouter - free tier"
-    }
\ No newline at end of file
+        "cache": llm_cache.stats(),
+        "coalescing": llm_service.single_flight.stats(),
+        "admission": admission_controller.stats()
+    }
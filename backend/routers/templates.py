@@ -1,28 +1,31 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import List, Optional
 from datetime import datetime
-from models.schemas import Template, TemplateCreate, TemplateUpdate
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from models.schemas import Template, TemplateCreate, TemplateUpdate, TemplateSearchPage, Page, BulkCreateRequest, BulkUpdateRequest, BulkDeleteRequest, BulkResult
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from services.database import get_database
+from services import cache
+from services import user_stats
+from services.repository import templates_repository, summarize_bulk
+from services.pagination import paginate, page_limit
+from services.serialization import page_response, model_projection
+from services import template_search
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/templates", tags=["templates"])
 
-# Database dependency
-def get_database():
-    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
-    return client[os.environ['DB_NAME']]
-
-@router.get("/", response_model=List[Template])
+@router.get("/", response_model=Page[Template])
 async def get_templates(
     category: Optional[str] = None,
     is_public: Optional[bool] = None,
-    created_by: Optional[str] = None
+    created_by: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Get all templates with optional filters"""
-    db = get_database()
+    """Get a page of templates, newest first, with optional filters"""
     query = {}
     
     if category:
@@ -32,21 +35,71 @@ async def get_templates(
     if created_by:
         query["created_by"] = created_by
     
-    templates = await db.templates.find(query).to_list(1000)
-    return [Template(**template) for template in templates]
+    page = await paginate(db.templates, query, limit, cursor, projection=model_projection(Template))
+    return page_response(Template, page)
 
 @router.get("/categories")
-async def get_template_categories():
+async def get_template_categories(db: AsyncIOMotorDatabase = Depends(get_database)):
     """Get all available template categories"""
-    db = get_database()
-    categories = await db.templates.distinct("category")
+    categories = await cache.template_category_cache.get_or_load(
+        "all", lambda: db.templates.distinct("category")
+    )
     return {"categories": categories}
 
+@router.post("/bulk", response_model=BulkResult)
+async def bulk_create_templates(request: BulkCreateRequest[TemplateCreate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Create many templates with one insert_many"""
+    templates = [Template(**template.dict()).dict() for template in request.items]
+    results = await templates_repository.bulk_insert(db, templates, ordered=request.ordered)
+    cache.template_category_cache.clear()
+    created = [doc for doc, result in zip(templates, results) if result["status"] == "created"]
+    await user_stats.increment_many(db, "templates", created)
+    return summarize_bulk(results)
+
+@router.patch("/bulk", response_model=BulkResult)
+async def bulk_update_templates(request: BulkUpdateRequest[TemplateUpdate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Update many templates with one bulk_write"""
+    updates = [(item.id, item.update.dict(exclude_unset=True)) for item in request.items]
+    results = await templates_repository.bulk_update(db, updates, ordered=request.ordered)
+    for template_id, _ in updates:
+        cache.invalidate_template(template_id)
+    return summarize_bulk(results)
+
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete_templates(request: BulkDeleteRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Delete many templates by id"""
+    results, deleted = await templates_repository.bulk_delete(db, request.ids, projection={"_id": 0, "id": 1, "created_by": 1})
+    for template in deleted:
+        cache.invalidate_template(template["id"])
+    await user_stats.increment_many(db, "templates", deleted, sign=-1)
+    return summarize_bulk(results)
+
+@router.get("/search", response_model=TemplateSearchPage)
+async def search_templates(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    tag: List[str] = Query(default_factory=list),
+    is_public: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Full-text template search ranked by relevance, usage and rating, with category/tag facets"""
+    filters = {}
+    if category:
+        filters["category"] = category
+    if tag:
+        filters["tags"] = {"$all": tag}
+    if is_public is not None:
+        filters["is_public"] = is_public
+    
+    result = await template_search.search_templates(db, q, filters, limit, cursor)
+    return {"limit": limit, **result}
+
 @router.get("/{template_id}", response_model=Template)
-async def get_template(template_id: str):
+async def get_template(template_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Get a specific template by ID"""
-    db = get_database()
-    template = await db.templates.find_one({"id": template_id})
+    template = await cache.template_cache.get_or_load(template_id, lambda: templates_repository.get(db, template_id))
     
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
@@ -54,72 +107,53 @@ async def get_template(template_id: str):
     return Template(**template)
 
 @router.post("/", response_model=Template)
-async def create_template(template: TemplateCreate):
+async def create_template(template: TemplateCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Create a new template"""
-    db = get_database()
-    
     # Create template object
     template_obj = Template(**template.dict())
     
     # Insert into database
-    await db.templates.insert_one(template_obj.dict())
+    await templates_repository.insert(db, template_obj.dict())
+    cache.template_category_cache.clear()
+    await user_stats.increment(db, "templates", template_obj.created_by)
     
     return template_obj
 
 @router.put("/{template_id}", response_model=Template)
-async def update_template(template_id: str, template_update: TemplateUpdate):
+async def update_template(template_id: str, template_update: TemplateUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Update an existing template"""
-    db = get_database()
-    
-    # Check if template exists
-    existing_template = await db.templates.find_one({"id": template_id})
-    if not existing_template:
-        raise HTTPException(status_code=404, detail="Template not found")
-    
-    # Update fields
+    # Update fields and read back the result in one round trip
     update_data = template_update.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.templates.update_one(
-        {"id": template_id},
-        {"$set": update_data}
-    )
+    updated_template = await templates_repository.update_fields(db, template_id, update_data)
+    cache.invalidate_template(template_id)
+    if not updated_template:
+        raise HTTPException(status_code=404, detail="Template not found")
     
-    # Return updated template
-    updated_template = await db.templates.find_one({"id": template_id})
     return Template(**updated_template)
 
 @router.delete("/{template_id}")
-async def delete_template(template_id: str):
+async def delete_template(template_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Delete a template"""
-    db = get_database()
-    
-    # Check if template exists
-    existing_template = await db.templates.find_one({"id": template_id})
-    if not existing_template:
+    deleted_template = await templates_repository.delete(db, template_id)
+    cache.invalidate_template(template_id)
+    if not deleted_template:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    # Delete from database
-    await db.templates.delete_one({"id": template_id})
+    await user_stats.increment(db, "templates", deleted_template.get("created_by"), -1)
     
     return {"message": "Template deleted successfully"}
 
 @router.post("/{template_id}/use")
-async def use_template(template_id: str):
+async def use_template(template_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Mark a template as used (increment usage count)"""
-    db = get_database()
-    
-    # Check if template exists
-    existing_template = await db.templates.find_one({"id": template_id})
-    if not existing_template:
-        raise HTTPException(status_code=404, detail="Template not found")
-    
     # Increment usage count
-    await db.templates.update_one(
-        {"id": template_id},
-        {"$inc": {"usage_count": 1}}
-    )
+    updated_template = await templates_repository.modify(db, template_id, [
+        {"$set": {"usage_count": {"$add": [{"$ifNull": ["$usage_count", 0]}, 1]}}},
+        {"$set": {"popularity": template_search.popularity_expression()}}
+    ])
+    cache.template_cache.invalidate(template_id)
+    if not updated_template:
+        raise HTTPException(status_code=404, detail="Template not found")
     
     return {
         "template_id": template_id,
@@ -127,32 +161,29 @@ async def use_template(template_id: str):
     }
 
 @router.post("/{template_id}/rate")
-async def rate_template(template_id: str, rating: float):
+async def rate_template(template_id: str, rating: float, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Rate a template (simple implementation)"""
-    db = get_database()
-    
     if not (1 <= rating <= 5):
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
     
-    # Check if template exists
-    existing_template = await db.templates.find_one({"id": template_id})
-    if not existing_template:
+    # Simple rating update (in real implementation, you'd track individual ratings).
+    # The new average is computed server-side so concurrent ratings cannot
+    # overwrite each other.
+    current_rating = {"$ifNull": ["$rating", 0]}
+    usage_count = {"$ifNull": ["$usage_count", 0]}
+    updated_template = await templates_repository.modify(db, template_id, [
+        {"$set": {"rating": {"$divide": [
+            {"$add": [{"$multiply": [current_rating, usage_count]}, rating]},
+            {"$add": [usage_count, 1]}
+        ]}}},
+        {"$set": {"popularity": template_search.popularity_expression()}}
+    ])
+    cache.template_cache.invalidate(template_id)
+    if not updated_template:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    # Simple rating update (in real implementation, you'd track individual ratings)
-    current_rating = existing_template.get("rating", 0)
-    usage_count = existing_template.get("usage_count", 0)
-    
-    # Calculate new average rating
-    new_rating = ((current_rating * usage_count) + rating) / (usage_count + 1)
-    
-    await db.templates.update_one(
-        {"id": template_id},
-        {"$set": {"rating": new_rating}}
-    )
-    
     return {
         "template_id": template_id,
-        "new_rating": new_rating,
+        "new_rating": updated_template["rating"],
         "message": "Template rating updated"
     }
\ No newline at end of file
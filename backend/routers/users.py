@@ -1,32 +1,60 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
 from datetime import datetime
-from models.schemas import User, UserCreate, UserUpdate
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from models.schemas import User, UserCreate, UserUpdate, Page, BulkCreateRequest, BulkUpdateRequest, BulkDeleteRequest, BulkResult
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+from services.database import get_database
+from services import cache
+from services import user_stats
+from services.repository import users_repository, summarize_bulk
+from services.indexes import duplicate_key_field
+from services.pagination import paginate, page_limit
+from services.serialization import page_response, model_projection
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-# Database dependency
-def get_database():
-    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
-    return client[os.environ['DB_NAME']]
+@router.get("/", response_model=Page[User])
+async def get_users(
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get a page of users, newest first"""
+    page = await paginate(db.users, {}, limit, cursor, projection=model_projection(User))
+    return page_response(User, page)
 
-@router.get("/", response_model=List[User])
-async def get_users():
-    """Get all users"""
-    db = get_database()
-    users = await db.users.find().to_list(1000)
-    return [User(**user) for user in users]
+@router.post("/bulk", response_model=BulkResult)
+async def bulk_create_users(request: BulkCreateRequest[UserCreate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Create many users with one insert_many"""
+    users = [User(**user.dict()).dict() for user in request.items]
+    results = await users_repository.bulk_insert(db, users, ordered=request.ordered)
+    return summarize_bulk(results)
+
+@router.patch("/bulk", response_model=BulkResult)
+async def bulk_update_users(request: BulkUpdateRequest[UserUpdate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Update many users with one bulk_write"""
+    updates = [(item.id, item.update.dict(exclude_unset=True)) for item in request.items]
+    results = await users_repository.bulk_update(db, updates, ordered=request.ordered)
+    for user_id, _ in updates:
+        cache.invalidate_user_plan(user_id)
+    return summarize_bulk(results)
+
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete_users(request: BulkDeleteRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Delete many users by id"""
+    results, _ = await users_repository.bulk_delete(db, request.ids)
+    for user_id in request.ids:
+        cache.invalidate_user_plan(user_id)
+    return summarize_bulk(results)
 
 @router.get("/{user_id}", response_model=User)
-async def get_user(user_id: str):
+async def get_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Get a specific user by ID"""
-    db = get_database()
-    user = await db.users.find_one({"id": user_id})
+    user = await users_repository.get(db, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -34,103 +62,76 @@ async def get_user(user_id: str):
     return User(**user)
 
 @router.post("/", response_model=User)
-async def create_user(user: UserCreate):
+async def create_user(user: UserCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Create a new user"""
-    db = get_database()
-    
-    # Check if user with email already exists
-    existing_user = await db.users.find_one({"email": user.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="User with this email already exists")
-    
-    # Check if username already exists
-    existing_username = await db.users.find_one({"username": user.username})
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
     # Create user object
     user_obj = User(**user.dict())
     
-    # Insert into database
-    await db.users.insert_one(user_obj.dict())
+    # Insert into database; the unique email/username indexes reject duplicates
+    try:
+        await users_repository.insert(db, user_obj.dict())
+    except DuplicateKeyError as e:
+        if duplicate_key_field(e) == "username":
+            raise HTTPException(status_code=400, detail="Username already taken")
+        raise HTTPException(status_code=400, detail="User with this email already exists")
     
     return user_obj
 
 @router.put("/{user_id}", response_model=User)
-async def update_user(user_id: str, user_update: UserUpdate):
+async def update_user(user_id: str, user_update: UserUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Update an existing user"""
-    db = get_database()
-    
-    # Check if user exists
-    existing_user = await db.users.find_one({"id": user_id})
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Check for email conflicts if email is being updated
-    if user_update.email:
-        email_conflict = await db.users.find_one({
-            "email": user_update.email,
-            "id": {"$ne": user_id}
-        })
-        if email_conflict:
-            raise HTTPException(status_code=400, detail="Email already in use")
-    
-    # Update fields
+    # Update fields; the unique email/username indexes reject conflicts
     update_data = user_update.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": update_data}
-    )
+    try:
+        updated_user = await users_repository.update_fields(db, user_id, update_data)
+    except DuplicateKeyError as e:
+        if duplicate_key_field(e) == "username":
+            raise HTTPException(status_code=400, detail="Username already taken")
+        raise HTTPException(status_code=400, detail="Email already in use")
+    cache.invalidate_user_plan(user_id)
+    
+    if not updated_user:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    # Return updated user
-    updated_user = await db.users.find_one({"id": user_id})
     return User(**updated_user)
 
 @router.delete("/{user_id}")
-async def delete_user(user_id: str):
+async def delete_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Delete a user"""
-    db = get_database()
-    
-    # Check if user exists
-    existing_user = await db.users.find_one({"id": user_id})
-    if not existing_user:
+    deleted_user = await users_repository.delete(db, user_id)
+    cache.invalidate_user_plan(user_id)
+    if not deleted_user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Delete from database
-    await db.users.delete_one({"id": user_id})
-    
     return {"message": "User deleted successfully"}
 
 @router.get("/{user_id}/stats")
-async def get_user_stats(user_id: str):
-    """Get user statistics"""
-    db = get_database()
-    
+async def get_user_stats(user_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Get user statistics from the incrementally maintained usage_stats counters"""
     # Check if user exists
-    user = await db.users.find_one({"id": user_id})
+    user = await users_repository.get(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get agent count
-    agent_count = await db.agents.count_documents({"user_id": user_id})
-    
-    # Get workflow count
-    workflow_count = await db.workflows.count_documents({"user_id": user_id})
-    
-    # Get template count (created by user)
-    template_count = await db.templates.count_documents({"created_by": user_id})
-    
-    # Get chat session count
-    session_count = await db.chat_sessions.count_documents({"user_id": user_id})
+    # Counters are only trusted once reconciled: a legacy user's first $inc after
+    # a deploy would otherwise look like a complete set of counters
+    stats = user.get("usage_stats", {})
+    if "reconciled_at" not in stats:
+        await user_stats.reconcile(db, [user_id])
+        user = await users_repository.get(db, user_id)
+        stats = user.get("usage_stats", {})
     
     return {
         "user_id": user_id,
-        "agent_count": agent_count,
-        "workflow_count": workflow_count,
-        "template_count": template_count,
-        "session_count": session_count,
+        "agent_count": stats.get("agent_count", 0),
+        "workflow_count": stats.get("workflow_count", 0),
+        "template_count": stats.get("template_count", 0),
+        "session_count": stats.get("session_count", 0),
         "subscription_plan": user.get("subscription_plan", "free")
-    }
\ No newline at end of file
+    }
+
+@router.post("/{user_id}/stats/reconcile")
+async def reconcile_user_stats(user_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Recount a user's usage_stats counters from the source collections"""
+    await user_stats.reconcile(db, [user_id])
+    return await get_user_stats(user_id, db)
\ No newline at end of file
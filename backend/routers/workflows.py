@@ -1,36 +1,129 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Body
+from typing import List, Optional, Dict, Any
 from datetime import datetime
-from models.schemas import Workflow, WorkflowCreate, WorkflowUpdate
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from models.schemas import Workflow, WorkflowCreate, WorkflowUpdate, WorkflowRun, Page, BulkCreateRequest, BulkUpdateRequest, BulkDeleteRequest, BulkResult
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from services.database import get_database
+from services import user_stats
+from services.repository import workflows_repository, summarize_bulk, merge_rejected
+from services.pagination import paginate, page_limit
+from services.serialization import page_response, model_projection
+from services.workflow_queue import workflow_queue
+from services.workflow_engine import WorkflowExecutionError
+from services.workflow_compiler import compile_workflow, is_current, load_plan
+from services.trigger_scheduler import trigger_scheduler, validate_triggers
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/workflows", tags=["workflows"])
 
-# Database dependency
-def get_database():
-    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
-    return client[os.environ['DB_NAME']]
+def _compile(nodes: List[Dict[str, Any]], connections: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compile the execution plan on save; invalid graphs are rejected with 422"""
+    try:
+        return compile_workflow(nodes, connections)
+    except WorkflowExecutionError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid workflow: {str(e)}")
 
-@router.get("/", response_model=List[Workflow])
-async def get_workflows(user_id: Optional[str] = None):
-    """Get all workflows, optionally filtered by user_id"""
-    db = get_database()
+def _validate_triggers(triggers: List[Dict[str, Any]]):
+    try:
+        validate_triggers(triggers)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid workflow: {str(e)}")
+
+def _update_fields(update: WorkflowUpdate) -> Dict[str, Any]:
+    """Fields set on an update; an explicit null graph keeps the stored nodes/connections"""
+    fields = update.dict(exclude_unset=True)
+    for key in ("nodes", "connections"):
+        if key in fields and fields[key] is None:
+            del fields[key]
+    return fields
+
+@router.get("/", response_model=Page[Workflow])
+async def get_workflows(
+    user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get a page of workflows, newest first, optionally filtered by user_id"""
     query = {}
     if user_id:
         query["user_id"] = user_id
     
-    workflows = await db.workflows.find(query).to_list(1000)
-    return [Workflow(**workflow) for workflow in workflows]
+    page = await paginate(db.workflows, query, limit, cursor, projection=model_projection(Workflow))
+    return page_response(Workflow, page)
+
+@router.post("/bulk", response_model=BulkResult)
+async def bulk_create_workflows(request: BulkCreateRequest[WorkflowCreate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Create many workflows with one insert_many; invalid graphs are reported per item"""
+    workflows, attempted, rejected = [], [], {}
+    for index, item in enumerate(request.items):
+        workflow = Workflow(**item.dict())
+        try:
+            workflow.plan = compile_workflow(workflow.nodes, workflow.connections)
+            validate_triggers(workflow.triggers)
+        except (WorkflowExecutionError, ValueError) as e:
+            rejected[index] = {"id": workflow.id, "error": f"Invalid workflow: {str(e)}"}
+            if request.ordered:
+                break
+            continue
+        attempted.append(index)
+        workflows.append(workflow.dict())
+    
+    results = await workflows_repository.bulk_insert(db, workflows, ordered=request.ordered)
+    created = [doc for doc, result in zip(workflows, results) if result["status"] == "created"]
+    await user_stats.increment_many(db, "workflows", created)
+    trigger_scheduler.notify_changed()
+    return summarize_bulk(merge_rejected(len(request.items), attempted, results, rejected, request.ordered))
+
+@router.patch("/bulk", response_model=BulkResult)
+async def bulk_update_workflows(request: BulkUpdateRequest[WorkflowUpdate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Update many workflows with one bulk_write; graph changes are recompiled per item"""
+    updates = [(item.id, _update_fields(item.update)) for item in request.items]
+    
+    # Partial graph updates compile against the stored nodes/connections
+    graph_ids = [doc_id for doc_id, fields in updates if "nodes" in fields or "connections" in fields]
+    stored = {
+        doc["id"]: doc for doc in await db.workflows.find(
+            {"id": {"$in": graph_ids}}, {"_id": 0, "id": 1, "nodes": 1, "connections": 1}
+        ).to_list(None)
+    } if graph_ids else {}
+    
+    valid, attempted, rejected = [], [], {}
+    for index, (doc_id, fields) in enumerate(updates):
+        try:
+            validate_triggers(fields.get("triggers"))
+            if doc_id in stored and ("nodes" in fields or "connections" in fields):
+                current = stored[doc_id]
+                fields["plan"] = compile_workflow(
+                    fields.get("nodes", current.get("nodes", [])),
+                    fields.get("connections", current.get("connections", []))
+                )
+        except (WorkflowExecutionError, ValueError) as e:
+            rejected[index] = {"id": doc_id, "error": f"Invalid workflow: {str(e)}"}
+            if request.ordered:
+                break
+            continue
+        attempted.append(index)
+        valid.append((doc_id, fields))
+    
+    results = await workflows_repository.bulk_update(db, valid, ordered=request.ordered)
+    trigger_scheduler.notify_changed()
+    return summarize_bulk(merge_rejected(len(updates), attempted, results, rejected, request.ordered))
+
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete_workflows(request: BulkDeleteRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Delete many workflows by id"""
+    results, deleted = await workflows_repository.bulk_delete(db, request.ids, projection={"_id": 0, "id": 1, "user_id": 1})
+    await user_stats.increment_many(db, "workflows", deleted, sign=-1)
+    trigger_scheduler.notify_changed()
+    return summarize_bulk(results)
 
 @router.get("/{workflow_id}", response_model=Workflow)
-async def get_workflow(workflow_id: str):
+async def get_workflow(workflow_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Get a specific workflow by ID"""
-    db = get_database()
-    workflow = await db.workflows.find_one({"id": workflow_id})
+    workflow = await workflows_repository.get(db, workflow_id)
     
     if not workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
@@ -38,94 +131,113 @@ async def get_workflow(workflow_id: str):
     return Workflow(**workflow)
 
 @router.post("/", response_model=Workflow)
-async def create_workflow(workflow: WorkflowCreate):
+async def create_workflow(workflow: WorkflowCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Create a new workflow"""
-    db = get_database()
-    
-    # Create workflow object
+    # Create workflow object with its compiled execution plan
     workflow_obj = Workflow(**workflow.dict())
+    workflow_obj.plan = _compile(workflow_obj.nodes, workflow_obj.connections)
+    _validate_triggers(workflow_obj.triggers)
     
     # Insert into database
-    await db.workflows.insert_one(workflow_obj.dict())
+    await workflows_repository.insert(db, workflow_obj.dict())
+    await user_stats.increment(db, "workflows", workflow_obj.user_id)
+    trigger_scheduler.notify_changed()
     
     return workflow_obj
 
 @router.put("/{workflow_id}", response_model=Workflow)
-async def update_workflow(workflow_id: str, workflow_update: WorkflowUpdate):
+async def update_workflow(workflow_id: str, workflow_update: WorkflowUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Update an existing workflow"""
-    db = get_database()
-    
-    # Check if workflow exists
-    existing_workflow = await db.workflows.find_one({"id": workflow_id})
-    if not existing_workflow:
+    # Update fields and read back the result in one round trip
+    update_data = _update_fields(workflow_update)
+    _validate_triggers(update_data.get("triggers"))
+    if "nodes" in update_data or "connections" in update_data:
+        current = await workflows_repository.get(db, workflow_id)
+        if not current:
+            raise HTTPException(status_code=404, detail="Workflow not found")
+        update_data["plan"] = _compile(
+            update_data.get("nodes", current.get("nodes", [])),
+            update_data.get("connections", current.get("connections", []))
+        )
+    
+    updated_workflow = await workflows_repository.update_fields(db, workflow_id, update_data)
+    if not updated_workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
+    trigger_scheduler.notify_changed()
     
-    # Update fields
-    update_data = workflow_update.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.workflows.update_one(
-        {"id": workflow_id},
-        {"$set": update_data}
-    )
-    
-    # Return updated workflow
-    updated_workflow = await db.workflows.find_one({"id": workflow_id})
     return Workflow(**updated_workflow)
 
 @router.delete("/{workflow_id}")
-async def delete_workflow(workflow_id: str):
+async def delete_workflow(workflow_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """Delete a workflow"""
-    db = get_database()
-    
-    # Check if workflow exists
-    existing_workflow = await db.workflows.find_one({"id": workflow_id})
-    if not existing_workflow:
+    deleted_workflow = await workflows_repository.delete(db, workflow_id)
+    if not deleted_workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
     
-    # Delete from database
-    await db.workflows.delete_one({"id": workflow_id})
+    await user_stats.increment(db, "workflows", deleted_workflow.get("user_id"), -1)
+    trigger_scheduler.notify_changed()
     
     return {"message": "Workflow deleted successfully"}
 
-@router.post("/{workflow_id}/execute")
-async def execute_workflow(workflow_id: str):
-    """Execute a workflow (placeholder for now)"""
-    db = get_database()
-    
-    # Get workflow
-    workflow = await db.workflows.find_one({"id": workflow_id})
+@router.post("/{workflow_id}/execute", status_code=202)
+async def execute_workflow(
+    workflow_id: str,
+    inputs: Optional[Dict[str, Any]] = Body(None),
+    priority: int = 0,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Queue a workflow run and return its run id immediately"""
+    # Check if workflow exists
+    workflow = await db.workflows.find_one(
+        {"id": workflow_id},
+        {"_id": 0, "id": 1, "nodes": 1, "connections": 1, "plan.version": 1, "plan.fingerprint": 1}
+    )
     if not workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
     
-    # Update execution count and last execution time
-    await db.workflows.update_one(
-        {"id": workflow_id},
-        {
-            "$inc": {"execution_count": 1},
-            "$set": {"last_execution": datetime.utcnow()}
-        }
-    )
+    # Workflows saved before plans existed are compiled (and rejected if invalid) before queueing
+    if not is_current(workflow):
+        try:
+            await load_plan(db, workflow)
+        except WorkflowExecutionError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid workflow: {str(e)}")
+    
+    run = await workflow_queue.enqueue(db, workflow_id, inputs, priority)
     
     return {
         "workflow_id": workflow_id,
-        "status": "executed",
-        "message": "Workflow execution completed (placeholder implementation)"
+        "run_id": run.id,
+        "status": run.status,
+        "priority": run.priority
     }
 
 @router.get("/{workflow_id}/status")
-async def get_workflow_status(workflow_id: str):
-    """Get workflow execution status"""
-    db = get_database()
-    
+async def get_workflow_status(workflow_id: str, limit: int = 20, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Get workflow execution status, recent runs and queue depth"""
     workflow = await db.workflows.find_one({"id": workflow_id})
     if not workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
     
+    limit = min(max(limit, 1), 100)
+    runs = await db.workflow_runs.find(
+        {"workflow_id": workflow_id},
+        {"_id": 0, "result": 0, "inputs": 0}
+    ).sort("created_at", -1).limit(limit).to_list(limit)
+    
     return {
         "workflow_id": workflow_id,
         "status": workflow.get("status", "draft"),
         "execution_count": workflow.get("execution_count", 0),
-        "last_execution": workflow.get("last_execution")
-    }
\ No newline at end of file
+        "last_execution": workflow.get("last_execution"),
+        "queue_depth": await workflow_queue.queue_depth(db),
+        "runs": runs
+    }
+
+@router.get("/{workflow_id}/runs/{run_id}", response_model=WorkflowRun)
+async def get_workflow_run(workflow_id: str, run_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Get a single workflow run, including its result once finished"""
+    run = await db.workflow_runs.find_one({"id": run_id, "workflow_id": workflow_id})
+    if not run:
+        raise HTTPException(status_code=404, detail="Workflow run not found")
+    
+    return WorkflowRun(**run)
\ No newline at end of file
@@ -1,32 +1,43 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends, Response
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Optional
 import uuid
 from datetime import datetime
 
-# Import routers
-from routers import agents, workflows, templates, users, llm
-
-
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Import routers
+from routers import agents, workflows, templates, users, llm
+from services.database import db_manager, get_database
+from services.pagination import paginate, page_limit
+from services.serialization import page_response, model_projection
+from models.schemas import Page
+from services.indexes import ensure_indexes
+from services import template_search
+from services.llm_cache import llm_cache
+from services.workflow_queue import workflow_queue
+from services.user_stats import stats_reconciler
+from services.cache import cache_stats, change_stream_invalidator
+from services.metrics import MetricsMiddleware, render_metrics
+from services.llm_service import llm_service
+from services.chat_writer import chat_write_buffer
+from services.session_archive import session_archiver
+from services.trigger_scheduler import trigger_scheduler
 
 # Create the main app without a prefix
 app = FastAPI(
     title="Pipedream Clone API",
     description="API for AI agents, workflows, and templates",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Create a router with the /api prefix
@@ -48,16 +59,20 @@ async def root():
     return {"message": "Pipedream Clone API is running!", "version": "1.0.0"}
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+@api_router.get("/status", response_model=Page[StatusCheck])
+async def get_status_checks(
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    page = await paginate(db.status_checks, {}, limit, cursor, sort_field="timestamp", projection=model_projection(StatusCheck))
+    return page_response(StatusCheck, page)
 
 # Health check endpoint
 @api_router.get("/health")
@@ -68,6 +83,17 @@ async def health_check():
         "timestamp": datetime.utcnow()
     }
 
+# Read-through cache hit rates
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    return cache_stats()
+
+# Prometheus scrape endpoint
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # Include all routers
 api_router.include_router(agents.router)
 api_router.include_router(workflows.router)
@@ -85,6 +111,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -96,10 +123,30 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting up Pipedream Clone API...")
+    db = db_manager.connect()
     logger.info("Connected to MongoDB")
+    await ensure_indexes(db)
+    refreshed = await template_search.refresh_popularity(db)
+    if refreshed:
+        logger.info(f"Recomputed popularity of {refreshed} templates")
+    llm_cache.attach(db)
+    chat_write_buffer.start(db)
+    await workflow_queue.start(db)
+    trigger_scheduler.start(db)
+    stats_reconciler.start(db)
+    session_archiver.start(db)
+    change_stream_invalidator.start(db)
     logger.info("LLM service initialized")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await trigger_scheduler.stop()
+    # Flush buffered chat turns while the database is still connected
+    await chat_write_buffer.stop()
+    await workflow_queue.stop()
+    await stats_reconciler.stop()
+    await session_archiver.stop()
+    await change_stream_invalidator.stop()
+    await llm_service.aclose()
+    db_manager.close()
     logger.info("Database connection closed")
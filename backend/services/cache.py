@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Awaitable, Optional, List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+class AsyncTTLCache:
+    """
+    Size-bounded LRU read-through cache with per-entry TTL.
+
+    Concurrent misses for the same key share one loader call. A load that an
+    invalidate overtakes is returned to its callers but not stored, so the
+    cache cannot keep a value read before the write that invalidated it.
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._loads = SingleFlight()
+        # key -> invalidations seen while a load for it is in flight
+        self._loading: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return await self._loads.do(key, lambda: self._load(key, loader))
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        self._loading[key] = 0
+        try:
+            value = await loader()
+        finally:
+            overtaken = self._loading.pop(key)
+        # Missing documents are not cached so a later create is visible at once
+        if value is not None and not overtaken:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: str):
+        if key in self._loading:
+            self._loading[key] += 1
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        for key in self._loading:
+            self._loading[key] += 1
+        if self._entries:
+            self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+_TTL = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+
+agent_cache = AsyncTTLCache("agents", _MAX_ENTRIES, _TTL)
+template_cache = AsyncTTLCache("templates", _MAX_ENTRIES, _TTL)
+template_category_cache = AsyncTTLCache("template_categories", 1, _TTL)
+user_plan_cache = AsyncTTLCache("user_plans", _MAX_ENTRIES, _TTL)
+
+CACHES: List[AsyncTTLCache] = [agent_cache, template_cache, template_category_cache, user_plan_cache]
+
+def cache_stats() -> Dict[str, Any]:
+    return {cache.name: cache.stats() for cache in CACHES}
+
+def invalidate_agent(agent_id: str):
+    agent_cache.invalidate(agent_id)
+
+def invalidate_user_plan(user_id: str):
+    user_plan_cache.invalidate(user_id)
+
+def invalidate_template(template_id: Optional[str] = None):
+    """Drop a template (or every template) and the derived category list"""
+    if template_id is None:
+        template_cache.clear()
+    else:
+        template_cache.invalidate(template_id)
+    template_category_cache.clear()
+
+# Change-stream filters: agents get performance_metrics updates on every chat
+# turn and users get usage counter updates, neither of which affects the cache
+AGENT_CONFIG_CHANGES = {"$or": [
+    {"operationType": {"$ne": "update"}},
+    {"updateDescription.removedFields.0": {"$exists": True}},
+    {"$expr": {"$gt": [{"$size": {"$filter": {
+        "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+        "cond": {"$ne": [{"$arrayElemAt": [{"$split": ["$$this.k", "."]}, 0]}, "performance_metrics"]}
+    }}}, 0]}}
+]}
+USER_PLAN_CHANGES = {"$or": [
+    {"operationType": {"$in": ["delete", "replace"]}},
+    {"updateDescription.updatedFields.subscription_plan": {"$exists": True}}
+]}
+
+class ChangeStreamInvalidator:
+    """
+    Keeps caches in other uvicorn workers coherent by invalidating on Mongo
+    change events. Requires a replica set; disabled unless CACHE_CHANGE_STREAMS=true.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get('CACHE_CHANGE_STREAMS', 'false').lower() == 'true'
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if not self.enabled:
+            return
+        self._tasks = [
+            asyncio.create_task(self._watch(db, "agents", invalidate_agent, agent_cache.clear, AGENT_CONFIG_CHANGES)),
+            asyncio.create_task(self._watch(db, "templates", invalidate_template, invalidate_template)),
+            asyncio.create_task(self._watch(db, "users", invalidate_user_plan, user_plan_cache.clear, USER_PLAN_CHANGES)),
+        ]
+        logger.info("Cache change-stream invalidation started")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _watch(
+        self,
+        db: AsyncIOMotorDatabase,
+        collection: str,
+        invalidate: Callable[[str], None],
+        clear: Callable[[], None],
+        match: Optional[Dict[str, Any]] = None
+    ):
+        pipeline = ([{"$match": match}] if match else []) + [{"$project": {"operationType": 1, "fullDocument.id": 1}}]
+        while True:
+            try:
+                async with db[collection].watch(pipeline, full_document="updateLookup") as stream:
+                    async for change in stream:
+                        doc_id = (change.get("fullDocument") or {}).get("id")
+                        if doc_id and change["operationType"] != "delete":
+                            invalidate(doc_id)
+                        else:
+                            # Deletes only carry _id, so drop everything
+                            clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream on {collection} failed, retrying: {str(e)}")
+                # Events may have been missed while disconnected
+                clear()
+                await asyncio.sleep(5)
+
+# Create a singleton instance
+change_stream_invalidator = ChangeStreamInvalidator()
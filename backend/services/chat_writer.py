@@ -0,0 +1,268 @@
+import asyncio
+import os
+import logging
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.metrics import CHAT_WRITE_QUEUE_DEPTH, CHAT_WRITE_BATCH_SIZE
+from services.resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+# Fields of a chat message copied into the session's recent_messages bucket
+EMBEDDED_FIELDS = ("id", "user_message", "agent_response", "timestamp")
+
+# (chat message document, callback run once the turn is persisted)
+PendingTurn = Tuple[Dict[str, Any], Optional[Callable[[], None]]]
+
+def embedded_turn(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: message[field] for field in EMBEDDED_FIELDS}
+
+def agent_metrics_update(
+    turns: int = 0,
+    errors: int = 0,
+    tokens: int = 0,
+    response_time: float = 0.0,
+    last_response_time: float = 0.0,
+    last_used_at: Optional[datetime] = None,
+    last_time_to_first_token: Optional[float] = None,
+    last_message_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Update pipeline folding completed turns and errors into Agent.performance_metrics"""
+    def current(field, default=0):
+        return {"$ifNull": [f"$performance_metrics.{field}", default]}
+
+    metrics = {
+        "performance_metrics.message_count": {"$add": [current("message_count"), turns]},
+        "performance_metrics.error_count": {"$add": [current("error_count"), errors]},
+        "performance_metrics.total_tokens": {"$add": [current("total_tokens"), tokens]},
+        "performance_metrics.total_response_time": {"$add": [current("total_response_time"), response_time]},
+        "performance_metrics.last_response_time": last_response_time,
+        "performance_metrics.last_used_at": last_used_at or datetime.utcnow()
+    }
+    if last_time_to_first_token is not None:
+        metrics["performance_metrics.last_time_to_first_token"] = last_time_to_first_token
+    if last_message_id is not None:
+        metrics["performance_metrics.last_message_id"] = last_message_id
+    return [
+        {"$set": metrics},
+        {"$set": {
+            "performance_metrics.avg_response_time": {"$divide": [
+                "$performance_metrics.total_response_time",
+                {"$max": ["$performance_metrics.message_count", 1]}
+            ]},
+            "performance_metrics.error_rate": {"$divide": [
+                "$performance_metrics.error_count",
+                {"$max": [{"$add": ["$performance_metrics.message_count", "$performance_metrics.error_count"]}, 1]}
+            ]}
+        }}
+    ]
+
+class ChatWriteBuffer:
+    """
+    Write-behind buffer for completed chat turns. Message inserts, the
+    matching session $inc/updated_at updates and the agents' performance
+    metrics are queued and flushed as one bulk_write per collection, with
+    session and agent updates coalesced per document. Those updates record
+    the newest message they fold in and only match documents that do not
+    have it yet, so retrying a write that did apply cannot count turns twice.
+    Each session update also pushes the new turns onto the session's capped
+    recent_messages bucket; chat_messages remains the full log.
+    The queue is bounded: when it is full, callers wait for the flusher.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get('CHAT_WRITE_BEHIND', 'true').lower() == 'true'
+        self.batch_size = int(os.environ.get('CHAT_WRITE_BATCH_SIZE', '200'))
+        self.flush_interval = float(os.environ.get('CHAT_WRITE_FLUSH_SECONDS', '0.05'))
+        self.max_pending = int(os.environ.get('CHAT_WRITE_MAX_PENDING', '5000'))
+        self.max_retries = int(os.environ.get('CHAT_WRITE_MAX_RETRIES', '3'))
+        # Newest turns kept in ChatSession.recent_messages ($push/$slice); 0 disables the bucket
+        self.embedded_turns = int(os.environ.get('CHAT_EMBEDDED_TURNS', '20'))
+        self.db: Optional[AsyncIOMotorDatabase] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Turns queued or mid-flush, by session, so history reads see their own writes
+        self._unflushed: Dict[str, List[Dict[str, Any]]] = {}
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if self.enabled and self._task is None:
+            self.db = db
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run())
+            logger.info("Chat write-behind buffer started")
+
+    async def stop(self):
+        """Flush everything still queued, then stop the flusher"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+        logger.info("Chat write-behind buffer flushed and stopped")
+
+    async def submit(
+        self,
+        db: AsyncIOMotorDatabase,
+        message: Dict[str, Any],
+        on_persisted: Optional[Callable[[], None]] = None
+    ):
+        """Queue a chat message document; written inline when the buffer is not running"""
+        if self._task is None:
+            await self._flush(db, [(message, on_persisted)])
+            return
+        self._unflushed.setdefault(message["session_id"], []).append(message)
+        await self._queue.put((message, on_persisted))
+        CHAT_WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def pending_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Messages for a session that may not be in chat_messages yet, oldest first"""
+        return list(self._unflushed.get(session_id, ()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_pending": self.max_pending
+        }
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            # Give concurrent turns the flush interval to join the batch unless it is already full
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval)
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            CHAT_WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                await self._flush(self.db, batch)
+            except Exception as e:
+                logger.error(f"Chat write-behind flush failed: {str(e)}")
+
+        # Drain anything that raced in behind the stop sentinel
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        if remaining:
+            await self._flush(self.db, remaining)
+        CHAT_WRITE_QUEUE_DEPTH.set(0)
+
+    async def _flush(self, db: AsyncIOMotorDatabase, batch: List[PendingTurn]):
+        inserts = []
+        sessions: Dict[str, Dict[str, Any]] = {}
+        agents: Dict[str, List[Dict[str, Any]]] = {}
+        for message, _ in batch:
+            inserts.append(InsertOne(message))
+            session = sessions.setdefault(message["session_id"], {"turns": [], "updated_at": message["timestamp"]})
+            session["turns"].append(embedded_turn(message))
+            session["updated_at"] = max(session["updated_at"], message["timestamp"])
+            agents.setdefault(message["agent_id"], []).append(message)
+
+        updates = []
+        for session_id, session in sessions.items():
+            last_id = max(session["turns"], key=lambda turn: turn["timestamp"])["id"]
+            updates.append(UpdateOne(
+                {"id": session_id, "last_message_id": {"$ne": last_id}},
+                self._session_update(session["turns"], session["updated_at"], last_id)
+            ))
+        metrics = []
+        for agent_id, messages in agents.items():
+            last_id = max(messages, key=lambda message: message["timestamp"])["id"]
+            metrics.append(UpdateOne(
+                {"id": agent_id, "performance_metrics.last_message_id": {"$ne": last_id}},
+                self._agent_update(messages)
+            ))
+        CHAT_WRITE_BATCH_SIZE.observe(len(batch))
+        try:
+            failed = await self._bulk_write(db, "chat_messages", inserts)
+            await self._bulk_write(db, "chat_sessions", updates)
+            await self._bulk_write(db, "agents", metrics)
+        finally:
+            for message, _ in batch:
+                unflushed = self._unflushed.get(message["session_id"])
+                if unflushed and message in unflushed:
+                    unflushed.remove(message)
+                    if not unflushed:
+                        del self._unflushed[message["session_id"]]
+
+        for index, (_, on_persisted) in enumerate(batch):
+            if on_persisted is not None and index not in failed:
+                try:
+                    on_persisted()
+                except Exception as e:
+                    logger.error(f"Chat write callback failed: {str(e)}")
+
+    def _session_update(self, turns: List[Dict[str, Any]], updated_at, last_message_id: str) -> Dict[str, Any]:
+        update = {
+            "$set": {"last_message_id": last_message_id},
+            "$max": {"updated_at": updated_at},
+            "$inc": {"message_count": len(turns)},
+            # New activity makes an archived session eligible for compaction again
+            "$unset": {"archived_at": ""}
+        }
+        if self.embedded_turns > 0:
+            update["$push"] = {"recent_messages": {
+                "$each": turns[-self.embedded_turns:],
+                "$sort": {"timestamp": 1},
+                "$slice": -self.embedded_turns
+            }}
+        return update
+
+    @staticmethod
+    def _agent_update(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        last = max(messages, key=lambda message: message["timestamp"])
+        return agent_metrics_update(
+            turns=len(messages),
+            tokens=sum(message.get("tokens_used") or 0 for message in messages),
+            response_time=sum(message.get("response_time") or 0.0 for message in messages),
+            last_response_time=last.get("response_time") or 0.0,
+            last_used_at=last["timestamp"],
+            last_time_to_first_token=last.get("time_to_first_token"),
+            last_message_id=last["id"]
+        )
+
+    async def _bulk_write(self, db: AsyncIOMotorDatabase, collection: str, operations: list) -> Set[int]:
+        """
+        Write with retries; returns the indexes of operations that were not applied.
+        Retrying is safe because inserts ignore duplicate ids and updates are guarded.
+        """
+        if not operations:
+            return set()
+        for attempt in range(self.max_retries + 1):
+            try:
+                await db[collection].bulk_write(operations, ordered=False)
+                return set()
+            except BulkWriteError as e:
+                # Per-document errors are not transient; duplicate ids are inserts
+                # that an earlier attempt of this batch already applied
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+                if errors:
+                    logger.error(f"{len(errors)} of {len(operations)} {collection} writes failed: {errors[0].get('errmsg')}")
+                return {err["index"] for err in errors}
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Dropped {len(operations)} {collection} writes after {attempt + 1} attempts: {str(e)}")
+                    return set(range(len(operations)))
+                await asyncio.sleep(backoff_delay(attempt, 0.1, 2.0))
+
+# Create a singleton instance
+chat_write_buffer = ChatWriteBuffer()
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from typing import List, Set, Tuple
+
+# (name, lowest, highest) of the five standard cron fields
+FIELDS: List[Tuple[str, int, int]] = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),  # 0 and 7 are both Sunday
+]
+
+MONTH_NAMES = {name: index for index, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1
+)}
+WEEKDAY_NAMES = {name: index for index, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# A schedule with no match this far ahead (e.g. "0 0 30 2 *") is rejected
+MAX_YEARS_AHEAD = 5
+
+def _value(token: str, field: str, low: int, high: int) -> int:
+    names = MONTH_NAMES if field == "month" else WEEKDAY_NAMES if field == "weekday" else {}
+    value = names.get(token.lower())
+    if value is None:
+        try:
+            value = int(token)
+        except ValueError:
+            raise ValueError(f"Invalid {field} value '{token}'")
+    if not low <= value <= high:
+        raise ValueError(f"{field} value {value} outside {low}-{high}")
+    return value
+
+def _parse_field(spec: str, field: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in spec.split(","):
+        base, _, step_text = part.partition("/")
+        step = 1
+        if step_text:
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise ValueError(f"Invalid {field} step '{step_text}'")
+            step = int(step_text)
+
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            first, _, last = base.partition("-")
+            start, end = _value(first, field, low, high), _value(last, field, low, high)
+            if field == "weekday" and end == 0 < start:
+                end = 7  # "sun" closing a range, as in sat-sun
+            if start > end:
+                raise ValueError(f"Invalid {field} range '{base}'")
+        else:
+            start = _value(base, field, low, high)
+            end = high if step_text else start
+        values.update(range(start, end + 1, step))
+    if field == "weekday" and 7 in values:
+        # Normalised after expansion so ranges ending on Sunday (5-7, sat-sun) stay valid
+        values.discard(7)
+        values.add(0)
+    return values
+
+class CronExpression:
+    """
+    Standard five-field cron expression (minute hour day month weekday)
+    evaluated in UTC. Supports lists, ranges, steps, month/weekday names and
+    the @hourly-style aliases. As in cron, when both day and weekday are
+    restricted a time matches if either does.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f"Cron expression must have {len(FIELDS)} fields: '{expression}'")
+
+        parsed = [_parse_field(spec, *field) for spec, field in zip(fields, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+        # Fail fast on expressions that can never fire
+        self.next_after(datetime(2000, 1, 1))
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after `moment`"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        horizon = candidate.year + MAX_YEARS_AHEAD
+        while candidate.year <= horizon:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never fires: '{self.expression}'")
@@ -0,0 +1,49 @@
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from typing import Optional
+import os
+import logging
+
+from services.metrics import mongo_command_listener
+
+logger = logging.getLogger(__name__)
+
+class DatabaseManager:
+    """Owns the single pooled Motor client shared by every router"""
+
+    def __init__(self):
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db: Optional[AsyncIOMotorDatabase] = None
+
+    def connect(self) -> AsyncIOMotorDatabase:
+        """Create the pooled client (idempotent)"""
+        if self.client is not None:
+            return self.db
+
+        self.client = AsyncIOMotorClient(
+            os.environ['MONGO_URL'],
+            maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+            minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+            maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+            serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+            event_listeners=[mongo_command_listener],
+        )
+        self.db = self.client[os.environ['DB_NAME']]
+        logger.info("MongoDB client created")
+        return self.db
+
+    def close(self):
+        """Close the pooled client and release its sockets"""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+            logger.info("MongoDB client closed")
+
+# Create a singleton instance
+db_manager = DatabaseManager()
+
+def get_database() -> AsyncIOMotorDatabase:
+    """Database dependency returning the shared, pooled database handle"""
+    if db_manager.db is None:
+        raise RuntimeError("Database client is not initialized; the app startup hook has not run")
+    return db_manager.db
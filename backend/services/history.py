@@ -0,0 +1,166 @@
+import asyncio
+import os
+import logging
+from typing import Dict, Any, List, Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.llm_service import llm_service
+from services.chat_writer import chat_write_buffer
+from services.rate_limiter import admission_controller, RateLimitExceeded, BACKGROUND_PLAN
+from services.session_archive import read_latest_session_messages, read_session_messages
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI agent. "
+    "Merge the new turns into the existing summary. Keep facts, decisions, names and open "
+    "questions; drop pleasantries. Reply with the updated summary only, at most 200 words."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) good enough for budgeting"""
+    return len(text) // 4 + 1
+
+class HistoryBuilder:
+    """
+    Builds token-budgeted conversation history from a rolling summary stored
+    on the session plus a bounded window of recent verbatim turns
+    """
+
+    def __init__(self):
+        self.token_budget = int(os.environ.get('HISTORY_TOKEN_BUDGET', '3000'))
+        self.recent_turns = int(os.environ.get('HISTORY_RECENT_TURNS', '10'))
+        self.fold_batch = int(os.environ.get('HISTORY_FOLD_BATCH', '50'))
+        self._folding: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def build(self, db: AsyncIOMotorDatabase, session: Dict[str, Any]) -> List[Dict[str, str]]:
+        """
+        Return chat messages for the model: the summary (if any) followed by as
+        many of the newest unsummarized turns as fit in the token budget
+        """
+        # Folding keeps at most 2x recent_turns unsummarized, so this read is bounded
+        window = 2 * self.recent_turns
+        messages = self._embedded_window(session, window)
+        if messages is None:
+            # Reads through archives too: a revived session's recent turns may be in cold storage
+            messages = await read_latest_session_messages(
+                db, session["id"], window, after=session.get("summarized_until")
+            )
+
+        # Turns still in the write-behind buffer are newer than anything stored
+        pending = chat_write_buffer.pending_messages(session["id"])
+        if pending:
+            stored = {msg["id"] for msg in messages}
+            newer = [msg for msg in reversed(pending) if msg["id"] not in stored]
+            messages = (newer + messages)[:window]
+
+        summary = session.get("summary", "")
+        budget = self.token_budget - (estimate_tokens(summary) if summary else 0)
+
+        turns = []
+        for msg in messages:
+            cost = estimate_tokens(msg["user_message"]) + estimate_tokens(msg["agent_response"])
+            if turns and cost > budget:
+                break
+            budget -= cost
+            turns.append(msg)
+
+        history = []
+        if summary:
+            history.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        for msg in reversed(turns):
+            history.append({"role": "user", "content": msg["user_message"]})
+            history.append({"role": "assistant", "content": msg["agent_response"]})
+        return history
+
+    def _embedded_window(self, session: Dict[str, Any], window: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Newest unsummarized turns from the session's recent_messages bucket,
+        newest first, or None when the bucket cannot stand in for chat_messages
+        (disabled, smaller than the window, or not yet holding every recent turn
+        of a session that predates it)
+        """
+        capacity = chat_write_buffer.embedded_turns
+        bucket = session.get("recent_messages")
+        if capacity < window or bucket is None:
+            return None
+        if len(bucket) < min(capacity, session.get("message_count", 0)):
+            return None
+        summarized_until = session.get("summarized_until")
+        turns = [msg for msg in bucket if not summarized_until or msg["timestamp"] > summarized_until]
+        return turns[::-1][:window]
+
+    def schedule_fold(self, db: AsyncIOMotorDatabase, session_id: str):
+        """Fold old turns into the summary in the background, off the response path"""
+        if session_id in self._folding:
+            return
+        task = asyncio.create_task(self.fold(db, session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def fold(self, db: AsyncIOMotorDatabase, session_id: str):
+        """
+        Once 2x recent_turns turns are unsummarized, merge all but the newest
+        recent_turns into the session's rolling summary
+        """
+        if session_id in self._folding:
+            return
+        self._folding.add(session_id)
+        try:
+            session = await db.chat_sessions.find_one(
+                {"id": session_id},
+                {"_id": 0, "message_count": 1, "summarized_count": 1, "summarized_until": 1, "summary": 1}
+            )
+            if not session:
+                return
+
+            summarized_count = session.get("summarized_count", 0)
+            unsummarized = session.get("message_count", 0) - summarized_count
+            if unsummarized < 2 * self.recent_turns:
+                return
+
+            # Reads through archives too: a revived session may have unsummarized turns in cold storage
+            batch = min(unsummarized - self.recent_turns, self.fold_batch)
+            to_fold = await read_session_messages(db, session_id, batch, after=session.get("summarized_until"))
+            if not to_fold:
+                return
+
+            transcript = "\n".join(
+                f"User: {msg['user_message']}\nAgent: {msg['agent_response']}" for msg in to_fold
+            )
+            try:
+                # Folds share the low-priority background plan; a skipped fold is retried on the next turn
+                async with admission_controller.admit("history-fold", BACKGROUND_PLAN):
+                    result = await llm_service.chat_with_agent(
+                        system_prompt=SUMMARY_PROMPT,
+                        user_message=f"Existing summary:\n{session.get('summary') or '(none)'}\n\nNew turns:\n{transcript}"
+                    )
+            except RateLimitExceeded as e:
+                logger.info(f"Deferred summarizing session {session_id}: {str(e)}")
+                return
+            if not result.get("success"):
+                logger.error(f"Failed to summarize session {session_id}: {result.get('error')}")
+                return
+
+            # Conditional on summarized_count so a concurrent fold cannot double-apply;
+            # sessions created before summaries existed have no counter yet
+            count_filter = summarized_count if summarized_count else {"$in": [0, None]}
+            await db.chat_sessions.update_one(
+                {"id": session_id, "summarized_count": count_filter},
+                {
+                    "$set": {
+                        "summary": result["response"].strip(),
+                        "summarized_until": to_fold[-1]["timestamp"],
+                        "summarized_count": summarized_count + len(to_fold)
+                    }
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error folding history for session {session_id}: {str(e)}")
+        finally:
+            self._folding.discard(session_id)
+
+# Create a singleton instance
+history_builder = HistoryBuilder()
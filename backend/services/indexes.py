@@ -0,0 +1,116 @@
+import logging
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Newest-first keyset pagination order used by the list endpoints
+_PAGE_ORDER = [("created_at", DESCENDING), ("id", DESCENDING)]
+_POPULARITY_ORDER = [("popularity", DESCENDING), ("id", DESCENDING)]
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "agents": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(_PAGE_ORDER, name="created_at_id"),
+        IndexModel([("user_id", ASCENDING)] + _PAGE_ORDER, name="user_id_created_at_id"),
+    ],
+    "workflows": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(_PAGE_ORDER, name="created_at_id"),
+        IndexModel([("user_id", ASCENDING)] + _PAGE_ORDER, name="user_id_created_at_id"),
+    ],
+    "templates": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(_PAGE_ORDER, name="created_at_id"),
+        IndexModel([("category", ASCENDING)] + _PAGE_ORDER, name="category_created_at_id"),
+        IndexModel([("is_public", ASCENDING)] + _PAGE_ORDER, name="is_public_created_at_id"),
+        IndexModel([("created_by", ASCENDING)] + _PAGE_ORDER, name="created_by_created_at_id"),
+        IndexModel([("tags", ASCENDING)], name="tags"),
+        # Keyset order of query-less search
+        IndexModel(_POPULARITY_ORDER, name="popularity_id"),
+        IndexModel([("category", ASCENDING)] + _POPULARITY_ORDER, name="category_popularity_id"),
+        IndexModel([("is_public", ASCENDING)] + _POPULARITY_ORDER, name="is_public_popularity_id"),
+        IndexModel(
+            [("name", TEXT), ("description", TEXT), ("tags", TEXT)],
+            weights={"name": 10, "tags": 5, "description": 1},
+            name="template_text"
+        ),
+    ],
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+        IndexModel(_PAGE_ORDER, name="created_at_id"),
+    ],
+    "chat_sessions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("agent_id", ASCENDING)] + _PAGE_ORDER, name="agent_id_created_at_id"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "chat_messages": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("session_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)],
+            name="session_id_timestamp_id"
+        ),
+        IndexModel(
+            [("agent_id", ASCENDING), ("session_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)],
+            name="agent_id_session_id_timestamp_id"
+        ),
+    ],
+    "chat_archives": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("session_id", ASCENDING), ("first_timestamp", ASCENDING)], name="session_id_first_timestamp"),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "workflow_runs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+            name="status_priority_created_at"
+        ),
+        IndexModel([("workflow_id", ASCENDING), ("created_at", DESCENDING)], name="workflow_id_created_at"),
+    ],
+    "workflow_schedules": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "scheduler_leases": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "llm_cache": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "status_checks": [
+        IndexModel([("timestamp", DESCENDING), ("id", DESCENDING)], name="timestamp_id"),
+    ],
+}
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Create every declared index; createIndexes is a no-op for indexes that
+    already exist with the same spec, so this is safe on every startup
+    """
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # Usually existing duplicates blocking a unique index; keep serving
+            logger.error(f"Failed to ensure indexes on {collection}: {str(e)}")
+    logger.info("MongoDB indexes ensured")
+
+def duplicate_key_field(error: DuplicateKeyError) -> Optional[str]:
+    """Name of the field that violated a unique index, if the server reported it"""
+    details = error.details or {}
+    key_pattern = details.get("keyPattern") or details.get("keyValue") or {}
+    if key_pattern:
+        return next(iter(key_pattern))
+    # Older servers only report the index name in the message
+    for field in ("email", "username", "id"):
+        if f"{field}_unique" in str(error):
+            return field
+    return None
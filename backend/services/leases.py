@@ -0,0 +1,33 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+def process_owner() -> str:
+    """Identity of this process in scheduler_leases"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+async def acquire_lease(db: AsyncIOMotorDatabase, lease_id: str, owner: str, seconds: float, now: datetime) -> bool:
+    """Take or renew a named lease in scheduler_leases; False while another owner holds it"""
+    try:
+        await db.scheduler_leases.find_one_and_update(
+            {"id": lease_id, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return True
+    except DuplicateKeyError:
+        # The upsert collided with the lease document another owner holds
+        return False
+
+async def release_lease(db: AsyncIOMotorDatabase, lease_id: str, owner: str):
+    """Expire a lease this owner holds so another process can take it at once"""
+    await db.scheduler_leases.update_one(
+        {"id": lease_id, "owner": owner},
+        {"$set": {"expires_at": datetime.utcnow()}}
+    )
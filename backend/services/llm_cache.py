@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+class LLMResponseCache:
+    """
+    Exact-match cache of LLM completions: an in-memory LRU tier with TTL and
+    an optional Mongo tier shared across workers
+    """
+
+    def __init__(self):
+        self.max_entries = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '1024'))
+        self.ttl = int(os.environ.get('LLM_CACHE_TTL_SECONDS', '3600'))
+        self.mongo_enabled = os.environ.get('LLM_CACHE_MONGO', 'false').lower() == 'true'
+        self.db: Optional[AsyncIOMotorDatabase] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.mongo_hits = 0
+
+    def attach(self, db: AsyncIOMotorDatabase):
+        """Enable the Mongo tier once the database client exists"""
+        if self.mongo_enabled:
+            self.db = db
+
+    @staticmethod
+    def make_key(model: str, messages: list, params: Optional[Dict[str, Any]] = None) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params or {}},
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self.db is not None:
+            try:
+                doc = await self.db.llm_cache.find_one(
+                    {"key": key, "expires_at": {"$gt": datetime.utcnow()}},
+                    {"_id": 0, "value": 1, "expires_at": 1}
+                )
+            except Exception as e:
+                logger.error(f"LLM cache lookup failed: {str(e)}")
+                doc = None
+            if doc:
+                remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds()
+                self._store(key, doc["value"], remaining)
+                self.hits += 1
+                self.mongo_hits += 1
+                return doc["value"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        self._store(key, value, self.ttl)
+
+        if self.db is not None:
+            try:
+                await self.db.llm_cache.update_one(
+                    {"key": key},
+                    {"$set": {
+                        "value": value,
+                        "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"LLM cache write failed: {str(e)}")
+
+    def _store(self, key: str, value: Dict[str, Any], ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "mongo_tier": self.db is not None,
+            "hits": self.hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+# Create a singleton instance
+llm_cache = LLMResponseCache()
@@ -0,0 +1,471 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+
+import httpx
+
+from services import metrics
+from services.resilience import CircuitBreaker, CircuitOpenError, backoff_delay, hedged
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "deepseek/deepseek-r1-0528-qwen3-8b:free"
+
+# Rate limiting, timeouts and server-side failures are worth retrying; other 4xx are not
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+class ProviderError(Exception):
+    """Raised when a provider call fails; the router fails over to the next candidate model"""
+
+    def __init__(self, provider: str, model: str, message: str, status_code: Optional[int] = None):
+        super().__init__(f"{provider}/{model}: {message}")
+        self.provider = provider
+        self.model = model
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        # No status code means a transport error or a timeout
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS_CODES
+
+class LLMProvider:
+    """Interface for chat-completion backends; responses use the OpenAI schema"""
+
+    name = "base"
+
+    async def complete(self, model: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def stream(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Yield parsed OpenAI-style stream chunks"""
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    Any /chat/completions endpoint (OpenRouter, vLLM, OpenAI) over one
+    persistent, connection-pooled httpx client
+    """
+
+    def __init__(self, name: str, base_url: str, api_key: Optional[str], timeout: float = 120.0):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', '100')),
+            max_keepalive_connections=int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE', '20')),
+            keepalive_expiry=30.0
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                limits=self.limits,
+                timeout=httpx.Timeout(self.timeout, connect=10.0)
+            )
+        return self._client
+
+    async def complete(self, model: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            response = await self.client.post("/chat/completions", json={"model": model, "messages": messages})
+        except httpx.HTTPError as e:
+            raise ProviderError(self.name, model, f"{type(e).__name__}: {e}")
+        if response.status_code != 200:
+            raise ProviderError(self.name, model, f"HTTP {response.status_code}: {response.text[:500]}", response.status_code)
+        return response.json()
+
+    async def stream(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        try:
+            async with self.client.stream("POST", "/chat/completions", json=payload, timeout=httpx.Timeout(None, connect=10.0)) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise ProviderError(
+                        self.name, model,
+                        f"HTTP {response.status_code}: {body.decode(errors='replace')[:500]}",
+                        response.status_code
+                    )
+
+                async for line in response.aiter_lines():
+                    # SSE frames look like "data: {...}"; comments and blank lines are keep-alives
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    yield json.loads(data)
+        except httpx.HTTPError as e:
+            raise ProviderError(self.name, model, f"{type(e).__name__}: {e}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class LocalProvider(LLMProvider):
+    """
+    Network-free stand-in that echoes the last user message, for tests and
+    local development. Serves every model named local/<anything>.
+    """
+
+    name = "local"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def _reply(self, messages: List[Dict[str, Any]]) -> Tuple[str, Dict[str, int]]:
+        last = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        content = f"echo: {last}"
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        completion_tokens = len(content.split())
+        return content, {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    async def complete(self, model: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency)
+        content, usage = self._reply(messages)
+        return {"model": model, "choices": [{"message": {"role": "assistant", "content": content}}], "usage": usage}
+
+    async def stream(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        await asyncio.sleep(self.latency)
+        content, usage = self._reply(messages)
+        for word in content.split(" "):
+            yield {"model": model, "choices": [{"delta": {"content": word + " "}}]}
+        yield {"model": model, "choices": [], "usage": usage}
+
+class ModelStats:
+    """Exponentially weighted latency, a window of recent latencies and recent failures for one model"""
+
+    def __init__(self, expected_latency: float):
+        self.latency = expected_latency
+        self.samples: deque = deque(maxlen=200)
+        self.failures = 0
+        self.last_failure = 0.0
+
+    def success(self, latency: float, alpha: float = 0.2):
+        self.latency = alpha * latency + (1 - alpha) * self.latency
+        self.samples.append(latency)
+        self.failures = 0
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self.samples) < 20:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def failure(self):
+        self.failures += 1
+        self.last_failure = time.monotonic()
+
+    def score(self, cooldown: float) -> float:
+        # Recently failing models sort behind healthy ones until the cooldown passes
+        if self.failures and time.monotonic() - self.last_failure < cooldown:
+            return self.latency * (1 + self.failures) + cooldown
+        return self.latency
+
+ROUTING_POLICIES = ("pinned", "cheapest", "fastest", "latency_aware")
+
+class ModelRouter:
+    """
+    Maps models to providers and orders candidate models per request.
+
+    Policies:
+      pinned        - the requested model first, then fallbacks in configured order
+      cheapest      - candidates by catalog price (per 1M tokens)
+      fastest       - candidates by catalog expected latency
+      latency_aware - candidates by observed latency, penalising recent failures
+    """
+
+    def __init__(self):
+        self.policy = os.environ.get('LLM_ROUTING_POLICY', 'pinned')
+        if self.policy not in ROUTING_POLICIES:
+            raise ValueError(f"LLM_ROUTING_POLICY must be one of {', '.join(ROUTING_POLICIES)}")
+        self.default_model = os.environ.get('LLM_DEFAULT_MODEL', DEFAULT_MODEL)
+        self.fallback_models = [
+            model.strip() for model in os.environ.get('LLM_FALLBACK_MODELS', '').split(",") if model.strip()
+        ]
+        self.failure_cooldown = float(os.environ.get('LLM_FAILURE_COOLDOWN_SECONDS', '30'))
+
+        # Deadlines and retries
+        self.request_deadline = float(os.environ.get('LLM_REQUEST_DEADLINE_SECONDS', '120'))
+        self.attempt_timeout = float(os.environ.get('LLM_ATTEMPT_TIMEOUT_SECONDS', '60'))
+        self.stream_idle_timeout = float(os.environ.get('LLM_STREAM_IDLE_TIMEOUT_SECONDS', '30'))
+        self.max_retries = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+        self.retry_base_delay = float(os.environ.get('LLM_RETRY_BASE_DELAY_SECONDS', '0.5'))
+        self.retry_max_delay = float(os.environ.get('LLM_RETRY_MAX_DELAY_SECONDS', '8'))
+
+        # Hedging: a duplicate request once the first exceeds the model's latency percentile
+        self.hedge_enabled = os.environ.get('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.hedge_percentile = float(os.environ.get('LLM_HEDGE_PERCENTILE', '95'))
+        self.hedge_min_delay = float(os.environ.get('LLM_HEDGE_MIN_DELAY_SECONDS', '1'))
+
+        self.providers: Dict[str, LLMProvider] = {
+            "openrouter": OpenAICompatibleProvider(
+                "openrouter",
+                os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1'),
+                os.environ.get('OPENROUTER_API_KEY')
+            ),
+            "local": LocalProvider(float(os.environ.get('LLM_LOCAL_LATENCY_SECONDS', '0')))
+        }
+
+        # model -> {"provider", "price", "latency"}; unknown models default to OpenRouter
+        self.catalog: Dict[str, Dict[str, Any]] = {
+            DEFAULT_MODEL: {"provider": "openrouter", "price": 0.0, "latency": 5.0},
+            "local/echo": {"provider": "local", "price": 0.0, "latency": 0.0},
+        }
+        overrides = os.environ.get('LLM_MODEL_CATALOG')
+        if overrides:
+            for model, entry in json.loads(overrides).items():
+                self.catalog[model] = {**self.catalog.get(model, {}), **entry}
+        # Only configured models get routing stats and metric labels; ?model= is caller-chosen
+        self.known_models = {self.default_model, *self.fallback_models, *self.catalog}
+        metrics.register_models(self.known_models)
+
+        self.stats: Dict[str, ModelStats] = {}
+        self.breaker_threshold = int(os.environ.get('LLM_BREAKER_FAILURE_THRESHOLD', '5'))
+        self.breaker_recovery = float(os.environ.get('LLM_BREAKER_RECOVERY_SECONDS', '30'))
+        self.breakers: Dict[str, CircuitBreaker] = {
+            name: CircuitBreaker(name, self.breaker_threshold, self.breaker_recovery) for name in self.providers
+        }
+        for name, breaker in self.breakers.items():
+            metrics.LLM_CIRCUIT_STATE.labels(name).set_function(lambda breaker=breaker: metrics.CIRCUIT_STATE_VALUES[breaker.state])
+
+    def model_info(self, model: str) -> Dict[str, Any]:
+        info = self.catalog.get(model, {})
+        provider = info.get("provider") or ("local" if model.startswith("local/") else "openrouter")
+        return {"provider": provider, "price": info.get("price", 0.0), "latency": info.get("latency", 5.0)}
+
+    def provider_for(self, model: str) -> LLMProvider:
+        provider = self.model_info(model)["provider"]
+        if provider not in self.providers:
+            raise ProviderError(provider, model, "Unknown provider")
+        return self.providers[provider]
+
+    def _stats(self, model: str) -> ModelStats:
+        if model not in self.known_models:
+            # Neither kept nor shared: an unknown model routes on its catalog defaults
+            return ModelStats(self.model_info(model)["latency"])
+        if model not in self.stats:
+            self.stats[model] = ModelStats(self.model_info(model)["latency"])
+        return self.stats[model]
+
+    def candidates(self, model: Optional[str] = None) -> List[str]:
+        """Models to try for a request, in order"""
+        requested = model or self.default_model
+        models = [requested] + [fallback for fallback in self.fallback_models if fallback != requested]
+        if self.policy == "cheapest":
+            models.sort(key=lambda m: self.model_info(m)["price"])
+        elif self.policy == "fastest":
+            models.sort(key=lambda m: self.model_info(m)["latency"])
+        elif self.policy == "latency_aware":
+            models.sort(key=lambda m: self._stats(m).score(self.failure_cooldown))
+        return models
+
+    def record_success(self, model: str, latency: float):
+        self._stats(model).success(latency)
+
+    def record_failure(self, model: str):
+        self._stats(model).failure()
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        return self.breakers[self.model_info(model)["provider"]]
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds before a hedged duplicate is sent, or None when hedging does not apply yet"""
+        if not self.hedge_enabled:
+            return None
+        observed = self._stats(model).percentile(self.hedge_percentile)
+        if observed is None:
+            return None
+        return max(self.hedge_min_delay, observed)
+
+    def _record_outcome(self, breaker: CircuitBreaker, model: str, error: Optional[ProviderError], latency: float = 0.0):
+        # Non-retryable errors (bad request, auth) mean the provider answered, so they do not trip the breaker
+        if error is None or not error.retryable:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        if error is None:
+            self.record_success(model, latency)
+        else:
+            self.record_failure(model)
+
+    async def _attempt(self, model: str, messages: List[Dict[str, Any]], timeout: float) -> Dict[str, Any]:
+        """One provider call under its circuit breaker and a deadline"""
+        provider = self.provider_for(model)
+        breaker = self._breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{provider.name}/{model}: circuit open")
+
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(provider.complete(model, messages), timeout)
+        except asyncio.TimeoutError:
+            error = ProviderError(provider.name, model, f"Timed out after {timeout:.1f}s")
+            self._record_outcome(breaker, model, error)
+            raise error
+        except ProviderError as e:
+            self._record_outcome(breaker, model, e)
+            raise
+        except asyncio.CancelledError:
+            # A hedged loser or an abandoned request says nothing about provider health
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            # A malformed response or an unwrapped client error still settles a half-open trial
+            error = ProviderError(provider.name, model, f"{type(e).__name__}: {e}")
+            self._record_outcome(breaker, model, error)
+            raise error from e
+        self._record_outcome(breaker, model, None, time.monotonic() - started)
+        return response
+
+    async def _backoff(self, model: str, attempt: int, error: ProviderError, deadline: float) -> bool:
+        """Sleep before retrying the same model; False when a retry is not allowed or would miss the deadline"""
+        if not error.retryable or attempt >= self.max_retries:
+            return False
+        delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+        if time.monotonic() + delay >= deadline:
+            return False
+        metrics.LLM_RETRIES.labels(metrics.model_label(model)).inc()
+        logger.warning(f"Retrying {model} in {delay:.2f}s: {str(error)}")
+        await asyncio.sleep(delay)
+        return True
+
+    async def complete(self, messages: List[Dict[str, Any]], model: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+        """
+        Complete on the first candidate that succeeds within the request
+        deadline; returns the response and the model used. Each candidate gets
+        jittered retries for retryable errors, and optionally a hedged duplicate.
+        """
+        deadline = time.monotonic() + self.request_deadline
+        errors = []
+        for candidate in self.candidates(model):
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = min(self.attempt_timeout, remaining)
+                try:
+                    hedge_delay = self._hedge_delay(candidate)
+                    if hedge_delay is not None and hedge_delay < timeout:
+                        response = await hedged(
+                            lambda: self._attempt(candidate, messages, timeout),
+                            hedge_delay,
+                            on_hedge=lambda: metrics.LLM_HEDGES.labels(metrics.model_label(candidate)).inc()
+                        )
+                    else:
+                        response = await self._attempt(candidate, messages, timeout)
+                    return response, candidate
+                except CircuitOpenError as e:
+                    errors.append(str(e))
+                    break
+                except ProviderError as e:
+                    errors.append(str(e))
+                    if not await self._backoff(candidate, attempt, e, deadline):
+                        break
+            logger.warning(f"LLM calls to {candidate} failed, trying next model")
+        raise ProviderError("router", model or self.default_model, "All candidate models failed: " + "; ".join(errors))
+
+    async def _stream_attempt(self, model: str, messages: List[Dict[str, Any]], first_chunk_timeout: float) -> AsyncIterator[Dict[str, Any]]:
+        """One provider stream under its circuit breaker, with first-chunk and idle deadlines"""
+        provider = self.provider_for(model)
+        breaker = self._breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{provider.name}/{model}: circuit open")
+
+        started = time.monotonic()
+        chunks = provider.stream(model, messages).__aiter__()
+        produced = False
+        try:
+            while True:
+                timeout = self.stream_idle_timeout if produced else first_chunk_timeout
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise ProviderError(provider.name, model, f"No stream data for {timeout:.1f}s")
+                produced = True
+                yield chunk
+        except ProviderError as e:
+            self._record_outcome(breaker, model, e)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            error = ProviderError(provider.name, model, f"{type(e).__name__}: {e}")
+            self._record_outcome(breaker, model, error)
+            raise error from e
+        finally:
+            await chunks.aclose()
+        self._record_outcome(breaker, model, None, time.monotonic() - started)
+
+    async def stream(self, messages: List[Dict[str, Any]], model: Optional[str] = None) -> AsyncIterator[Tuple[Dict[str, Any], str]]:
+        """
+        Stream from the first candidate that produces a chunk. Retries and
+        failover only happen before anything was yielded; a stream that breaks
+        mid-response raises, since the client already holds partial output.
+        """
+        deadline = time.monotonic() + self.request_deadline
+        errors = []
+        for candidate in self.candidates(model):
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                produced = False
+                try:
+                    async for chunk in self._stream_attempt(candidate, messages, min(self.attempt_timeout, remaining)):
+                        produced = True
+                        yield chunk, candidate
+                    return
+                except CircuitOpenError as e:
+                    errors.append(str(e))
+                    break
+                except ProviderError as e:
+                    if produced:
+                        raise
+                    errors.append(str(e))
+                    if not await self._backoff(candidate, attempt, e, deadline):
+                        break
+            logger.warning(f"LLM streams from {candidate} failed, trying next model")
+        raise ProviderError("router", model or self.default_model, "All candidate models failed: " + "; ".join(errors))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "default_model": self.default_model,
+            "fallback_models": self.fallback_models,
+            "hedging": {"enabled": self.hedge_enabled, "percentile": self.hedge_percentile},
+            "circuits": {name: breaker.stats() for name, breaker in self.breakers.items()},
+            "models": {
+                model: {**self.model_info(model), "observed_latency": self._stats(model).latency}
+                for model in dict.fromkeys([*self.catalog, *sorted(self.known_models - set(self.catalog))])
+            }
+        }
+
+    async def aclose(self):
+        for provider in self.providers.values():
+            await provider.aclose()
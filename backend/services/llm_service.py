@@ -1,68 +1,122 @@
-from emergentintegrations.llm.chat import chat
-import os
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Optional, AsyncIterator
 import logging
 
+from services.llm_cache import llm_cache
+from services.llm_providers import ModelRouter, ProviderError
+from services import metrics
+from services.single_flight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 class LLMService:
     def __init__(self):
-        self.api_key = os.environ.get('OPENROUTER_API_KEY')
-        self.model = "deepseek/deepseek-r1-0528-qwen3-8b:free"
+        self.router = ModelRouter()
+        self.model = self.router.default_model
+        self.single_flight = SingleFlight()
         
-        if not self.api_key:
+        if self.router.model_info(self.model)["provider"] == "openrouter" and not self.router.providers["openrouter"].api_key:
             raise ValueError("OPENROUTER_API_KEY environment variable is required")
     
+    def _build_messages(
+        self,
+        system_prompt: str,
+        user_message: str,
+        conversation_history: Optional[list] = None
+    ) -> list:
+        """Assemble the system prompt, history and user message into chat messages"""
+        messages = []
+        
+        # Add system message
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        # Add conversation history if provided
+        if conversation_history:
+            messages.extend(conversation_history)
+        
+        # Add current user message
+        messages.append({
+            "role": "user",
+            "content": user_message
+        })
+        
+        return messages
+    
+    def _build_agent_prompt(self, agent_config: Dict[str, Any]) -> str:
+        """Enhance the agent's system prompt with agent-specific instructions"""
+        system_prompt = agent_config.get('system_prompt', '')
+        return f"""
+{system_prompt}
+
+You are an AI agent with the following configuration:
+- Name: {agent_config.get('name', 'Assistant')}
+- Description: {agent_config.get('description', '')}
+- Available Tools: {', '.join(agent_config.get('tools', []))}
+- Memory Enabled: {agent_config.get('memory_enabled', True)}
+
+Please respond according to your configuration and maintain consistency with your role.
+"""
+    
     async def chat_with_agent(
         self, 
         system_prompt: str, 
         user_message: str, 
-        conversation_history: Optional[list] = None
+        conversation_history: Optional[list] = None,
+        use_cache: bool = False,
+        model: Optional[str] = None
     ) -> Dict[str, Any]:
         """
-        Chat with an agent using the OpenRouter DeepSeek model
+        Chat with an agent on the requested model (default model if None),
+        failing over to the configured fallback models
         """
+        model = model or self.model
         try:
             # Prepare messages for the chat
-            messages = []
+            messages = self._build_messages(system_prompt, user_message, conversation_history)
             
-            # Add system message
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
+            request_key = llm_cache.make_key(model, messages)
             
-            # Add conversation history if provided
-            if conversation_history:
-                messages.extend(conversation_history)
-            
-            # Add current user message
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
+            # Serve identical requests from the response cache when opted in
+            if use_cache:
+                cached = await llm_cache.get(request_key)
+                if cached is not None:
+                    metrics.record_llm_outcome(model, "complete", "cached")
+                    return {**cached, "cached": True}
             
-            # Make the API call
-            response = await chat(
-                model=self.model,
-                messages=messages,
-                api_key=self.api_key,
-                provider="openrouter"
+            # Make the API call; identical concurrent requests share one upstream call
+            started = time.monotonic()
+            response, model_used = await self.single_flight.do(
+                request_key,
+                lambda: self.router.complete(messages, model)
             )
             
-            return {
+            result = {
                 "success": True,
                 "response": response.get('choices', [{}])[0].get('message', {}).get('content', ''),
                 "usage": response.get('usage', {}),
-                "model": self.model
+                "model": model_used
             }
+            metrics.observe_llm_call(model_used, "complete", time.monotonic() - started, result["usage"])
+            
+            # Keyed on the model that answered: a fallback's reply must not be
+            # served for the primary model once it recovers
+            if use_cache:
+                await llm_cache.set(llm_cache.make_key(model_used, messages), result)
+            
+            return result
             
         except Exception as e:
             logger.error(f"Error in chat_with_agent: {str(e)}")
+            metrics.record_llm_outcome(model, "complete", "error")
             return {
                 "success": False,
                 "error": str(e),
+                # Upstream exhaustion (retries, failover, open circuits, deadline) is a 503
+                "status_code": 503 if isinstance(e, ProviderError) else 500,
                 "response": "I apologize, but I encountered an error while processing your request."
             }
     
@@ -76,26 +130,17 @@ class LLMService:
         Generate a response from an agent with specific configuration
         """
         try:
-            system_prompt = agent_config.get('system_prompt', '')
             conversation_history = session_context.get('history', []) if session_context else []
             
             # Enhance system prompt with agent-specific instructions
-            enhanced_system_prompt = f"""
-{system_prompt}
-
-You are an AI agent with the following configuration:
-- Name: {agent_config.get('name', 'Assistant')}
-- Description: {agent_config.get('description', '')}
-- Available Tools: {', '.join(agent_config.get('tools', []))}
-- Memory Enabled: {agent_config.get('memory_enabled', True)}
-
-Please respond according to your configuration and maintain consistency with your role.
-"""
+            enhanced_system_prompt = self._build_agent_prompt(agent_config)
             
             result = await self.chat_with_agent(
                 system_prompt=enhanced_system_prompt,
                 user_message=user_message,
-                conversation_history=conversation_history
+                conversation_history=conversation_history,
+                use_cache=agent_config.get('cache_enabled', False),
+                model=agent_config.get('model')
             )
             
             return result
@@ -108,6 +153,82 @@ Please respond according to your configuration and maintain consistency with you
                 "response": "I apologize, but I encountered an error while processing your request."
             }
     
+    async def stream_chat(
+        self,
+        system_prompt: str,
+        user_message: str,
+        conversation_history: Optional[list] = None,
+        model: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat completion, yielding token events as they arrive and a
+        final "done" event carrying usage and timing
+        """
+        messages = self._build_messages(system_prompt, user_message, conversation_history)
+        model = model or self.model
+        
+        started = time.monotonic()
+        time_to_first_token = None
+        usage: Dict[str, Any] = {}
+        chunks = []
+        
+        try:
+            async for event, model_used in self.router.stream(messages, model):
+                model = model_used
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if not content:
+                        continue
+                    if time_to_first_token is None:
+                        time_to_first_token = time.monotonic() - started
+                    chunks.append(content)
+                    yield {"type": "token", "content": content}
+            
+            if not usage:
+                usage = {"completion_tokens": len(chunks), "total_tokens": len(chunks), "estimated": True}
+            
+            response_time = time.monotonic() - started
+            metrics.observe_llm_call(model, "stream", response_time, usage, time_to_first_token)
+            
+            yield {
+                "type": "done",
+                "success": True,
+                "response": "".join(chunks),
+                "usage": usage,
+                "model": model,
+                "response_time": response_time,
+                "time_to_first_token": time_to_first_token
+            }
+            
+        except Exception as e:
+            logger.error(f"Error in stream_chat: {str(e)}")
+            metrics.record_llm_outcome(model, "stream", "error")
+            yield {
+                "type": "error",
+                "success": False,
+                "error": str(e),
+                "response": "I apologize, but I encountered an error while processing your request."
+            }
+    
+    def stream_agent_response(
+        self,
+        agent_config: Dict[str, Any],
+        user_message: str,
+        session_context: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a response from an agent with specific configuration
+        """
+        conversation_history = session_context.get('history', []) if session_context else []
+        return self.stream_chat(
+            system_prompt=self._build_agent_prompt(agent_config),
+            user_message=user_message,
+            conversation_history=conversation_history,
+            model=agent_config.get('model')
+        )
+    
     async def test_connection(self) -> Dict[str, Any]:
         """
         Test the LLM connection
@@ -118,11 +239,12 @@ Please respond according to your configuration and maintain consistency with you
                 user_message="Hello! Please respond with 'Connection successful!' to confirm the integration is working."
             )
             
+            model = test_response.get('model', self.model)
             return {
                 "success": test_response.get('success', False),
-                "model": self.model,
+                "model": model,
                 "response": test_response.get('response', ''),
-                "provider": "openrouter"
+                "provider": self.router.model_info(model)["provider"]
             }
             
         except Exception as e:
@@ -130,8 +252,12 @@ Please respond according to your configuration and maintain consistency with you
             return {
                 "success": False,
                 "error": str(e),
-                "provider": "openrouter"
+                "provider": self.router.model_info(self.model)["provider"]
             }
+    
+    async def aclose(self):
+        """Close the providers' pooled HTTP clients"""
+        await self.router.aclose()
 
 # Create a singleton instance
 llm_service = LLMService()
\ No newline at end of file
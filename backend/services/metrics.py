@@ -0,0 +1,207 @@
+import time
+import threading
+import logging
+from typing import Dict, Any, Iterable, Optional, Set, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from pymongo import monitoring
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; LLM calls are orders of magnitude slower than Mongo
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=HTTP_BUCKETS
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served",
+    ["method", "route"]
+)
+MONGO_OPERATION_DURATION = Histogram(
+    "mongo_operation_duration_seconds",
+    "MongoDB command latency by collection and command",
+    ["collection", "operation"],
+    buckets=MONGO_BUCKETS
+)
+MONGO_OPERATION_ERRORS = Counter(
+    "mongo_operation_errors_total",
+    "MongoDB commands that failed",
+    ["collection", "operation"]
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "LLM completion latency",
+    ["model", "mode"],
+    buckets=LLM_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time until the first streamed token arrived",
+    ["model"],
+    buckets=LLM_BUCKETS
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total",
+    "LLM requests by outcome (success, error, cached)",
+    ["model", "mode", "outcome"]
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the provider",
+    ["model", "kind"]
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total",
+    "Retries of retryable LLM failures",
+    ["model"]
+)
+LLM_HEDGES = Counter(
+    "llm_hedged_requests_total",
+    "Duplicate LLM requests sent because the first exceeded the hedge threshold",
+    ["model"]
+)
+LLM_CIRCUIT_STATE = Gauge(
+    "llm_circuit_state",
+    "Provider circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["provider"]
+)
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+WORKFLOW_SCHEDULED_RUNS = Counter(
+    "workflow_scheduled_runs_total",
+    "Schedule trigger fires by outcome (fired, misfire, skipped_misfire, lost_race)",
+    ["outcome"]
+)
+CHAT_WRITE_QUEUE_DEPTH = Gauge(
+    "chat_write_queue_depth",
+    "Chat turns waiting in the write-behind buffer"
+)
+CHAT_WRITE_BATCH_SIZE = Histogram(
+    "chat_write_batch_size",
+    "Chat turns persisted per write-behind flush",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 200, 500, 1000)
+)
+
+# Models are labelled by name only once configured (catalog, default, fallbacks);
+# any other caller-chosen model counts as "other" so labels stay bounded
+OTHER_MODEL = "other"
+_labelled_models: Set[str] = set()
+
+def register_models(models: Iterable[str]):
+    _labelled_models.update(models)
+
+def model_label(model: str) -> str:
+    return model if model in _labelled_models else OTHER_MODEL
+
+def observe_llm_call(
+    model: str,
+    mode: str,
+    duration: float,
+    usage: Dict[str, Any],
+    time_to_first_token: Optional[float] = None
+):
+    """Record a successful LLM call"""
+    model = model_label(model)
+    LLM_REQUESTS.labels(model, mode, "success").inc()
+    LLM_REQUEST_DURATION.labels(model, mode).observe(duration)
+    if time_to_first_token is not None:
+        LLM_TIME_TO_FIRST_TOKEN.labels(model).observe(time_to_first_token)
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.labels(model, kind).inc(tokens)
+
+def record_llm_outcome(model: str, mode: str, outcome: str):
+    """Count an LLM request that did not reach the provider successfully (error) or never left (cached)"""
+    LLM_REQUESTS.labels(model_label(model), mode, outcome).inc()
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Times every command the driver sends. Callbacks run on the driver's
+    threads, so in-flight commands are tracked under a lock.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection", "unknown")
+        else:
+            collection = command.get(event.command_name)
+            if not isinstance(collection, str):
+                collection = "admin"
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finish(self, event) -> Tuple[str, str]:
+        with self._lock:
+            labels = self._pending.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            labels = ("unknown", event.command_name)
+        MONGO_OPERATION_DURATION.labels(*labels).observe(event.duration_micros / 1_000_000)
+        return labels
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        MONGO_OPERATION_ERRORS.labels(*self._finish(event)).inc()
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency and in-flight requests per route
+    template (e.g. /api/agents/{agent_id}) so ids do not explode label cardinality.
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def _route_template(self, scope: Scope) -> str:
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unmatched")
+        return "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route_template(scope)
+        status = "500"
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_DURATION.labels(method, route, status).observe(time.perf_counter() - started)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus text exposition of every registered metric"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+# Create a singleton instance
+mongo_command_listener = MongoCommandListener()
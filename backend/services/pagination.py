@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from fastapi import HTTPException, Query
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def page_limit(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)) -> int:
+    """Shared `limit` query parameter for list endpoints"""
+    return limit
+
+def encode_cursor(sort_value: Any, doc_id: str) -> str:
+    """Opaque cursor pointing just past (sort_value, id)"""
+    if isinstance(sort_value, datetime):
+        payload = {"t": sort_value.isoformat(), "i": doc_id}
+    else:
+        payload = {"v": sort_value, "i": doc_id}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if "t" in payload:
+            return datetime.fromisoformat(payload["t"]), payload["i"]
+        return payload["v"], payload["i"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def paginate(
+    collection: AsyncIOMotorCollection,
+    query: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    sort_field: str = "created_at",
+    descending: bool = True,
+    projection: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Keyset pagination over (sort_field, id); every page is an index range scan
+    no matter how deep the client has paged
+    """
+    direction = -1 if descending else 1
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor)
+        op = "$lt" if descending else "$gt"
+        keyset = {"$or": [
+            {sort_field: {op: sort_value}},
+            {sort_field: sort_value, "id": {op: last_id}}
+        ]}
+        query = {"$and": [query, keyset]} if query else keyset
+
+    docs = await collection.find(query, projection).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last["id"])
+
+    return {"items": docs, "limit": limit, "next_cursor": next_cursor}
+
+def encode_offset_cursor(offset: int) -> str:
+    """Opaque cursor for result sets ranked by a computed score, where keyset paging does not apply"""
+    raw = json.dumps({"o": offset}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_offset_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(padded.encode()))["o"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
@@ -0,0 +1,242 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services import cache
+
+logger = logging.getLogger(__name__)
+
+# rate: sustained requests/second, burst: bucket size, concurrency: in-flight
+# calls per user, plan_rate/plan_burst: aggregate bucket shared by the whole plan,
+# priority: lower is served first when the upstream is saturated
+DEFAULT_PLAN_LIMITS: Dict[str, Dict[str, float]] = {
+    "free": {"rate": 0.2, "burst": 5, "concurrency": 1, "plan_rate": 5, "plan_burst": 20, "priority": 2},
+    "pro": {"rate": 1, "burst": 20, "concurrency": 4, "plan_rate": 20, "plan_burst": 100, "priority": 1},
+    "enterprise": {"rate": 5, "burst": 50, "concurrency": 16, "plan_rate": 100, "plan_burst": 500, "priority": 0},
+    # Callers with no user behind them, limited per client address
+    "anonymous": {"rate": 0.1, "burst": 3, "concurrency": 1, "plan_rate": 2, "plan_burst": 10, "priority": 3},
+    # Maintenance calls the server makes on its own (history summaries), served last
+    "background": {"rate": 1, "burst": 5, "concurrency": 2, "plan_rate": 1, "plan_burst": 5, "priority": 4},
+}
+ANONYMOUS_PLAN = "anonymous"
+BACKGROUND_PLAN = "background"
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is rejected by admission control"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_take(self) -> float:
+        """Take one token; returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class PrioritySemaphore:
+    """Semaphore whose waiters are woken in priority order, with a bounded wait queue"""
+
+    def __init__(self, limit: int, max_waiters: int):
+        self.limit = limit
+        self.max_waiters = max_waiters
+        self.active = 0
+        self._waiters: list = []
+        self._counter = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int, timeout: float):
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+
+        if self.waiting >= self.max_waiters:
+            raise RateLimitExceeded("LLM wait queue is full", retry_after=1)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            # A released slot is handed directly to the woken waiter
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RateLimitExceeded("Timed out waiting for LLM capacity", retry_after=timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+class AdmissionController:
+    """
+    Per-user and per-plan token buckets in front of the LLM, plus a global
+    concurrency cap whose queue serves higher plans first
+    """
+
+    def __init__(self):
+        self.plan_limits = dict(DEFAULT_PLAN_LIMITS)
+        overrides = os.environ.get('LLM_PLAN_LIMITS')
+        if overrides:
+            for plan, limits in json.loads(overrides).items():
+                self.plan_limits[plan] = {**self.plan_limits.get(plan, DEFAULT_PLAN_LIMITS["free"]), **limits}
+
+        self.queue_timeout = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '30'))
+        self.max_tracked_users = int(os.environ.get('LLM_RATE_LIMIT_MAX_USERS', '100000'))
+        self.upstream = PrioritySemaphore(
+            limit=int(os.environ.get('LLM_MAX_CONCURRENCY', '32')),
+            max_waiters=int(os.environ.get('LLM_MAX_QUEUE', '200'))
+        )
+        self._user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._plan_buckets: Dict[str, TokenBucket] = {}
+        self._in_flight: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    def _limits(self, plan: str) -> Dict[str, float]:
+        return self.plan_limits.get(plan, self.plan_limits["free"])
+
+    def _user_bucket(self, user_key: str, limits: Dict[str, float]) -> TokenBucket:
+        bucket = self._user_buckets.get(user_key)
+        if bucket is None:
+            bucket = TokenBucket(limits["rate"], limits["burst"])
+            self._user_buckets[user_key] = bucket
+            while len(self._user_buckets) > self.max_tracked_users:
+                self._user_buckets.popitem(last=False)
+        self._user_buckets.move_to_end(user_key)
+        return bucket
+
+    def _plan_bucket(self, plan: str, limits: Dict[str, float]) -> TokenBucket:
+        bucket = self._plan_buckets.get(plan)
+        if bucket is None:
+            bucket = TokenBucket(limits["plan_rate"], limits["plan_burst"])
+            self._plan_buckets[plan] = bucket
+        return bucket
+
+    async def acquire(self, user_key: str, plan: str, max_wait: float = 0.0):
+        """
+        Admit one LLM call or raise RateLimitExceeded; pair with release().
+        Callers with nobody waiting on a response (workflow runs) pass max_wait
+        to sleep out rejections for up to that many seconds instead.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            try:
+                ticket = await self._try_acquire(user_key, plan)
+            except RateLimitExceeded as e:
+                remaining = deadline - time.monotonic()
+                if e.retry_after >= remaining:
+                    self.rejected += 1
+                    raise
+                await asyncio.sleep(e.retry_after)
+                continue
+            self.admitted += 1
+            return ticket
+
+    async def _try_acquire(self, user_key: str, plan: str) -> str:
+        limits = self._limits(plan)
+        # Buckets are keyed per plan so a plan change starts a fresh bucket
+        user_bucket_key = f"{plan}:{user_key}"
+
+        if self._in_flight.get(user_bucket_key, 0) >= limits["concurrency"]:
+            raise RateLimitExceeded("Too many concurrent LLM requests", retry_after=1)
+
+        user_bucket = self._user_bucket(user_bucket_key, limits)
+        wait = user_bucket.try_take()
+        if wait:
+            raise RateLimitExceeded("User rate limit exceeded", retry_after=wait)
+
+        plan_bucket = self._plan_bucket(plan, limits)
+        wait = plan_bucket.try_take()
+        if wait:
+            user_bucket.refund()
+            raise RateLimitExceeded(f"Rate limit for the {plan} plan exceeded", retry_after=wait)
+
+        self._in_flight[user_bucket_key] = self._in_flight.get(user_bucket_key, 0) + 1
+        try:
+            await self.upstream.acquire(int(limits["priority"]), self.queue_timeout)
+        except BaseException:
+            # No call was made, so a full queue or timeout costs no rate budget
+            self._release_user(user_bucket_key)
+            user_bucket.refund()
+            plan_bucket.refund()
+            raise
+        return user_bucket_key
+
+    def release(self, ticket: str):
+        self.upstream.release()
+        self._release_user(ticket)
+
+    def _release_user(self, user_bucket_key: str):
+        remaining = self._in_flight.get(user_bucket_key, 1) - 1
+        if remaining > 0:
+            self._in_flight[user_bucket_key] = remaining
+        else:
+            self._in_flight.pop(user_bucket_key, None)
+
+    @asynccontextmanager
+    async def admit(self, user_key: str, plan: str, max_wait: float = 0.0):
+        ticket = await self.acquire(user_key, plan, max_wait)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "active": self.upstream.active,
+            "queued": self.upstream.waiting,
+            "max_concurrency": self.upstream.limit,
+            "max_queue": self.upstream.max_waiters
+        }
+
+async def resolve_plan(db: AsyncIOMotorDatabase, user_id: Optional[str]) -> str:
+    """Subscription plan for a user, read through the in-process cache; unknown users are free"""
+    if not user_id:
+        return "free"
+
+    async def load():
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "subscription_plan": 1})
+        return user.get("subscription_plan", "free") if user else None
+
+    return await cache.user_plan_cache.get_or_load(user_id, load) or "free"
+
+def retry_after_header(error: RateLimitExceeded) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+
+# Create a singleton instance
+admission_controller = AdmissionController()
@@ -0,0 +1,176 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorCollection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+class Repository:
+    """
+    Single-round-trip access to a collection keyed by the string `id` field.
+
+    Mutations use find_one_and_* so the existence check, the write and the
+    read-back happen atomically on the server.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+
+    def collection(self, db: AsyncIOMotorDatabase) -> AsyncIOMotorCollection:
+        return db[self.collection_name]
+
+    async def get(self, db: AsyncIOMotorDatabase, doc_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection(db).find_one({"id": doc_id}, {"_id": 0})
+
+    async def insert(self, db: AsyncIOMotorDatabase, document: Dict[str, Any]):
+        await self.collection(db).insert_one(document)
+
+    async def update_fields(
+        self,
+        db: AsyncIOMotorDatabase,
+        doc_id: str,
+        fields: Dict[str, Any],
+        touch: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """$set the given fields and return the updated document, or None if missing"""
+        fields = dict(fields)
+        if touch:
+            fields["updated_at"] = datetime.utcnow()
+        return await self.modify(db, doc_id, {"$set": fields})
+
+    async def modify(
+        self,
+        db: AsyncIOMotorDatabase,
+        doc_id: str,
+        update: Union[Dict[str, Any], List[Dict[str, Any]]]
+    ) -> Optional[Dict[str, Any]]:
+        """Apply a raw update document or pipeline and return the result, or None if missing"""
+        return await self.collection(db).find_one_and_update(
+            {"id": doc_id},
+            update,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def delete(self, db: AsyncIOMotorDatabase, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Delete the document and return it, or None if it did not exist"""
+        return await self.collection(db).find_one_and_delete({"id": doc_id}, projection={"_id": 0})
+
+    async def bulk_insert(
+        self,
+        db: AsyncIOMotorDatabase,
+        documents: List[Dict[str, Any]],
+        ordered: bool = True
+    ) -> List[Dict[str, Any]]:
+        """insert_many with per-item results"""
+        results = [{"index": i, "id": doc["id"], "status": "created"} for i, doc in enumerate(documents)]
+        if not documents:
+            return results
+        
+        try:
+            await self.collection(db).insert_many(documents, ordered=ordered)
+        except BulkWriteError as e:
+            _apply_write_errors(results, e, ordered)
+        return results
+
+    async def bulk_update(
+        self,
+        db: AsyncIOMotorDatabase,
+        updates: List[Tuple[str, Dict[str, Any]]],
+        ordered: bool = True
+    ) -> List[Dict[str, Any]]:
+        """One bulk_write of $set operations with per-item results"""
+        results = [{"index": i, "id": doc_id, "status": "updated"} for i, (doc_id, _) in enumerate(updates)]
+        if not updates:
+            return results
+        
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"id": doc_id}, {"$set": {**fields, "updated_at": now}})
+            for doc_id, fields in updates
+        ]
+        try:
+            await self.collection(db).bulk_write(operations, ordered=ordered)
+        except BulkWriteError as e:
+            _apply_write_errors(results, e, ordered)
+        
+        # bulk_write only reports totals, so resolve which ids matched nothing
+        ids = [doc_id for doc_id, _ in updates]
+        existing = {
+            doc["id"] for doc in await self.collection(db).find(
+                {"id": {"$in": ids}}, {"_id": 0, "id": 1}
+            ).to_list(None)
+        }
+        for result in results:
+            if result["status"] == "updated" and result["id"] not in existing:
+                result["status"] = "not_found"
+        return results
+
+    async def bulk_delete(
+        self,
+        db: AsyncIOMotorDatabase,
+        ids: List[str],
+        projection: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Delete many documents; returns per-item results and the deleted documents"""
+        documents = await self.collection(db).find(
+            {"id": {"$in": ids}}, projection or {"_id": 0}
+        ).to_list(None)
+        found = {doc["id"] for doc in documents}
+        if found:
+            await self.collection(db).delete_many({"id": {"$in": list(found)}})
+        
+        results = [
+            {"index": i, "id": doc_id, "status": "deleted" if doc_id in found else "not_found"}
+            for i, doc_id in enumerate(ids)
+        ]
+        return results, documents
+
+def _apply_write_errors(results: List[Dict[str, Any]], error: BulkWriteError, ordered: bool):
+    write_errors = error.details.get("writeErrors", [])
+    for write_error in write_errors:
+        message = write_error.get("errmsg", "Write failed")
+        key_pattern = write_error.get("keyPattern")
+        if write_error.get("code") == 11000 and key_pattern:
+            message = f"Duplicate {next(iter(key_pattern))}"
+        results[write_error["index"]].update(status="error", error=message)
+    
+    # An ordered batch stops at its first failure
+    if ordered and write_errors:
+        first_failure = min(write_error["index"] for write_error in write_errors)
+        for result in results[first_failure + 1:]:
+            result.update(status="skipped", error="Not attempted after an earlier failure in an ordered batch")
+
+def merge_rejected(
+    total: int,
+    attempted: List[int],
+    results: List[Dict[str, Any]],
+    rejected: Dict[int, Dict[str, Any]],
+    ordered: bool
+) -> List[Dict[str, Any]]:
+    """
+    Combine the results of the items that were written with items rejected
+    before the write (e.g. by validation), indexed by request position. An
+    ordered batch stops at its first rejection, so nothing after it was attempted.
+    """
+    written = dict(zip(attempted, results))
+    first_rejected = min(rejected) if ordered and rejected else total
+    merged = []
+    for index in range(total):
+        if index in rejected:
+            merged.append({**rejected[index], "index": index, "status": "error"})
+        elif index in written and index < first_rejected:
+            merged.append({**written[index], "index": index})
+        else:
+            merged.append({"index": index, "status": "skipped", "error": "Not attempted after an earlier failure in an ordered batch"})
+    return merged
+
+def summarize_bulk(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Shape per-item results into a BulkResult payload"""
+    succeeded = sum(1 for result in results if result["status"] in ("created", "updated", "deleted"))
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+agents_repository = Repository("agents")
+workflows_repository = Repository("workflows")
+templates_repository = Repository("templates")
+users_repository = Repository("users")
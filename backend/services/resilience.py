@@ -0,0 +1,110 @@
+import asyncio
+import random
+import time
+import logging
+from typing import Dict, Any, Callable, Awaitable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After `failure_threshold` failures in
+    a row the circuit opens and calls are rejected for `recovery_timeout`
+    seconds; then up to `half_open_max_calls` trial calls decide whether it
+    closes again or re-opens.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self.half_open_calls = 0
+            logger.info(f"Circuit {self.name} half-open; sending trial calls")
+
+        if self.state == HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.rejected += 1
+                return False
+            self.half_open_calls += 1
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Return a half-open trial slot for a call that ended without a verdict (e.g. cancelled)"""
+        if self.state == HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected
+        }
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff for the given 0-based retry number"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: float, on_hedge: Callable[[], None] = lambda: None) -> T:
+    """
+    Run `call`; if it has not finished after `delay` seconds start a second,
+    identical call and return whichever succeeds first. The loser is cancelled.
+    If both fail, the last error is raised.
+    """
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result()
+
+        on_hedge()
+        tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Also reached when the caller is cancelled mid-wait
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,32 @@
+from functools import lru_cache
+from typing import Dict, Any, List, Type
+
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+@lru_cache(maxsize=None)
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning only the fields the model declares"""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+def dump_documents(model: Type[BaseModel], documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Validate raw documents against the model in one pass and dump them to plain dicts"""
+    adapter = _list_adapter(model)
+    return adapter.dump_python(adapter.validate_python(documents))
+
+def page_response(model: Type[BaseModel], page: Dict[str, Any]) -> ORJSONResponse:
+    """
+    Serialize a paginate() result directly. Returning a Response bypasses
+    FastAPI's response_model pass, which would otherwise re-validate every
+    row and walk it through jsonable_encoder; the declared response_model is
+    still used for the OpenAPI schema.
+    """
+    return ORJSONResponse({
+        "items": dump_documents(model, page["items"]),
+        "limit": page["limit"],
+        "next_cursor": page["next_cursor"]
+    })
@@ -0,0 +1,220 @@
+import asyncio
+import gzip
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+def compress(payload: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(payload)
+    return gzip.compress(payload, compresslevel=6)
+
+def decompress(payload: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return gzip.decompress(payload)
+
+def _after(message: Dict[str, Any], after: Optional[datetime], after_id: Optional[str]) -> bool:
+    if after is None:
+        return True
+    if after_id is None:
+        return message["timestamp"] > after
+    return (message["timestamp"], message["id"]) > (after, after_id)
+
+def _after_query(after: Optional[datetime], after_id: Optional[str]) -> Dict[str, Any]:
+    if after is None:
+        return {}
+    if after_id is None:
+        return {"timestamp": {"$gt": after}}
+    return {"$or": [{"timestamp": {"$gt": after}}, {"timestamp": after, "id": {"$gt": after_id}}]}
+
+async def read_session_messages(
+    db: AsyncIOMotorDatabase,
+    session_id: str,
+    limit: int,
+    after: Optional[datetime] = None,
+    after_id: Optional[str] = None,
+    agent_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Up to `limit` messages of a session in (timestamp, id) order, starting just
+    past (after, after_id) -- or strictly after `after` when no id is given.
+    Archived segments are older than anything left in chat_messages, so they
+    are read first and the live collection fills the rest.
+    """
+    scope = {"session_id": session_id}
+    if agent_id is not None:
+        scope["agent_id"] = agent_id
+
+    messages: List[Dict[str, Any]] = []
+    seen = set()
+    segments = {**scope}
+    if after is not None:
+        segments["last_timestamp"] = {"$gte": after}
+    async for segment in db.chat_archives.find(segments, {"_id": 0}).sort("first_timestamp", 1):
+        for message in bson.decode(decompress(segment["data"], segment["codec"]))["messages"]:
+            if _after(message, after, after_id) and message["id"] not in seen:
+                seen.add(message["id"])
+                messages.append(message)
+        if len(messages) >= limit:
+            return messages[:limit]
+
+    if messages:
+        last = messages[-1]
+        after, after_id = last["timestamp"], last["id"]
+    query = {**scope, **_after_query(after, after_id)}
+    remaining = limit - len(messages)
+    # An interrupted compaction can leave archived messages behind; skip the duplicates
+    async for message in db.chat_messages.find(query, {"_id": 0}).sort([("timestamp", 1), ("id", 1)]).limit(remaining + len(seen)):
+        if message["id"] not in seen:
+            messages.append(message)
+            if len(messages) >= limit:
+                break
+    return messages
+
+async def read_latest_session_messages(
+    db: AsyncIOMotorDatabase,
+    session_id: str,
+    limit: int,
+    after: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    The newest `limit` messages of a session newer than `after`, newest first.
+    Archived segments are only decoded when chat_messages holds fewer than
+    `limit`, i.e. for a session revived after compaction.
+    """
+    query: Dict[str, Any] = {"session_id": session_id}
+    if after is not None:
+        query["timestamp"] = {"$gt": after}
+    messages = await db.chat_messages.find(query, {"_id": 0}).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+    if len(messages) >= limit:
+        return messages
+
+    seen = {message["id"] for message in messages}
+    segments = {"session_id": session_id}
+    if after is not None:
+        segments["last_timestamp"] = {"$gt": after}
+    async for segment in db.chat_archives.find(segments, {"_id": 0}).sort("first_timestamp", -1):
+        archived = bson.decode(decompress(segment["data"], segment["codec"]))["messages"]
+        for message in reversed(archived):
+            if _after(message, after, None) and message["id"] not in seen:
+                seen.add(message["id"])
+                messages.append(message)
+        if len(messages) >= limit:
+            break
+    return messages[:limit]
+
+class SessionArchiver:
+    """
+    Background compaction of inactive chat sessions: their chat_messages are
+    packed into compressed per-session archive segments in chat_archives and
+    removed from the hot collection. Segments optionally expire via a TTL index.
+    """
+
+    def __init__(self):
+        self.interval = int(os.environ.get('CHAT_ARCHIVE_INTERVAL_SECONDS', '3600'))
+        self.inactive_after = timedelta(days=float(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', '30')))
+        self.ttl_days = float(os.environ.get('CHAT_ARCHIVE_TTL_DAYS', '0'))
+        self.batch_size = int(os.environ.get('CHAT_ARCHIVE_BATCH', '100'))
+        self.segment_size = int(os.environ.get('CHAT_ARCHIVE_SEGMENT_MESSAGES', '1000'))
+        self.codec = os.environ.get('CHAT_ARCHIVE_CODEC', 'zstd')
+        if self.codec == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed; chat archives will use gzip")
+            self.codec = "gzip"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, db: AsyncIOMotorDatabase):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                archived = await self.compact(db)
+                if archived:
+                    logger.info(f"Archived {archived} inactive chat sessions")
+            except Exception as e:
+                logger.error(f"Chat session compaction failed: {str(e)}")
+
+    async def compact(self, db: AsyncIOMotorDatabase) -> int:
+        """Archive every session idle past the cutoff, in batches. Returns the number of sessions archived."""
+        cutoff = datetime.utcnow() - self.inactive_after
+        archived = 0
+        while True:
+            sessions = await db.chat_sessions.find(
+                {"updated_at": {"$lt": cutoff}, "archived_at": {"$exists": False}},
+                {"_id": 0, "id": 1, "agent_id": 1, "updated_at": 1}
+            ).limit(self.batch_size).to_list(self.batch_size)
+            for session in sessions:
+                await self.archive_session(db, session)
+            archived += len(sessions)
+            if len(sessions) < self.batch_size:
+                return archived
+
+    async def archive_session(self, db: AsyncIOMotorDatabase, session: Dict[str, Any]):
+        """
+        Pack a session's live messages into segments, then delete them. Segment ids
+        derive from their first message, so a rerun after a crash replaces rather
+        than duplicates a segment. The session is only marked archived if no turn
+        arrived meanwhile (its updated_at is unchanged); otherwise it stays
+        eligible and the new turns are compacted on a later run.
+        """
+        now = datetime.utcnow()
+        messages = await db.chat_messages.find(
+            {"session_id": session["id"]}, {"_id": 0}
+        ).sort([("timestamp", 1), ("id", 1)]).to_list(None)
+
+        operations = []
+        for start in range(0, len(messages), self.segment_size):
+            chunk = messages[start:start + self.segment_size]
+            raw = bson.encode({"messages": chunk})
+            segment = {
+                "id": f"{session['id']}:{chunk[0]['id']}",
+                "session_id": session["id"],
+                "agent_id": session["agent_id"],
+                "codec": self.codec,
+                "message_count": len(chunk),
+                "first_timestamp": chunk[0]["timestamp"],
+                "last_timestamp": chunk[-1]["timestamp"],
+                "raw_bytes": len(raw),
+                "data": compress(raw, self.codec),
+                "archived_at": now
+            }
+            if self.ttl_days > 0:
+                segment["expires_at"] = now + timedelta(days=self.ttl_days)
+            operations.append(ReplaceOne({"id": segment["id"]}, segment, upsert=True))
+
+        if operations:
+            await db.chat_archives.bulk_write(operations, ordered=True)
+            await db.chat_messages.delete_many({"id": {"$in": [message["id"] for message in messages]}})
+        # A new turn clears archived_at again (see chat_writer), making the session eligible next time
+        await db.chat_sessions.update_one(
+            {"id": session["id"], "updated_at": session.get("updated_at")},
+            {"$set": {"archived_at": now}}
+        )
+
+# Create a singleton instance
+session_archiver = SessionArchiver()
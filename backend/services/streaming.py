@@ -0,0 +1,30 @@
+import json
+from typing import Dict, Any, AsyncIterator, Callable
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Encode an event dict as a server-sent-events frame"""
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, default=str)}\n\n"
+
+class SSEResponse(StreamingResponse):
+    """
+    Server-sent-events response that calls `on_close` once the response is
+    over however it ends: finished, failed, or abandoned by a client that
+    disconnected before the stream was first iterated
+    """
+
+    def __init__(self, content: AsyncIterator[str], on_close: Callable[[], None]):
+        super().__init__(
+            content,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
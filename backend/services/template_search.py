@@ -0,0 +1,113 @@
+import os
+from typing import Dict, Any, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.pagination import paginate, encode_offset_cursor, decode_offset_cursor
+
+# Ranking blends text relevance with popularity; usage is log-scaled so a few
+# viral templates do not drown out relevance entirely
+TEXT_WEIGHT = float(os.environ.get('TEMPLATE_SEARCH_TEXT_WEIGHT', '1.0'))
+USAGE_WEIGHT = float(os.environ.get('TEMPLATE_SEARCH_USAGE_WEIGHT', '0.5'))
+RATING_WEIGHT = float(os.environ.get('TEMPLATE_SEARCH_RATING_WEIGHT', '0.3'))
+MAX_TAG_FACETS = 50
+
+def popularity_expression() -> Dict[str, Any]:
+    """Usage/rating part of the rank, stored on templates as `popularity`"""
+    return {"$add": [
+        {"$multiply": [USAGE_WEIGHT, {"$ln": {"$add": [{"$ifNull": ["$usage_count", 0]}, 1]}}]},
+        {"$multiply": [RATING_WEIGHT, {"$ifNull": ["$rating", 0]}]}
+    ]}
+
+async def refresh_popularity(db: AsyncIOMotorDatabase) -> int:
+    """Recompute stored popularity that is missing or was computed with other weights"""
+    result = await db.templates.update_many(
+        {"$expr": {"$ne": [{"$ifNull": ["$popularity", None]}, popularity_expression()]}},
+        [{"$set": {"popularity": popularity_expression()}}]
+    )
+    return result.modified_count
+
+def build_facet_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Category/tag facets and the total for the documents matching `match`"""
+    return [
+        {"$match": match},
+        {"$facet": {
+            "categories": [
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ],
+            "tags": [
+                {"$unwind": "$tags"},
+                {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": MAX_TAG_FACETS}
+            ],
+            "total": [{"$count": "count"}]
+        }}
+    ]
+
+def build_search_pipeline(
+    query: str,
+    filters: Dict[str, Any],
+    offset: int,
+    limit: int
+) -> List[Dict[str, Any]]:
+    """Aggregation returning one page of text matches ranked by relevance and popularity, plus facets"""
+    match, facet = build_facet_pipeline({**filters, "$text": {"$search": query}})
+    facet["$facet"]["results"] = [
+        {"$addFields": {"_rank": {"$add": [
+            {"$multiply": [TEXT_WEIGHT, "$_text_score"]},
+            popularity_expression()
+        ]}}},
+        {"$sort": {"_rank": -1, "id": 1}},
+        {"$skip": offset},
+        {"$limit": limit + 1},
+        {"$project": {"_id": 0, "_text_score": 0}}
+    ]
+    # The text score is only available before $facet
+    return [match, {"$addFields": {"_text_score": {"$meta": "textScore"}}}, facet]
+
+def _facet_counts(facets: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "category": [{"value": row["_id"], "count": row["count"]} for row in facets["categories"]],
+        "tag": [{"value": row["_id"], "count": row["count"]} for row in facets["tags"]]
+    }
+
+async def search_templates(
+    db: AsyncIOMotorDatabase,
+    query: Optional[str],
+    filters: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    One page of search results. Text queries rank by a computed score and page
+    by offset; browsing without a query pages by keyset over the stored
+    popularity, so deep pages stay index range scans.
+    """
+    if not query:
+        page = await paginate(db.templates, filters, limit, cursor, sort_field="popularity", projection={"_id": 0})
+        for doc in page["items"]:
+            doc["score"] = doc.get("popularity", 0.0)
+        facets = (await db.templates.aggregate(build_facet_pipeline(filters)).to_list(1))[0]
+        return {
+            "items": page["items"],
+            "next_cursor": page["next_cursor"],
+            "total": facets["total"][0]["count"] if facets["total"] else 0,
+            "facets": _facet_counts(facets)
+        }
+
+    offset = decode_offset_cursor(cursor)
+    facets = (await db.templates.aggregate(build_search_pipeline(query, filters, offset, limit)).to_list(1))[0]
+    results = facets["results"]
+    has_more = len(results) > limit
+    results = results[:limit]
+    for doc in results:
+        doc["score"] = doc.pop("_rank", 0.0)
+
+    return {
+        "items": results,
+        "next_cursor": encode_offset_cursor(offset + limit) if has_more else None,
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        "facets": _facet_counts(facets)
+    }
@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteMany, UpdateOne
+
+from services.cron import CronExpression
+from services.leases import acquire_lease, process_owner, release_lease
+from services.metrics import WORKFLOW_SCHEDULED_RUNS
+from services.workflow_queue import workflow_queue
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_TRIGGER_TYPES = ("schedule", "cron", "interval")
+MISFIRE_POLICIES = ("run_once", "skip", "catch_up")
+MIN_INTERVAL_SECONDS = 1.0
+LEASE_ID = "trigger_scheduler"
+
+def _to_millis(moment: datetime) -> datetime:
+    """Mongo stores milliseconds; fire times must round-trip exactly for the compare-and-set"""
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+
+class ScheduleSpec:
+    """
+    A workflow trigger that fires on a schedule:
+    {"type": "schedule", "cron": "*/5 * * * *"} or {"type": "interval", "interval_seconds": 300},
+    with optional inputs, priority, jitter_seconds and misfire (run_once, skip, catch_up).
+    """
+
+    def __init__(self, trigger: Dict[str, Any], default_jitter: float = 0.0):
+        cron, interval = trigger.get("cron"), trigger.get("interval_seconds")
+        if bool(cron) == bool(interval):
+            raise ValueError("Schedule triggers need exactly one of cron or interval_seconds")
+        self.cron = CronExpression(str(cron)) if cron else None
+        self.interval = None
+        if interval:
+            try:
+                self.interval = timedelta(seconds=float(interval))
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid interval_seconds '{interval}'")
+            if self.interval.total_seconds() < MIN_INTERVAL_SECONDS:
+                raise ValueError(f"interval_seconds must be at least {MIN_INTERVAL_SECONDS}")
+
+        self.misfire = trigger.get("misfire", "run_once")
+        if self.misfire not in MISFIRE_POLICIES:
+            raise ValueError(f"misfire must be one of {', '.join(MISFIRE_POLICIES)}")
+        try:
+            self.jitter = max(float(trigger.get("jitter_seconds", default_jitter)), 0.0)
+            self.priority = int(trigger.get("priority", 0))
+        except (TypeError, ValueError):
+            raise ValueError("jitter_seconds and priority must be numeric")
+        self.inputs = trigger.get("inputs") or {}
+        if not isinstance(self.inputs, dict):
+            raise ValueError("Trigger inputs must be an object")
+        self.hash = hashlib.sha256(json.dumps(trigger, sort_keys=True, default=str).encode()).hexdigest()
+
+    def next_after(self, moment: datetime) -> datetime:
+        if self.cron:
+            return self.cron.next_after(moment)
+        return _to_millis(moment + self.interval)
+
+    def resume_after(self, anchor: datetime, now: datetime) -> datetime:
+        """First occurrence after `now`, keeping an interval's cadence relative to `anchor`"""
+        if self.cron:
+            return self.cron.next_after(now)
+        periods = (now - anchor) // self.interval + 1
+        return _to_millis(anchor + periods * self.interval)
+
+def is_schedule_trigger(trigger: Dict[str, Any]) -> bool:
+    return isinstance(trigger, dict) and trigger.get("type") in SCHEDULE_TRIGGER_TYPES
+
+def validate_triggers(triggers: List[Dict[str, Any]]):
+    """Raise ValueError naming the first invalid schedule trigger"""
+    for index, trigger in enumerate(triggers or []):
+        if is_schedule_trigger(trigger):
+            try:
+                ScheduleSpec(trigger)
+            except ValueError as e:
+                raise ValueError(f"Trigger {index}: {str(e)}")
+
+class TriggerScheduler:
+    """
+    Fires schedule triggers of active workflows by enqueueing runs on the
+    workflow queue. Due times sit in an in-memory heap, so the loop sleeps
+    until the next one (or a lease renewal) instead of polling. Only the
+    replica holding the Mongo lease schedules; each fire is additionally a
+    compare-and-set on the stored next_fire_at, so a lease handover cannot
+    double-fire. Stored fire times survive restarts, which is how misfires
+    after downtime are detected and handled per the trigger's misfire policy.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+        self.lease_seconds = float(os.environ.get('SCHEDULER_LEASE_SECONDS', '30'))
+        self.reload_interval = float(os.environ.get('SCHEDULER_RELOAD_SECONDS', '60'))
+        self.max_concurrency = int(os.environ.get('SCHEDULER_MAX_CONCURRENT_FIRES', '16'))
+        self.default_jitter = float(os.environ.get('SCHEDULER_JITTER_SECONDS', '1'))
+        self.misfire_grace = float(os.environ.get('SCHEDULER_MISFIRE_GRACE_SECONDS', '60'))
+        self.max_catch_up = int(os.environ.get('SCHEDULER_MAX_CATCH_UP', '10'))
+        self.owner = process_owner()
+        self.db: Optional[AsyncIOMotorDatabase] = None
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+        self._fires: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._wakeup = asyncio.Event()
+        # (due time including jitter, tiebreaker, schedule id, stored fire time)
+        self._heap: List[Tuple[datetime, int, str, datetime]] = []
+        self._schedules: Dict[str, Dict[str, Any]] = {}
+        self._sequence = itertools.count()
+        self._lease_renew_at: Optional[datetime] = None
+        self._next_reload: Optional[datetime] = None
+        self._dirty = True
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if self.enabled and self._task is None:
+            self.db = db
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Trigger scheduler started as {self.owner}")
+
+    async def stop(self):
+        """Stop scheduling, let in-flight fires finish and hand the lease over"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await asyncio.gather(*self._fires, return_exceptions=True)
+        if self.is_leader:
+            try:
+                await release_lease(self.db, LEASE_ID, self.owner)
+            except Exception as e:
+                logger.error(f"Failed to release scheduler lease: {str(e)}")
+        self._reset()
+        logger.info("Trigger scheduler stopped")
+
+    def notify_changed(self):
+        """Reload schedules soon; called when workflows are saved on this replica"""
+        self._dirty = True
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leader": self.is_leader,
+            "owner": self.owner,
+            "schedules": len(self._schedules),
+            "next_due_at": self._heap[0][0] if self._heap else None,
+            "firing": len(self._fires)
+        }
+
+    def _reset(self):
+        self.is_leader = False
+        self._heap = []
+        self._schedules = {}
+        self._lease_renew_at = None
+        self._dirty = True
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Trigger scheduler error: {str(e)}")
+            await self._sleep()
+
+    async def _tick(self):
+        now = datetime.utcnow()
+        if self._lease_renew_at is None or now >= self._lease_renew_at:
+            leader = await self._acquire_lease(now)
+            if leader and not self.is_leader:
+                logger.info("Trigger scheduler acquired the lease")
+                self._dirty = True
+            elif self.is_leader and not leader:
+                logger.warning("Trigger scheduler lost the lease")
+                self._reset()
+            self.is_leader = leader
+            self._lease_renew_at = now + timedelta(seconds=self.lease_seconds / 3)
+        if not self.is_leader:
+            return
+
+        if self._dirty or now >= self._next_reload:
+            self._dirty = False
+            await self._reload(now)
+            self._next_reload = now + timedelta(seconds=self.reload_interval)
+
+        while self._heap and self._heap[0][0] <= now:
+            _, _, schedule_id, fire_at = heapq.heappop(self._heap)
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._fire(schedule_id, fire_at))
+            self._fires.add(task)
+            task.add_done_callback(self._fire_done)
+
+    def _fire_done(self, task: asyncio.Task):
+        self._fires.discard(task)
+        self._semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Scheduled fire failed: {str(task.exception())}")
+
+    async def _sleep(self):
+        now = datetime.utcnow()
+        deadlines = [self._lease_renew_at or now]
+        if self.is_leader:
+            deadlines.append(self._next_reload or now)
+            if self._heap:
+                deadlines.append(self._heap[0][0])
+        timeout = max((min(deadlines) - now).total_seconds(), 0.0)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _acquire_lease(self, now: datetime) -> bool:
+        """Take or renew the single scheduler lease; False while another replica holds it"""
+        return await acquire_lease(self.db, LEASE_ID, self.owner, self.lease_seconds, now)
+
+    def _push(self, schedule_id: str, fire_at: datetime, spec: ScheduleSpec):
+        due = fire_at + timedelta(seconds=random.uniform(0, spec.jitter)) if spec.jitter else fire_at
+        heapq.heappush(self._heap, (due, next(self._sequence), schedule_id, fire_at))
+        if self._heap[0][2] == schedule_id:
+            # The loop may be sleeping towards a later deadline
+            self._wakeup.set()
+
+    async def _reload(self, now: datetime):
+        """Sync stored schedules with the active workflows' triggers and rebuild the heap"""
+        desired: Dict[str, Dict[str, Any]] = {}
+        cursor = self.db.workflows.find(
+            {"status": "active", "triggers.type": {"$in": list(SCHEDULE_TRIGGER_TYPES)}},
+            {"_id": 0, "id": 1, "triggers": 1}
+        )
+        async for workflow in cursor:
+            for index, trigger in enumerate(workflow.get("triggers") or []):
+                if not is_schedule_trigger(trigger):
+                    continue
+                try:
+                    spec = ScheduleSpec(trigger, self.default_jitter)
+                except ValueError as e:
+                    logger.warning(f"Ignoring trigger {index} of workflow {workflow['id']}: {str(e)}")
+                    continue
+                desired[f"{workflow['id']}:{index}"] = {"workflow_id": workflow["id"], "trigger_index": index, "spec": spec}
+
+        stored = {
+            doc["id"]: doc for doc in await self.db.workflow_schedules.find({}, {"_id": 0}).to_list(None)
+        }
+        operations = []
+        schedules = {}
+        for schedule_id, entry in desired.items():
+            spec = entry["spec"]
+            doc = stored.get(schedule_id)
+            if doc is None or doc.get("spec_hash") != spec.hash:
+                # New or edited triggers start from now; past occurrences are not misfires
+                doc = {
+                    "id": schedule_id,
+                    "workflow_id": entry["workflow_id"],
+                    "trigger_index": entry["trigger_index"],
+                    "spec_hash": spec.hash,
+                    "next_fire_at": _to_millis(spec.next_after(now)),
+                    "last_fired_at": doc.get("last_fired_at") if doc else None
+                }
+                operations.append(UpdateOne({"id": schedule_id}, {"$set": doc}, upsert=True))
+            schedules[schedule_id] = {**entry, "next_fire_at": doc["next_fire_at"]}
+
+        removed = [schedule_id for schedule_id in stored if schedule_id not in desired]
+        if removed:
+            operations.append(DeleteMany({"id": {"$in": removed}}))
+        if operations:
+            await self.db.workflow_schedules.bulk_write(operations, ordered=False)
+
+        self._schedules = schedules
+        self._heap = []
+        for schedule_id, entry in schedules.items():
+            self._push(schedule_id, entry["next_fire_at"], entry["spec"])
+        logger.info(f"Trigger scheduler loaded {len(schedules)} schedules")
+
+    def _plan_fire(self, spec: ScheduleSpec, fire_at: datetime, now: datetime) -> Tuple[List[datetime], datetime]:
+        """
+        Occurrences to run now and the next fire time. Past the grace period the
+        misfire policy applies: run_once fires once for everything missed, skip
+        drops it, catch_up fires up to max_catch_up missed occurrences, oldest first.
+        """
+        missed = [fire_at]
+        next_at = spec.next_after(fire_at)
+        while next_at <= now and len(missed) < self.max_catch_up:
+            missed.append(next_at)
+            next_at = spec.next_after(next_at)
+        if next_at <= now:
+            # Beyond the catch-up cap the rest are dropped
+            next_at = spec.resume_after(fire_at, now)
+
+        if (now - fire_at).total_seconds() <= self.misfire_grace:
+            return missed, next_at
+        if spec.misfire == "skip":
+            return [], next_at
+        if spec.misfire == "catch_up":
+            return missed, next_at
+        return [fire_at], next_at
+
+    async def _fire(self, schedule_id: str, fire_at: datetime):
+        entry = self._schedules.get(schedule_id)
+        if entry is None or entry["next_fire_at"] != fire_at:
+            return  # superseded by a reload
+        spec = entry["spec"]
+        now = datetime.utcnow()
+        runs, next_at = self._plan_fire(spec, fire_at, now)
+
+        update = {"next_fire_at": next_at, "fired_by": self.owner}
+        if runs:
+            update["last_fired_at"] = now
+        claimed = await self.db.workflow_schedules.update_one(
+            {"id": schedule_id, "next_fire_at": fire_at},
+            {"$set": update}
+        )
+        if claimed.modified_count != 1:
+            WORKFLOW_SCHEDULED_RUNS.labels("lost_race").inc()
+            return
+
+        entry["next_fire_at"] = next_at
+        if self._schedules.get(schedule_id) is entry:
+            self._push(schedule_id, next_at, spec)
+
+        missed = (now - fire_at).total_seconds() > self.misfire_grace
+        if not runs:
+            WORKFLOW_SCHEDULED_RUNS.labels("skipped_misfire").inc()
+            logger.info(f"Skipped misfired schedule {schedule_id} due at {fire_at.isoformat()}")
+            return
+
+        # Deactivated since the last reload on another replica
+        workflow = await self.db.workflows.find_one({"id": entry["workflow_id"]}, {"_id": 0, "status": 1})
+        if not workflow or workflow.get("status") != "active":
+            self._dirty = True
+            return
+
+        for scheduled_at in runs:
+            inputs = {**spec.inputs, "scheduled_at": scheduled_at.isoformat()}
+            await workflow_queue.enqueue(self.db, entry["workflow_id"], inputs, spec.priority)
+            WORKFLOW_SCHEDULED_RUNS.labels("misfire" if missed else "fired").inc()
+
+# Create a singleton instance
+trigger_scheduler = TriggerScheduler()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from services.leases import acquire_lease, process_owner
+
+logger = logging.getLogger(__name__)
+
+# collection -> (owner field, counter name in User.usage_stats)
+COUNTED_COLLECTIONS = {
+    "agents": ("user_id", "agent_count"),
+    "workflows": ("user_id", "workflow_count"),
+    "templates": ("created_by", "template_count"),
+    "chat_sessions": ("user_id", "session_count"),
+}
+
+RECONCILE_BATCH = 1000
+LEASE_ID = "stats_reconciler"
+
+async def increment(db: AsyncIOMotorDatabase, collection: str, user_id: Optional[str], amount: int = 1):
+    """$inc the owner's counter for a document created in (or deleted from) a collection"""
+    if not user_id or not amount:
+        return
+    _, counter = COUNTED_COLLECTIONS[collection]
+    try:
+        await db.users.update_one({"id": user_id}, {"$inc": {f"usage_stats.{counter}": amount}})
+    except Exception as e:
+        # Counters are repaired by reconciliation; never fail the write path on them
+        logger.error(f"Failed to update {counter} for user {user_id}: {str(e)}")
+
+async def increment_many(db: AsyncIOMotorDatabase, collection: str, documents: Iterable[Dict[str, Any]], sign: int = 1):
+    """Apply counter deltas for a batch of created (sign=1) or deleted (sign=-1) documents"""
+    owner_field, counter = COUNTED_COLLECTIONS[collection]
+    deltas = Counter(doc.get(owner_field) for doc in documents if doc.get(owner_field))
+    if not deltas:
+        return
+    operations = [
+        UpdateOne({"id": user_id}, {"$inc": {f"usage_stats.{counter}": sign * count}})
+        for user_id, count in deltas.items()
+    ]
+    try:
+        await db.users.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to update {counter} counters: {str(e)}")
+
+async def reconcile(db: AsyncIOMotorDatabase, user_ids: Optional[List[str]] = None) -> int:
+    """
+    Recount every counted collection and repair usage_stats counters that
+    drifted after failed increments. Users never reconciled before (no
+    usage_stats.reconciled_at) are always written, so their marker is set.
+    Returns the number of users written.
+    """
+    query = {"id": {"$in": user_ids}} if user_ids else {}
+    repaired = 0
+    batch: List[Dict[str, Any]] = []
+    async for user in db.users.find(query, {"_id": 0, "id": 1, "usage_stats": 1}):
+        batch.append(user)
+        if len(batch) >= RECONCILE_BATCH:
+            repaired += await _reconcile_batch(db, batch)
+            batch = []
+    if batch:
+        repaired += await _reconcile_batch(db, batch)
+    return repaired
+
+async def _reconcile_batch(db: AsyncIOMotorDatabase, users: List[Dict[str, Any]]) -> int:
+    # Stored counters are read before counting, and each repair only applies if
+    # they are unchanged; a user incremented meanwhile is left for the next run
+    ids = [user["id"] for user in users]
+    counts: Dict[str, Dict[str, int]] = {}
+    for collection, (owner_field, counter) in COUNTED_COLLECTIONS.items():
+        pipeline = [{"$match": {owner_field: {"$in": ids}}}, {"$group": {"_id": f"${owner_field}", "count": {"$sum": 1}}}]
+        async for row in db[collection].aggregate(pipeline):
+            counts.setdefault(row["_id"], {})[counter] = row["count"]
+
+    now = datetime.utcnow()
+    operations = []
+    for user in users:
+        stored = user.get("usage_stats") or {}
+        expected = {f"usage_stats.{counter}": stored.get(counter) for _, counter in COUNTED_COLLECTIONS.values()}
+        actual = {
+            f"usage_stats.{counter}": counts.get(user["id"], {}).get(counter, 0)
+            for _, counter in COUNTED_COLLECTIONS.values()
+        }
+        if actual != expected or "reconciled_at" not in stored:
+            operations.append(UpdateOne(
+                {"id": user["id"], **expected},
+                {"$set": {**actual, "usage_stats.reconciled_at": now}}
+            ))
+    if not operations:
+        return 0
+    result = await db.users.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+class StatsReconciler:
+    """
+    Periodically recomputes every user's usage_stats counters. Every worker
+    runs the loop, but only the holder of a Mongo lease reconciles each round.
+    """
+
+    def __init__(self):
+        self.interval = int(os.environ.get('USER_STATS_RECONCILE_SECONDS', '3600'))
+        self.owner = process_owner()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, db: AsyncIOMotorDatabase):
+        # The first round runs at startup so counters left behind by a deploy are repaired promptly
+        while True:
+            try:
+                await self.run_once(db)
+            except Exception as e:
+                logger.error(f"Usage stats reconciliation failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, db: AsyncIOMotorDatabase) -> Optional[int]:
+        """Reconcile if this worker holds the lease; None when another worker does"""
+        # Held for the whole interval, so the other workers skip this round
+        if not await acquire_lease(db, LEASE_ID, self.owner, self.interval, datetime.utcnow()):
+            return None
+        repaired = await reconcile(db)
+        logger.info(f"Reconciled usage stats, repaired {repaired} users")
+        return repaired
+
+# Create a singleton instance
+stats_reconciler = StatsReconciler()
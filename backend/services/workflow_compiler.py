@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+from typing import Dict, Any, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.workflow_engine import NODE_HANDLERS, WorkflowExecutionError, build_graph, topological_sort
+
+logger = logging.getLogger(__name__)
+
+# Bump when the plan layout changes; stored plans with another version are recompiled
+PLAN_VERSION = 1
+
+# Relative cost used for the critical path; a node can override it with config.estimated_seconds
+NODE_COSTS = {"trigger": 0.0, "condition": 0.0, "action": 1.0}
+
+def graph_fingerprint(nodes: List[Dict[str, Any]], connections: List[Dict[str, Any]]) -> str:
+    """Stable hash of the graph definition a plan was compiled from"""
+    payload = json.dumps({"nodes": nodes, "connections": connections}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _node_cost(node: Dict[str, Any]) -> float:
+    config = node.get("config", {}) or {}
+    if "estimated_seconds" in config:
+        try:
+            return max(float(config["estimated_seconds"]), 0.0)
+        except (TypeError, ValueError):
+            raise WorkflowExecutionError(f"Node {node.get('id')} has a non-numeric estimated_seconds")
+    return NODE_COSTS[node.get("type", "action")]
+
+def compile_workflow(nodes: List[Dict[str, Any]], connections: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validate a workflow graph and precompute its execution plan: topological
+    order, per-node levels, the stages of nodes that can run in parallel, and
+    the critical (most expensive) path. Raises WorkflowExecutionError for
+    unknown node types, dangling connections and cycles.
+    """
+    for node in nodes:
+        node_type = node.get("type", "action")
+        if node_type not in NODE_HANDLERS:
+            raise WorkflowExecutionError(f"Unknown node type '{node_type}' on node {node.get('id')}")
+
+    graph = build_graph(nodes, connections)
+    order = topological_sort(graph)
+    predecessors = graph["predecessors"]
+
+    levels: Dict[str, int] = {}
+    cost_to: Dict[str, float] = {}
+    via: Dict[str, Optional[str]] = {}
+    for node_id in order:
+        preds = predecessors[node_id]
+        levels[node_id] = 1 + max(levels[p] for p in preds) if preds else 0
+        slowest = max(preds, key=lambda p: cost_to[p], default=None)
+        via[node_id] = slowest
+        cost_to[node_id] = _node_cost(graph["nodes"][node_id]) + (cost_to[slowest] if slowest else 0.0)
+
+    stages: List[List[str]] = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+    for node_id in order:
+        stages[levels[node_id]].append(node_id)
+
+    critical_path = []
+    node_id = max(order, key=lambda n: cost_to[n], default=None)
+    while node_id is not None:
+        critical_path.append(node_id)
+        node_id = via[node_id]
+    critical_path.reverse()
+
+    return {
+        "version": PLAN_VERSION,
+        "fingerprint": graph_fingerprint(nodes, connections),
+        "order": order,
+        "levels": levels,
+        "stages": stages,
+        "critical_path": critical_path,
+        "critical_path_cost": cost_to[critical_path[-1]] if critical_path else 0.0,
+        "predecessors": predecessors,
+        "successors": graph["successors"]
+    }
+
+def is_current(workflow: Dict[str, Any]) -> bool:
+    """Whether the stored plan was compiled by this version from the workflow's current graph"""
+    plan = workflow.get("plan") or {}
+    return (
+        plan.get("version") == PLAN_VERSION
+        and plan.get("fingerprint") == graph_fingerprint(workflow.get("nodes", []), workflow.get("connections", []))
+    )
+
+async def load_plan(db: AsyncIOMotorDatabase, workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The workflow's stored plan, recompiling and persisting it when it is
+    missing or stale (workflows saved before plans existed, or by an older version)
+    """
+    if is_current(workflow):
+        return workflow["plan"]
+
+    plan = compile_workflow(workflow.get("nodes", []), workflow.get("connections", []))
+    await db.workflows.update_one({"id": workflow["id"]}, {"$set": {"plan": plan}})
+    logger.info(f"Recompiled execution plan for workflow {workflow['id']}")
+    return plan
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+import logging
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+from services.llm_service import llm_service
+from services.rate_limiter import admission_controller
+
+logger = logging.getLogger(__name__)
+
+NodeHandler = Callable[[Dict[str, Any], Dict[str, Any], Dict[str, Any]], Awaitable[Any]]
+
+class WorkflowExecutionError(Exception):
+    """Raised when a workflow graph cannot be executed"""
+
+class _BranchSkipped(Exception):
+    """Raised by a condition node to skip everything downstream of it"""
+
+def _node_id(node: Dict[str, Any]) -> str:
+    return str(node.get("id"))
+
+def _edge_endpoints(connection: Dict[str, Any]) -> tuple:
+    source = connection.get("source", connection.get("from"))
+    target = connection.get("target", connection.get("to"))
+    return str(source), str(target)
+
+def build_graph(nodes: List[Dict[str, Any]], connections: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Index nodes and edges into predecessor/successor maps"""
+    node_map = {}
+    for node in nodes:
+        if node.get("id") is None:
+            raise WorkflowExecutionError("Every node must have an id")
+        node_id = _node_id(node)
+        if node_id in node_map:
+            raise WorkflowExecutionError(f"Duplicate node id: {node_id}")
+        node_map[node_id] = node
+
+    predecessors = {node_id: [] for node_id in node_map}
+    successors = {node_id: [] for node_id in node_map}
+    for connection in connections:
+        source, target = _edge_endpoints(connection)
+        if source not in node_map or target not in node_map:
+            raise WorkflowExecutionError(f"Connection references unknown node: {source} -> {target}")
+        predecessors[target].append(source)
+        successors[source].append(target)
+
+    return {"nodes": node_map, "predecessors": predecessors, "successors": successors}
+
+def topological_sort(graph: Dict[str, Any]) -> List[str]:
+    """Kahn's algorithm; raises if the graph contains a cycle"""
+    in_degree = {node_id: len(preds) for node_id, preds in graph["predecessors"].items()}
+    ready = [node_id for node_id, degree in in_degree.items() if degree == 0]
+    order = []
+
+    while ready:
+        node_id = ready.pop(0)
+        order.append(node_id)
+        for successor in graph["successors"][node_id]:
+            in_degree[successor] -= 1
+            if in_degree[successor] == 0:
+                ready.append(successor)
+
+    if len(order) != len(in_degree):
+        raise WorkflowExecutionError("Workflow contains a cycle")
+    return order
+
+# Node handlers receive (node, upstream outputs keyed by node id, run context)
+
+async def _run_trigger(node: Dict[str, Any], inputs: Dict[str, Any], context: Dict[str, Any]) -> Any:
+    return context.get("inputs", {})
+
+async def _run_action(node: Dict[str, Any], inputs: Dict[str, Any], context: Dict[str, Any]) -> Any:
+    config = node.get("config", {}) or {}
+    prompt = config.get("prompt")
+    if not prompt:
+        # Integrations without a backend implementation pass their inputs through
+        return {"passthrough": True, "inputs": inputs}
+
+    upstream = "\n".join(f"[{node_id}] {output}" for node_id, output in inputs.items())
+    user_message = f"{prompt}\n\nInput:\n{upstream}" if upstream else prompt
+    # Actions spend the workflow owner's LLM budget, waiting for it rather than failing the run
+    async with admission_controller.admit(context["user_id"], context["subscription_plan"], context["admission_wait"]):
+        result = await llm_service.chat_with_agent(
+            system_prompt=config.get("system_prompt", "You are a workflow automation step."),
+            user_message=user_message
+        )
+    if not result.get("success"):
+        raise WorkflowExecutionError(f"LLM error: {result.get('error')}")
+    return result["response"]
+
+async def _run_condition(node: Dict[str, Any], inputs: Dict[str, Any], context: Dict[str, Any]) -> Any:
+    config = node.get("config", {}) or {}
+    field = config.get("field")
+    if not field:
+        return inputs
+
+    values = [output.get(field) for output in inputs.values() if isinstance(output, dict)]
+    if "equals" in config:
+        passed = any(value == config["equals"] for value in values)
+    else:
+        passed = any(value for value in values)
+    if not passed:
+        raise _BranchSkipped()
+    return inputs
+
+NODE_HANDLERS: Dict[str, NodeHandler] = {
+    "trigger": _run_trigger,
+    "action": _run_action,
+    "condition": _run_condition,
+}
+
+class WorkflowEngine:
+    """Executes a workflow DAG, running independent branches concurrently"""
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        self.max_concurrency = max_concurrency or int(os.environ.get('WORKFLOW_MAX_CONCURRENCY', '8'))
+        # How long an action node waits for admission before the node fails
+        self.admission_wait = float(os.environ.get('WORKFLOW_LLM_ADMISSION_WAIT_SECONDS', '120'))
+
+    async def execute(
+        self,
+        workflow: Dict[str, Any],
+        inputs: Optional[Dict[str, Any]] = None,
+        plan: Optional[Dict[str, Any]] = None,
+        subscription_plan: str = "free"
+    ) -> Dict[str, Any]:
+        """
+        Execute every node once all of its predecessors have finished. A compiled
+        plan (see workflow_compiler) skips re-validating and re-sorting the graph.
+        LLM calls are admitted against the owner's subscription_plan.
+        """
+        if plan is None:
+            graph = build_graph(workflow.get("nodes", []), workflow.get("connections", []))
+            order = topological_sort(graph)
+        else:
+            graph = {
+                "nodes": {_node_id(node): node for node in workflow.get("nodes", [])},
+                "predecessors": plan["predecessors"],
+                "successors": plan["successors"]
+            }
+            order = plan["order"]
+
+        context = {
+            "workflow_id": workflow.get("id"),
+            "user_id": workflow.get("user_id", "default"),
+            "subscription_plan": subscription_plan,
+            "admission_wait": self.admission_wait,
+            "inputs": inputs or {}
+        }
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        done = {node_id: asyncio.Event() for node_id in order}
+        results: Dict[str, Dict[str, Any]] = {}
+        started = time.monotonic()
+
+        async def run_node(node_id: str):
+            try:
+                for predecessor in graph["predecessors"][node_id]:
+                    await done[predecessor].wait()
+
+                predecessors = graph["predecessors"][node_id]
+                if any(results[p]["status"] != "succeeded" for p in predecessors):
+                    results[node_id] = {"status": "skipped", "output": None}
+                    return
+
+                node = graph["nodes"][node_id]
+                handler = NODE_HANDLERS.get(node.get("type", "action"))
+                if handler is None:
+                    results[node_id] = {"status": "failed", "error": f"Unknown node type: {node.get('type')}"}
+                    return
+
+                upstream = {p: results[p]["output"] for p in predecessors}
+                async with semaphore:
+                    node_started = time.monotonic()
+                    try:
+                        output = await handler(node, upstream, context)
+                        results[node_id] = {"status": "succeeded", "output": output}
+                    except _BranchSkipped:
+                        results[node_id] = {"status": "skipped", "output": None}
+                    except Exception as e:
+                        logger.error(f"Workflow node {node_id} failed: {str(e)}")
+                        results[node_id] = {"status": "failed", "error": str(e)}
+                    results[node_id]["duration"] = time.monotonic() - node_started
+            finally:
+                done[node_id].set()
+
+        await asyncio.gather(*(run_node(node_id) for node_id in order))
+
+        failed = any(result["status"] == "failed" for result in results.values())
+        sinks = [node_id for node_id in order if not graph["successors"][node_id]]
+        return {
+            "status": "failed" if failed else "succeeded",
+            "order": order,
+            "node_results": {node_id: results[node_id] for node_id in order},
+            "outputs": {node_id: results[node_id].get("output") for node_id in sinks},
+            "duration": time.monotonic() - started
+        }
+
+# Create a singleton instance
+workflow_engine = WorkflowEngine()
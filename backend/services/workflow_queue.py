@@ -0,0 +1,210 @@
+import asyncio
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from models.schemas import WorkflowRun
+from services.workflow_engine import workflow_engine, WorkflowExecutionError
+from services.workflow_compiler import load_plan
+from services.rate_limiter import resolve_plan
+
+logger = logging.getLogger(__name__)
+
+class WorkflowQueue:
+    """
+    Mongo-backed priority queue of workflow runs drained by in-process workers.
+
+    A claimed run carries a claim token and a heartbeat that its worker
+    refreshes while it executes. Any process sweeps runs whose heartbeat is
+    older than stale_after back onto the queue, so runs of a crashed worker or
+    a dead peer are recovered; writes by the original worker are conditional
+    on its token, so a reclaimed run is not finished twice.
+    """
+
+    def __init__(self):
+        self.worker_count = int(os.environ.get('WORKFLOW_WORKERS', '4'))
+        self.poll_interval = float(os.environ.get('WORKFLOW_QUEUE_POLL_SECONDS', '2'))
+        self.heartbeat_interval = float(os.environ.get('WORKFLOW_RUN_HEARTBEAT_SECONDS', '15'))
+        self.stale_after = float(os.environ.get('WORKFLOW_RUN_STALE_SECONDS', '60'))
+        self.db: Optional[AsyncIOMotorDatabase] = None
+        self._workers: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        # run id -> claim token of runs executing in this process
+        self._active: Dict[str, str] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Recover abandoned runs and start the worker pool and the stale-run sweeper"""
+        self.db = db
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+
+        await self.recover_stale()
+        self._workers = [
+            asyncio.create_task(self._worker(index)) for index in range(self.worker_count)
+        ]
+        self._sweeper = asyncio.create_task(self._sweep())
+        logger.info(f"Started {self.worker_count} workflow workers")
+
+    async def stop(self):
+        """Stop the workers and put this process's in-progress runs back on the queue"""
+        self._stopping = True
+        self._wakeup.set()
+        # Taken before cancelling: _process forgets its run as the cancellation unwinds it
+        in_flight = dict(self._active)
+        tasks = self._workers + ([self._sweeper] if self._sweeper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._sweeper = None
+
+        for run_id, token in in_flight.items():
+            await self._release(run_id, token)
+        self._active.clear()
+        logger.info("Workflow workers stopped")
+
+    async def recover_stale(self) -> int:
+        """Requeue running runs whose worker stopped heartbeating"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        recovered = await self.db.workflow_runs.update_many(
+            {"status": "running", "$or": [
+                {"heartbeat_at": {"$lt": stale_before}},
+                # Runs claimed before heartbeats existed
+                {"heartbeat_at": {"$exists": False}, "started_at": {"$lt": stale_before}}
+            ]},
+            {"$set": {"status": "queued", "started_at": None, "heartbeat_at": None, "claim_token": None}}
+        )
+        if recovered.modified_count:
+            logger.info(f"Requeued {recovered.modified_count} abandoned workflow runs")
+            self._wakeup.set()
+        return recovered.modified_count
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.stale_after / 2)
+            try:
+                await self.recover_stale()
+            except Exception as e:
+                logger.error(f"Stale workflow run sweep failed: {str(e)}")
+
+    async def _release(self, run_id: str, token: str):
+        try:
+            await self.db.workflow_runs.update_one(
+                {"id": run_id, "claim_token": token, "status": "running"},
+                {"$set": {"status": "queued", "started_at": None, "heartbeat_at": None, "claim_token": None}}
+            )
+        except Exception as e:
+            logger.error(f"Failed to requeue workflow run {run_id}: {str(e)}")
+
+    async def enqueue(
+        self,
+        db: AsyncIOMotorDatabase,
+        workflow_id: str,
+        inputs: Optional[Dict[str, Any]] = None,
+        priority: int = 0
+    ) -> WorkflowRun:
+        """Persist a queued run and wake an idle worker"""
+        run = WorkflowRun(workflow_id=workflow_id, inputs=inputs or {}, priority=priority)
+        await db.workflow_runs.insert_one(run.dict())
+        self._wakeup.set()
+        return run
+
+    async def queue_depth(self, db: AsyncIOMotorDatabase) -> int:
+        return await db.workflow_runs.count_documents({"status": "queued"})
+
+    async def _claim_next(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.db.workflow_runs.find_one_and_update(
+            {"status": "queued"},
+            {
+                "$set": {"status": "running", "started_at": now, "heartbeat_at": now, "claim_token": uuid.uuid4().hex},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self, index: int):
+        while not self._stopping:
+            try:
+                self._wakeup.clear()
+                run = await self._claim_next()
+                if run is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process(run)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Workflow worker {index} error: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _heartbeat(self, run: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.db.workflow_runs.update_one(
+                    {"id": run["id"], "claim_token": run["claim_token"], "status": "running"},
+                    {"$set": {"heartbeat_at": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Heartbeat for workflow run {run['id']} failed: {str(e)}")
+
+    async def _process(self, run: Dict[str, Any]):
+        self._active[run["id"]] = run["claim_token"]
+        heartbeat = asyncio.create_task(self._heartbeat(run))
+        try:
+            await self._execute(run)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            self._active.pop(run["id"], None)
+
+    async def _execute(self, run: Dict[str, Any]):
+        status, result, error = "failed", None, None
+        workflow = await self.db.workflows.find_one({"id": run["workflow_id"]})
+
+        if not workflow:
+            error = "Workflow not found"
+        else:
+            try:
+                plan = await load_plan(self.db, workflow)
+                subscription_plan = await resolve_plan(self.db, workflow.get("user_id"))
+                result = await workflow_engine.execute(workflow, run.get("inputs"), plan, subscription_plan)
+                status = result["status"]
+            except WorkflowExecutionError as e:
+                error = f"Invalid workflow: {str(e)}"
+            except Exception as e:
+                logger.error(f"Workflow run {run['id']} failed: {str(e)}")
+                error = str(e)
+
+        finished_at = datetime.utcnow()
+        finished = await self.db.workflow_runs.update_one(
+            {"id": run["id"], "claim_token": run["claim_token"]},
+            {"$set": {"status": status, "result": result, "error": error, "finished_at": finished_at}}
+        )
+        if not finished.matched_count:
+            # The run went stale and was requeued while this worker held it
+            logger.warning(f"Workflow run {run['id']} was reclaimed; discarding this attempt's result")
+            return
+        if workflow:
+            await self.db.workflows.update_one(
+                {"id": run["workflow_id"]},
+                {
+                    "$inc": {"execution_count": 1},
+                    "$set": {"last_execution": finished_at}
+                }
+            )
+
+# Create a singleton instance
+workflow_queue = WorkflowQueue()
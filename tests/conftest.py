@@ -0,0 +1,37 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend imports its modules top-level (services.x, models.schemas)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Never reach a real database or provider from the suite; local/* models use the echo provider
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
+os.environ.setdefault("LLM_DEFAULT_MODEL", "local/echo")
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def db():
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient()["test"]
+
+@pytest.fixture
+def client():
+    """The app with its startup/shutdown hooks, backed by an in-memory Mongo"""
+    from fastapi.testclient import TestClient
+    from mongomock_motor import AsyncMongoMockClient
+    from services.database import db_manager
+    import server
+
+    # connect() keeps an existing client, so the startup hook uses this one
+    db_manager.client = AsyncMongoMockClient()
+    db_manager.db = db_manager.client["test"]
+    with TestClient(server.app) as test_client:
+        yield test_client
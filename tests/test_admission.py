@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from services.rate_limiter import admission_controller
+from services.streaming import SSEResponse
+
+pytestmark = pytest.mark.anyio
+
+async def _frames():
+    yield "data: 1\n\n"
+    yield "data: 2\n\n"
+
+async def test_sse_response_closes_when_client_left_before_first_frame():
+    closed = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    response = SSEResponse(_frames(), on_close=lambda: closed.append(True))
+    with pytest.raises((OSError, ExceptionGroup)):
+        await response({"type": "http"}, receive, send)
+
+    assert closed == [True]
+
+async def test_sse_response_closes_once_after_streaming():
+    closed, sent = [], []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await SSEResponse(_frames(), on_close=lambda: closed.append(True))({"type": "http"}, receive, send)
+
+    assert closed == [True]
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+def test_streamed_agent_chat_releases_its_ticket(client):
+    agent = client.post("/api/agents/", json={
+        "name": "streamer", "description": "", "system_prompt": "", "model": "local/echo", "user_id": "u1"
+    }).json()
+
+    response = client.post(f"/api/agents/{agent['id']}/chat", params={"message": "hi there", "stream": "true"})
+
+    assert response.status_code == 200
+    assert "event: done" in response.text
+    assert admission_controller.upstream.active == 0
+    assert admission_controller._in_flight == {}
+
+def test_direct_chat_ignores_caller_supplied_identity(client):
+    statuses = [
+        client.post("/api/llm/chat", params={"message": "hi", "model": "local/echo", "user_id": "someone-else"}).status_code
+        for _ in range(4)
+    ]
+    assert statuses == [200, 200, 200, 429]
+
+    # A call made for an agent is limited on its owner's plan instead
+    agent = client.post("/api/agents/", json={
+        "name": "owned", "description": "", "system_prompt": "", "model": "local/echo", "user_id": "owner"
+    }).json()
+    response = client.post("/api/llm/chat", params={"message": "hi", "model": "local/echo", "agent_id": agent["id"]})
+    assert response.status_code == 200
+    assert client.post("/api/llm/chat", params={"message": "hi", "agent_id": "missing"}).status_code == 404
+
+async def test_rejected_upstream_wait_refunds_rate_budget(monkeypatch):
+    from services.rate_limiter import AdmissionController, RateLimitExceeded
+
+    controller = AdmissionController()
+    controller.plan_limits["tiny"] = {"rate": 0.001, "burst": 1, "concurrency": 5,
+                                      "plan_rate": 0.001, "plan_burst": 1, "priority": 0}
+    controller.upstream.limit = 0
+    controller.upstream.max_waiters = 0
+
+    with pytest.raises(RateLimitExceeded, match="queue is full"):
+        await controller.acquire("u", "tiny")
+
+    # The rejected call spent nothing, so the single token is still there
+    controller.upstream.limit = 1
+    ticket = await controller.acquire("u", "tiny")
+    controller.release(ticket)
+    assert controller._in_flight == {}
+
+async def test_waiting_caller_is_admitted_once_capacity_frees():
+    from services.rate_limiter import AdmissionController, RateLimitExceeded
+
+    controller = AdmissionController()
+    first = await controller.acquire("owner", "free")
+    with pytest.raises(RateLimitExceeded, match="concurrent"):
+        await controller.acquire("owner", "free")
+
+    waiter = asyncio.create_task(controller.acquire("owner", "free", max_wait=5))
+    await asyncio.sleep(0.1)
+    assert not waiter.done()
+    controller.release(first)
+
+    controller.release(await asyncio.wait_for(waiter, 5))
+    assert controller._in_flight == {}
+    assert (controller.admitted, controller.rejected) == (2, 1)
+
+async def test_workflow_actions_spend_the_owner_budget(monkeypatch):
+    from services import workflow_engine as engine_module
+    from services.llm_service import llm_service
+    from services.rate_limiter import AdmissionController
+
+    controller = AdmissionController()
+    in_flight = []
+
+    async def chat_with_agent(**kwargs):
+        in_flight.append(dict(controller._in_flight))
+        return {"success": True, "response": "done"}
+
+    monkeypatch.setattr(engine_module, "admission_controller", controller)
+    monkeypatch.setattr(llm_service, "chat_with_agent", chat_with_agent)
+    workflow = {"id": "wf", "user_id": "owner", "connections": [],
+                "nodes": [{"id": "a", "type": "action", "config": {"prompt": "go"}}]}
+
+    result = await engine_module.WorkflowEngine().execute(workflow, subscription_plan="pro")
+
+    assert result["status"] == "succeeded"
+    assert in_flight == [{"pro:owner": 1}]
+    assert controller._in_flight == {}
+
+def test_connection_check_is_admission_controlled(client, monkeypatch):
+    from routers import llm as llm_router
+    from services.rate_limiter import AdmissionController
+
+    controller = AdmissionController()
+    monkeypatch.setattr(llm_router, "admission_controller", controller)
+
+    statuses = [client.get("/api/llm/test").status_code for _ in range(4)]
+
+    assert statuses == [200, 200, 200, 429]
+    assert controller._in_flight == {}
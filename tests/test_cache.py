@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from services import cache
+from services.cache import AsyncTTLCache, ChangeStreamInvalidator
+
+pytestmark = pytest.mark.anyio
+
+class _Loader:
+    """Loader returning an incrementing version, optionally held open until released"""
+
+    def __init__(self):
+        self.version = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.version += 1
+        version = self.version
+        self.started.set()
+        await self.release.wait()
+        return {"version": version}
+
+async def test_hit_after_load():
+    ttl_cache, loader = AsyncTTLCache("test", 10, 60), _Loader()
+
+    assert await ttl_cache.get_or_load("k", loader) == {"version": 1}
+    assert await ttl_cache.get_or_load("k", loader) == {"version": 1}
+    assert ttl_cache.hits == 1
+
+@pytest.mark.parametrize("invalidate", [lambda c: c.invalidate("k"), lambda c: c.clear()])
+async def test_invalidate_during_load_skips_store(invalidate):
+    ttl_cache, loader = AsyncTTLCache("test", 10, 60), _Loader()
+    loader.release.clear()
+
+    pending = asyncio.create_task(ttl_cache.get_or_load("k", loader))
+    await loader.started.wait()
+    invalidate(ttl_cache)
+    loader.release.set()
+
+    # The overtaken caller still gets its read, but it is not cached
+    assert await pending == {"version": 1}
+    assert await ttl_cache.get_or_load("k", loader) == {"version": 2}
+    assert ttl_cache._loading == {}
+
+async def test_failed_load_leaves_no_state():
+    ttl_cache = AsyncTTLCache("test", 10, 60)
+
+    async def failing():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        await ttl_cache.get_or_load("k", failing)
+    assert ttl_cache._loading == {}
+
+class _Stream:
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for change in self.changes:
+            yield change
+        await asyncio.Event().wait()
+
+class _Collection:
+    def __init__(self, changes):
+        self.changes = changes
+        self.pipeline = None
+
+    def watch(self, pipeline, **kwargs):
+        self.pipeline = pipeline
+        return _Stream(self.changes)
+
+async def test_user_plan_change_event_evicts_cached_plan(monkeypatch):
+    monkeypatch.setattr(cache, "user_plan_cache", AsyncTTLCache("user_plans", 10, 60))
+    for user_id in ("u1", "u2"):
+        await cache.user_plan_cache.get_or_load(user_id, _Loader())
+    users = _Collection([{"operationType": "update", "fullDocument": {"id": "u1"}}])
+    invalidator = ChangeStreamInvalidator()
+
+    watch = asyncio.create_task(invalidator._watch(
+        {"users": users}, "users", cache.invalidate_user_plan, cache.user_plan_cache.clear, {"x": 1}
+    ))
+    await asyncio.sleep(0.01)
+    watch.cancel()
+
+    assert users.pipeline[0] == {"$match": {"x": 1}}
+    assert list(cache.user_plan_cache._entries) == ["u2"]
+
+async def test_agent_change_filter_ignores_metrics_only_updates(db):
+    await db.changes.insert_many([
+        {"n": 1, "operationType": "update", "updateDescription": {"updatedFields": {"performance_metrics.message_count": 2}, "removedFields": []}},
+        {"n": 2, "operationType": "update", "updateDescription": {"updatedFields": {"performance_metrics": {}}, "removedFields": []}},
+        {"n": 3, "operationType": "update", "updateDescription": {"updatedFields": {"name": "x", "performance_metrics.error_count": 1}, "removedFields": []}},
+        {"n": 4, "operationType": "update", "updateDescription": {"updatedFields": {}, "removedFields": ["tools"]}},
+        {"n": 5, "operationType": "delete"},
+    ])
+
+    matched = [change["n"] async for change in db.changes.aggregate([{"$match": cache.AGENT_CONFIG_CHANGES}])]
+
+    assert matched == [3, 4, 5]
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.chat_writer import ChatWriteBuffer
+
+pytestmark = pytest.mark.anyio
+
+def _message(index, session_id="s1", agent_id="a1", **fields):
+    return {"id": f"m{index}", "agent_id": agent_id, "session_id": session_id, "user_message": "hi",
+            "agent_response": "hello", "timestamp": datetime(2026, 1, 1) + timedelta(seconds=index),
+            "response_time": 1.0, "tokens_used": 10, **fields}
+
+async def test_flush_folds_turns_into_one_agent_metrics_update(db):
+    await db.agents.insert_one({"id": "a1", "performance_metrics": {"message_count": 1, "total_response_time": 1.0}})
+    await db.chat_sessions.insert_one({"id": "s1", "message_count": 0})
+
+    await ChatWriteBuffer()._flush(db, [(_message(1), None), (_message(2, response_time=3.0, time_to_first_token=0.5), None)])
+
+    metrics = (await db.agents.find_one({"id": "a1"}))["performance_metrics"]
+    assert metrics["message_count"] == 3
+    assert metrics["total_tokens"] == 20
+    assert metrics["avg_response_time"] == pytest.approx(5.0 / 3)
+    assert metrics["last_response_time"] == 3.0
+    assert metrics["last_time_to_first_token"] == 0.5
+    assert metrics["last_used_at"] == datetime(2026, 1, 1, 0, 0, 2)
+
+class _FlakyDatabase:
+    """Database whose bulk writes on some collections fail after (or instead of) applying"""
+
+    def __init__(self, db, failures, apply_first=True):
+        self.db = db
+        self.failures = failures
+        self.apply_first = apply_first
+
+    def __getitem__(self, name):
+        collection = self.db[name]
+        outer = self
+
+        class Collection:
+            async def bulk_write(self, operations, **kwargs):
+                if outer.failures.get(name, 0) > 0:
+                    outer.failures[name] -= 1
+                    if outer.apply_first:
+                        await collection.bulk_write(operations, **kwargs)
+                    raise ConnectionError("connection reset")
+                return await collection.bulk_write(operations, **kwargs)
+
+        return Collection()
+
+@pytest.fixture
+def writer(monkeypatch):
+    buffer = ChatWriteBuffer()
+    buffer.max_retries = 2
+    monkeypatch.setattr("services.chat_writer.backoff_delay", lambda *args: 0)
+    return buffer
+
+async def test_retried_updates_that_already_applied_count_once(db, writer):
+    await db.agents.insert_one({"id": "a1"})
+    await db.chat_sessions.insert_one({"id": "s1", "message_count": 0})
+    flaky = _FlakyDatabase(db, {"chat_messages": 1, "chat_sessions": 1, "agents": 1})
+
+    await writer._flush(flaky, [(_message(1), None), (_message(2), None)])
+
+    session = await db.chat_sessions.find_one({"id": "s1"})
+    assert session["message_count"] == 2
+    assert [turn["id"] for turn in session["recent_messages"]] == ["m1", "m2"]
+    assert (await db.agents.find_one({"id": "a1"}))["performance_metrics"]["message_count"] == 2
+    assert await db.chat_messages.count_documents({}) == 2
+
+async def test_dropped_batch_skips_persisted_callbacks(db, writer):
+    persisted = []
+    flaky = _FlakyDatabase(db, {"chat_messages": 3}, apply_first=False)
+
+    await writer._flush(flaky, [(_message(1), lambda: persisted.append("m1"))])
+
+    assert persisted == []
+    assert writer.pending_messages("s1") == []
+
+async def test_persisted_callbacks_run_after_a_successful_flush(db, writer):
+    persisted = []
+
+    await writer._flush(db, [(_message(1), lambda: persisted.append("m1"))])
+
+    assert persisted == ["m1"]
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+
+from services.cron import CronExpression
+
+@pytest.mark.parametrize("weekday, expected", [
+    ("5-7", {0, 5, 6}),
+    ("sat-sun", {0, 6}),
+    ("fri-sun", {0, 5, 6}),
+    ("7", {0}),
+    ("0,7", {0}),
+    ("1-7/2", {0, 1, 3, 5}),
+    ("mon-fri", {1, 2, 3, 4, 5}),
+    ("*", {0, 1, 2, 3, 4, 5, 6}),
+])
+def test_weekday_fields(weekday, expected):
+    assert CronExpression(f"0 0 * * {weekday}").weekdays == expected
+
+@pytest.mark.parametrize("expression", [
+    "0 0 * * 8",
+    "0 0 * * sun-sat-mon",
+    "0 0 * * 3-1",
+    "0 0 * * sat-mon",
+    "60 0 * * *",
+    "0 0 * *",
+    "*/0 * * * *",
+    "0 0 30 2 *",
+])
+def test_invalid_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+def test_weekend_range_fires_on_saturday_and_sunday():
+    cron = CronExpression("30 9 * * sat-sun")
+    friday = datetime(2026, 10, 16, 12, 0)
+
+    saturday = cron.next_after(friday)
+    sunday = cron.next_after(saturday)
+
+    assert (saturday, sunday) == (datetime(2026, 10, 17, 9, 30), datetime(2026, 10, 18, 9, 30))
+    assert cron.next_after(sunday) == datetime(2026, 10, 24, 9, 30)
+
+def test_aliases_and_steps():
+    assert CronExpression("@hourly").next_after(datetime(2026, 1, 1, 10, 15)) == datetime(2026, 1, 1, 11, 0)
+    assert CronExpression("*/15 * * * *").minutes == {0, 15, 30, 45}
+    assert CronExpression("0 0 1 jan-mar *").months == {1, 2, 3}
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from services.llm_cache import llm_cache
+from services.llm_service import LLMService
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    llm_cache.clear()
+    yield
+    llm_cache.clear()
+
+async def test_fallback_reply_is_cached_under_the_answering_model(monkeypatch):
+    service = LLMService()
+    calls = []
+
+    async def complete(messages, model):
+        calls.append(model)
+        return {"choices": [{"message": {"content": "hi"}}], "usage": {"total_tokens": 5}}, "local/fallback"
+
+    monkeypatch.setattr(service.router, "complete", complete)
+
+    first = await service.chat_with_agent("", "hello", use_cache=True, model="local/primary")
+    again = await service.chat_with_agent("", "hello", use_cache=True, model="local/primary")
+    direct = await service.chat_with_agent("", "hello", use_cache=True, model="local/fallback")
+
+    assert first["model"] == "local/fallback" and "cached" not in first
+    # The primary is retried rather than served the fallback's reply
+    assert "cached" not in again
+    assert direct["cached"] is True
+    assert calls == ["local/primary", "local/primary"]
+
+def test_cache_hit_records_no_tokens(client):
+    agent = client.post("/api/agents/", json={
+        "name": "cached", "description": "", "system_prompt": "be brief",
+        "model": "local/echo", "cache_enabled": True, "user_id": "u1"
+    }).json()
+
+    sessions = [client.post(f"/api/agents/{agent['id']}/chat", params={"message": "hello"}).json()["session_id"]
+                for _ in range(2)]
+    time.sleep(0.3)  # let the write-behind buffer flush
+
+    tokens = [
+        client.get(f"/api/agents/{agent['id']}/sessions/{session_id}/messages").json()["items"][0]["tokens_used"]
+        for session_id in sessions
+    ]
+    assert tokens[0] > 0
+    assert tokens[1] == 0
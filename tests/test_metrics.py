@@ -0,0 +1,31 @@
+from prometheus_client import REGISTRY
+
+from services import metrics
+from services.llm_service import llm_service
+
+def _requests(model):
+    return REGISTRY.get_sample_value("llm_requests_total", {"model": model, "mode": "complete", "outcome": "error"}) or 0
+
+def test_uncatalogued_models_share_the_other_label():
+    before = _requests("other")
+
+    metrics.record_llm_outcome("attacker/model-1", "complete", "error")
+    metrics.record_llm_outcome("attacker/model-2", "complete", "error")
+
+    assert _requests("other") == before + 2
+    assert REGISTRY.get_sample_value("llm_requests_total", {"model": "attacker/model-1", "mode": "complete", "outcome": "error"}) is None
+
+def test_configured_models_keep_their_label():
+    assert llm_service.router.default_model == "local/echo"
+    assert metrics.model_label("local/echo") == "local/echo"
+
+def test_router_keeps_no_stats_for_uncatalogued_models():
+    router = llm_service.router
+
+    router.record_success("attacker/model-3", 0.5)
+    router.record_failure("attacker/model-3")
+    router.record_success("local/echo", 0.1)
+
+    assert "attacker/model-3" not in router.stats
+    assert "local/echo" in router.stats
+    assert "attacker/model-3" not in router.describe()["models"]
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from services.llm_providers import LLMProvider, ModelRouter, ProviderError
+from services.resilience import HALF_OPEN, OPEN, CircuitBreaker, hedged
+
+pytestmark = pytest.mark.anyio
+
+class _Calls:
+    def __init__(self, durations):
+        self.durations = list(durations)
+        self.cancelled = 0
+
+    async def __call__(self):
+        duration = self.durations.pop(0)
+        try:
+            await asyncio.sleep(duration)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return duration
+
+@pytest.mark.parametrize("cancel_after", [0.01, 0.1])
+async def test_cancelling_the_caller_cancels_every_attempt(cancel_after):
+    calls, hedges = _Calls([10, 10]), []
+    caller = asyncio.create_task(hedged(calls, 0.05, on_hedge=lambda: hedges.append(True)))
+    await asyncio.sleep(cancel_after)
+
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    await asyncio.sleep(0)
+
+    # Before the hedge delay only the first attempt exists; after it, both do
+    assert calls.cancelled == len(hedges) + 1
+
+async def test_hedge_wins_and_the_slow_attempt_is_cancelled():
+    calls = _Calls([10, 0.01])
+
+    assert await hedged(calls, 0.02) == 0.01
+    await asyncio.sleep(0)
+    assert calls.cancelled == 1
+
+async def test_fast_first_attempt_sends_no_hedge():
+    hedges = []
+    assert await hedged(_Calls([0.01]), 1, on_hedge=lambda: hedges.append(True)) == 0.01
+    assert hedges == []
+
+class _Malformed(LLMProvider):
+    name = "malformed"
+
+    async def complete(self, model, messages):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    async def stream(self, model, messages):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        yield
+
+def _half_open_router():
+    router = ModelRouter()
+    router.max_retries = 0
+    router.fallback_models = ["local/echo"]
+    router.catalog["malformed/model"] = {"provider": "malformed", "price": 0.0, "latency": 0.0}
+    router.providers["malformed"] = _Malformed()
+    breaker = router.breakers["malformed"] = CircuitBreaker("malformed", 5, 30)
+    breaker.state = OPEN
+    breaker.opened_at = time.monotonic() - 60
+    return router, breaker
+
+async def test_unexpected_error_in_half_open_trial_settles_the_breaker():
+    router, breaker = _half_open_router()
+
+    response, model = await router.complete([{"role": "user", "content": "hi"}], model="malformed/model")
+
+    # The trial counted as a failure and the request failed over instead of raising ValueError
+    assert model == "local/echo"
+    assert breaker.state == OPEN
+    breaker.opened_at = time.monotonic() - 60
+    assert breaker.allow() and breaker.state == HALF_OPEN
+
+async def test_unexpected_error_in_half_open_stream_settles_the_breaker():
+    router, breaker = _half_open_router()
+
+    chunks = [chunk async for chunk in router.stream([{"role": "user", "content": "hi"}], model="malformed/model")]
+
+    assert {model for _, model in chunks} == {"local/echo"}
+    assert breaker.state == OPEN
+
+async def test_unexpected_error_is_raised_as_provider_error():
+    router, _ = _half_open_router()
+    router.fallback_models = []
+
+    with pytest.raises(ProviderError, match="ValueError"):
+        await router.complete([{"role": "user", "content": "hi"}], model="malformed/model")
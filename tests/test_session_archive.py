@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.history import HistoryBuilder
+from services.session_archive import SessionArchiver, read_latest_session_messages
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 1, 1)
+
+async def _session_with_turns(db, count, session_id="s1"):
+    await db.chat_sessions.insert_one({"id": session_id, "agent_id": "a1", "updated_at": START + timedelta(minutes=count)})
+    await db.chat_messages.insert_many([
+        {"id": f"m{i:02d}", "session_id": session_id, "agent_id": "a1", "user_message": f"q{i}",
+         "agent_response": f"r{i}", "timestamp": START + timedelta(minutes=i)}
+        for i in range(count)
+    ])
+    return await db.chat_sessions.find_one({"id": session_id}, {"_id": 0})
+
+@pytest.fixture
+def archiver():
+    archiver = SessionArchiver()
+    archiver.codec = "gzip"
+    archiver.segment_size = 3
+    return archiver
+
+async def test_archive_marks_an_idle_session(db, archiver):
+    session = await _session_with_turns(db, 4)
+
+    await archiver.archive_session(db, session)
+
+    assert await db.chat_messages.count_documents({}) == 0
+    assert await db.chat_archives.count_documents({}) == 2
+    assert "archived_at" in await db.chat_sessions.find_one({"id": "s1"})
+
+async def test_turn_arriving_during_archive_keeps_session_eligible(db, archiver):
+    session = await _session_with_turns(db, 4)
+    # A new turn was flushed after compaction read the session
+    await db.chat_sessions.update_one({"id": "s1"}, {"$max": {"updated_at": START + timedelta(days=1)}, "$unset": {"archived_at": ""}})
+
+    await archiver.archive_session(db, session)
+
+    assert "archived_at" not in await db.chat_sessions.find_one({"id": "s1"})
+
+async def test_latest_messages_fall_back_to_archives(db, archiver):
+    session = await _session_with_turns(db, 7)
+    await archiver.archive_session(db, session)
+    await db.chat_messages.insert_one({"id": "m07", "session_id": "s1", "user_message": "q7", "agent_response": "r7",
+                                       "timestamp": START + timedelta(minutes=7)})
+
+    latest = await read_latest_session_messages(db, "s1", 5, after=START + timedelta(minutes=3))
+
+    assert [message["id"] for message in latest] == ["m07", "m06", "m05", "m04"]
+
+async def test_history_without_embedded_turns_reads_archived_turns(db, archiver):
+    session = await _session_with_turns(db, 4)
+    await archiver.archive_session(db, session)
+
+    history = await HistoryBuilder().build(db, await db.chat_sessions.find_one({"id": "s1"}))
+
+    assert [entry["content"] for entry in history[:2]] == ["q0", "r0"]
+    assert len(history) == 8
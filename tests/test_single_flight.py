@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+async def _value(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+async def test_concurrent_callers_share_one_call():
+    flight, calls = SingleFlight(), []
+
+    async def fetch():
+        calls.append(True)
+        return await _value("v", 0.01)
+
+    assert await asyncio.gather(*(flight.do("k", fetch) for _ in range(5))) == ["v"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"upstream_calls": 1, "coalesced_calls": 4, "in_flight": 0}
+
+async def test_cancelled_waiter_does_not_cancel_the_others():
+    flight = SingleFlight()
+    leader = asyncio.create_task(flight.do("k", lambda: _value("v", 0.05)))
+    follower = asyncio.create_task(flight.do("k", lambda: _value("other")))
+    await asyncio.sleep(0.01)
+
+    leader.cancel()
+
+    assert await follower == "v"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+async def test_caller_arriving_as_the_leader_is_cancelled_starts_a_fresh_call():
+    flight = SingleFlight()
+    leader = asyncio.create_task(flight.do("k", lambda: _value("stale", 10)))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    # Scheduled right behind the leader's cancellation, before the shared task has unwound
+    follower = asyncio.create_task(flight.do("k", lambda: _value("fresh")))
+
+    assert await follower == "fresh"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert flight.stats()["in_flight"] == 0
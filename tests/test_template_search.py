@@ -0,0 +1,62 @@
+import pytest
+
+from services import template_search
+from services.template_search import build_search_pipeline, refresh_popularity, search_templates
+
+pytestmark = pytest.mark.anyio
+
+def _template(index, category="ops", tags=("a",), usage=0, rating=0.0):
+    return {"id": f"t{index:02d}", "name": f"template {index}", "description": "", "category": category,
+            "tags": list(tags), "usage_count": usage, "rating": rating}
+
+async def test_browse_pages_by_keyset_over_popularity(db):
+    await db.templates.insert_many([_template(i, usage=i) for i in range(7)])
+    assert await refresh_popularity(db) == 7
+
+    seen, cursor = [], None
+    while True:
+        page = await search_templates(db, None, {}, 3, cursor)
+        seen += [doc["id"] for doc in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [f"t{i:02d}" for i in reversed(range(7))]
+    assert page["total"] == 7
+    assert page["facets"]["category"] == [{"value": "ops", "count": 7}]
+
+async def test_browse_facets_follow_filters(db):
+    await db.templates.insert_many([_template(0, "ops", ("a", "b")), _template(1, "ops", ("b",)), _template(2, "sales")])
+    await refresh_popularity(db)
+
+    page = await search_templates(db, None, {"category": "ops"}, 10)
+
+    assert page["total"] == 2
+    assert page["facets"]["tag"] == [{"value": "b", "count": 2}, {"value": "a", "count": 1}]
+
+async def test_refresh_popularity_only_rewrites_stale_documents(db, monkeypatch):
+    await db.templates.insert_many([_template(0, usage=3), _template(1, rating=4.0)])
+    await refresh_popularity(db)
+    assert await refresh_popularity(db) == 0
+
+    monkeypatch.setattr(template_search, "RATING_WEIGHT", 1.0)
+    assert await refresh_popularity(db) == 1
+
+def test_text_search_pipeline_sorts_only_text_matches():
+    pipeline = build_search_pipeline("deploy", {"category": "ops"}, 20, 10)
+
+    assert pipeline[0] == {"$match": {"category": "ops", "$text": {"$search": "deploy"}}}
+    results = pipeline[-1]["$facet"]["results"]
+    assert {"$skip": 20} in results and {"$limit": 11} in results
+
+def test_used_templates_rise_in_browse_order(client):
+    ids = [client.post("/api/templates/", json={
+        "name": name, "description": "", "category": "ops", "created_by": "u1"
+    }).json()["id"] for name in ("first", "second")]
+
+    assert client.post(f"/api/templates/{ids[1]}/use").status_code == 200
+    page = client.get("/api/templates/search", params={"limit": 1}).json()
+
+    assert [item["id"] for item in page["items"]] == [ids[1]]
+    assert page["items"][0]["score"] > 0
+    assert page["next_cursor"] is not None
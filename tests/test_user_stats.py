@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from services import user_stats
+from services.user_stats import StatsReconciler, reconcile
+
+pytestmark = pytest.mark.anyio
+
+async def test_reconcile_repairs_drifted_and_missing_counters(db):
+    await db.users.insert_many([
+        {"id": "drifted", "usage_stats": {"agent_count": 5, "workflow_count": 0, "template_count": 0, "session_count": 0}},
+        {"id": "legacy"},
+    ])
+    await db.agents.insert_many([{"id": "a1", "user_id": "drifted"}, {"id": "a2", "user_id": "legacy"}])
+
+    assert await reconcile(db) == 2
+    assert (await db.users.find_one({"id": "drifted"}))["usage_stats"]["agent_count"] == 1
+    legacy = (await db.users.find_one({"id": "legacy"}))["usage_stats"]
+    assert legacy.pop("reconciled_at")
+    assert legacy == {"agent_count": 1, "workflow_count": 0, "template_count": 0, "session_count": 0}
+    # Nothing drifted, nothing written
+    assert await reconcile(db) == 0
+
+async def test_reconcile_keeps_increment_that_lands_mid_count(db, monkeypatch):
+    await db.users.insert_one({"id": "u", "usage_stats": {"agent_count": 0}})
+    original = user_stats._reconcile_batch
+
+    async def racing_batch(db, users):
+        # A concurrent create: the document and its $inc land after the counters were read
+        await db.agents.insert_one({"id": "a", "user_id": "u"})
+        await user_stats.increment(db, "agents", "u")
+        return await original(db, users)
+
+    monkeypatch.setattr(user_stats, "_reconcile_batch", racing_batch)
+    await reconcile(db)
+
+    assert (await db.users.find_one({"id": "u"}))["usage_stats"]["agent_count"] == 1
+
+async def test_only_the_lease_holder_reconciles(db):
+    await db.scheduler_leases.create_index("id", unique=True)
+    await db.users.insert_one({"id": "u"})
+    first, second = StatsReconciler(), StatsReconciler()
+
+    assert await first.run_once(db) == 1
+    assert await second.run_once(db) is None
+    assert await first.run_once(db) == 0
+
+def test_legacy_user_incremented_after_deploy_is_backfilled(client):
+    from services.database import db_manager
+
+    db = db_manager.db
+    client.portal.call(db.users.insert_one, {"id": "legacy", "name": "old", "email": "old@example.com"})
+    client.portal.call(db.agents.insert_many, [{"id": f"a{i}", "user_id": "legacy"} for i in range(10)])
+    # The first create after the deploy $incs a counter the user never had
+    created = client.post("/api/agents/", json={
+        "name": "new", "description": "", "system_prompt": "", "model": "local/echo", "user_id": "legacy"
+    })
+    assert created.status_code == 200
+
+    assert client.get("/api/users/legacy/stats").json()["agent_count"] == 11
+
+async def test_reconciler_runs_a_round_at_startup(db):
+    await db.users.insert_one({"id": "u"})
+    reconciler = StatsReconciler()
+    reconciler.start(db)
+    for _ in range(50):
+        if "reconciled_at" in ((await db.users.find_one({"id": "u"})).get("usage_stats") or {}):
+            break
+        await asyncio.sleep(0.01)
+    await reconciler.stop()
+
+    assert (await db.users.find_one({"id": "u"}))["usage_stats"]["agent_count"] == 0
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from services import workflow_engine as engine_module
+from services.workflow_engine import WorkflowEngine, WorkflowExecutionError, build_graph, topological_sort
+
+pytestmark = pytest.mark.anyio
+
+def _workflow(nodes, connections):
+    return {"id": "wf", "nodes": nodes, "connections": connections}
+
+def _edge(source, target):
+    return {"source": source, "target": target}
+
+@pytest.fixture
+def slow_handler(monkeypatch):
+    """An action handler that records how many nodes run at once"""
+    state = {"running": 0, "peak": 0}
+
+    async def handler(node, inputs, context):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.05)
+        state["running"] -= 1
+        if (node.get("config") or {}).get("fail"):
+            raise RuntimeError("boom")
+        return {"node": node["id"], "inputs": sorted(inputs)}
+
+    monkeypatch.setitem(engine_module.NODE_HANDLERS, "action", handler)
+    return state
+
+async def test_independent_branches_run_concurrently(slow_handler):
+    nodes = [{"id": "t", "type": "trigger"}] + [{"id": name, "type": "action"} for name in ("a", "b", "c", "join")]
+    connections = [_edge("t", "a"), _edge("t", "b"), _edge("t", "c"), _edge("a", "join"), _edge("b", "join"), _edge("c", "join")]
+
+    result = await WorkflowEngine(max_concurrency=8).execute(_workflow(nodes, connections))
+
+    assert result["status"] == "succeeded"
+    assert slow_handler["peak"] == 3
+    assert result["outputs"] == {"join": {"node": "join", "inputs": ["a", "b", "c"]}}
+
+async def test_concurrency_is_bounded(slow_handler):
+    nodes = [{"id": str(index), "type": "action"} for index in range(6)]
+
+    await WorkflowEngine(max_concurrency=2).execute(_workflow(nodes, []))
+
+    assert slow_handler["peak"] == 2
+
+async def test_failure_skips_downstream_but_not_siblings(slow_handler):
+    nodes = [
+        {"id": "bad", "type": "action", "config": {"fail": True}},
+        {"id": "after_bad", "type": "action"},
+        {"id": "good", "type": "action"},
+    ]
+
+    result = await WorkflowEngine().execute(_workflow(nodes, [_edge("bad", "after_bad")]))
+
+    assert result["status"] == "failed"
+    assert result["node_results"]["bad"]["status"] == "failed"
+    assert result["node_results"]["after_bad"]["status"] == "skipped"
+    assert result["node_results"]["good"]["status"] == "succeeded"
+
+async def test_false_condition_skips_branch(slow_handler):
+    nodes = [
+        {"id": "t", "type": "trigger"},
+        {"id": "check", "type": "condition", "config": {"field": "go", "equals": True}},
+        {"id": "act", "type": "action"},
+    ]
+
+    result = await WorkflowEngine().execute(_workflow(nodes, [_edge("t", "check"), _edge("check", "act")]), {"go": False})
+
+    assert result["status"] == "succeeded"
+    assert result["node_results"]["act"]["status"] == "skipped"
+
+def test_cycle_is_rejected():
+    graph = build_graph([{"id": "a"}, {"id": "b"}], [_edge("a", "b"), _edge("b", "a")])
+    with pytest.raises(WorkflowExecutionError, match="cycle"):
+        topological_sort(graph)
+
+def test_dangling_connection_is_rejected():
+    with pytest.raises(WorkflowExecutionError, match="unknown node"):
+        build_graph([{"id": "a"}], [_edge("a", "missing")])
+
+def test_duplicate_node_id_is_rejected():
+    with pytest.raises(WorkflowExecutionError, match="Duplicate"):
+        build_graph([{"id": "a"}, {"id": "a"}], [])
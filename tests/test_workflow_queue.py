@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.workflow_engine import workflow_engine
+from services.workflow_queue import WorkflowQueue
+
+pytestmark = pytest.mark.anyio
+
+def _queue(db, stale_after=60):
+    queue = WorkflowQueue()
+    queue.db = db
+    queue.stale_after = stale_after
+    return queue
+
+async def _insert_run(db, run_id, **fields):
+    await db.workflow_runs.insert_one({"id": run_id, "workflow_id": "wf", "priority": 0,
+                                       "created_at": datetime.utcnow(), "attempts": 1, **fields})
+
+async def test_run_with_expired_heartbeat_is_requeued(db):
+    old = datetime.utcnow() - timedelta(seconds=120)
+    await _insert_run(db, "dead", status="running", started_at=old, heartbeat_at=old, claim_token="peer")
+
+    assert await _queue(db).recover_stale() == 1
+    run = await db.workflow_runs.find_one({"id": "dead"})
+    assert run["status"] == "queued"
+    assert run["claim_token"] is None
+
+async def test_run_with_fresh_heartbeat_is_not_stolen(db):
+    now = datetime.utcnow()
+    await _insert_run(db, "live", status="running", started_at=now - timedelta(hours=1),
+                      heartbeat_at=now, claim_token="peer")
+
+    assert await _queue(db).recover_stale() == 0
+    assert (await db.workflow_runs.find_one({"id": "live"}))["status"] == "running"
+
+async def test_legacy_run_without_heartbeat_recovered_by_start_time(db):
+    await _insert_run(db, "legacy", status="running", started_at=datetime.utcnow() - timedelta(hours=1))
+
+    assert await _queue(db).recover_stale() == 1
+
+async def test_reclaimed_run_discards_late_result(db):
+    await db.workflows.insert_one({"id": "wf", "nodes": [], "connections": [], "execution_count": 0})
+    await _insert_run(db, "run", status="queued")
+    queue = _queue(db)
+
+    run = await queue._claim_next()
+    # A peer decided the run was stale and claimed it again
+    await db.workflow_runs.update_one({"id": "run"}, {"$set": {"claim_token": "peer"}})
+    await queue._process(run)
+
+    stored = await db.workflow_runs.find_one({"id": "run"})
+    assert stored["status"] == "running"
+    assert (await db.workflows.find_one({"id": "wf"}))["execution_count"] == 0
+    assert queue._active == {}
+
+async def test_stop_requeues_runs_interrupted_mid_execution(db, monkeypatch):
+    started = asyncio.Event()
+
+    async def slow_execute(workflow, inputs, plan, subscription_plan):
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(workflow_engine, "execute", slow_execute)
+    await db.workflows.insert_one({"id": "wf", "nodes": [], "connections": [], "execution_count": 0})
+    queue = _queue(db)
+    queue.worker_count = 1
+    await queue.start(db)
+    await queue.enqueue(db, "wf")
+    await asyncio.wait_for(started.wait(), 5)
+
+    await queue.stop()
+
+    run = await db.workflow_runs.find_one({"workflow_id": "wf"})
+    assert run["status"] == "queued"
+    assert run["claim_token"] is None
+    assert queue._active == {}
@@ -0,0 +1,48 @@
+NODES = [{"id": "t", "type": "trigger"}, {"id": "a", "type": "action"}]
+CONNECTIONS = [{"source": "t", "target": "a"}]
+
+def _create(client, name="flow"):
+    response = client.post("/api/workflows/", json={
+        "name": name, "description": "", "nodes": NODES, "connections": CONNECTIONS, "user_id": "u1"
+    })
+    assert response.status_code == 200
+    return response.json()
+
+def test_update_with_null_graph_keeps_the_stored_graph(client):
+    workflow = _create(client)
+
+    response = client.put(f"/api/workflows/{workflow['id']}", json={"name": "renamed", "nodes": None, "connections": None})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["name"] == "renamed"
+    assert body["nodes"] == NODES and body["connections"] == CONNECTIONS
+    assert body["plan"]["order"] == ["t", "a"]
+
+def test_update_with_null_nodes_and_new_connections_recompiles(client):
+    workflow = _create(client)
+
+    response = client.put(f"/api/workflows/{workflow['id']}", json={"nodes": None, "connections": []})
+
+    assert response.status_code == 200
+    assert response.json()["plan"]["stages"] == [["t", "a"]]
+
+def test_bulk_update_with_null_graph_fields(client):
+    first, second = _create(client, "first"), _create(client, "second")
+
+    response = client.patch("/api/workflows/bulk", json={"items": [
+        {"id": first["id"], "update": {"nodes": None}},
+        {"id": second["id"], "update": {"connections": None, "description": "updated"}},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json()["succeeded"] == 2
+    assert client.get(f"/api/workflows/{first['id']}").json()["nodes"] == NODES
+    assert client.get(f"/api/workflows/{second['id']}").json()["connections"] == CONNECTIONS
+
+def test_update_with_invalid_graph_is_rejected(client):
+    workflow = _create(client)
+
+    response = client.put(f"/api/workflows/{workflow['id']}", json={"connections": [{"source": "a", "target": "t"}, {"source": "t", "target": "a"}]})
+
+    assert response.status_code == 422